@@ -13,7 +13,6 @@ function create_database() {
 
 	    GRANT ALL ON DATABASE $database TO $POSTGRES_USER;
       GRANT ALL ON SCHEMA $POSTGRES_SCHEMA_NAME TO $POSTGRES_USER;
-      GRANT ALL ON ALL TABLES IN SCHEMA $POSTGRES_SCHEMA_NAME TO $POSTGRES_USER;
 EOSQL
 
 }
@@ -21,5 +20,5 @@ EOSQL
 if [ -n "$POSTGRES_DB_NAME" ]; then
 	echo "Database creation requested: $POSTGRES_DB_NAME"
 	create_database "$POSTGRES_DB_NAME"
-	echo "Database with table created"
+	echo "Database created, tables are created by migrations (python -m src.allocation.adapters.migrations)"
 fi
\ No newline at end of file
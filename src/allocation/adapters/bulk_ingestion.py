@@ -0,0 +1,280 @@
+"""
+Массовая загрузка партий из файла поставщика (CSV или NDJSON) в обход шины сообщений.
+
+Строки читаются потоком и пишутся пачками по chunk_size, каждая пачка - своя транзакция,
+поэтому память не зависит от размера файла. В PostgreSQL пачка уходит через COPY во временную
+таблицу, откуда одним INSERT ... SELECT попадает в batches; недостающие продукты создаются,
+а у существующих, получивших новые партии, растет version - кэш продуктов и проверка версии
+при commit видят новые партии. Партии с уже существующим reference пропускаются, из повторов
+reference в файле остается первая строка.
+
+Запуск из корня репозитория:
+    python -m src.allocation.adapters.bulk_ingestion manifest.csv
+    python -m src.allocation.adapters.bulk_ingestion manifest.ndjson --format ndjson --chunk-size 50000
+"""
+import abc
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Callable, Iterable, Iterator, List, Optional, Set, TextIO
+
+from sqlalchemy import select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+
+from src.allocation.adapters import database, orm
+from src.allocation.core.config import app_settings
+
+FORMATS = ("csv", "ndjson")
+MAX_REPORTED_ERRORS = 10
+
+
+@dataclass(frozen=True)
+class BatchRow:
+    ref: str
+    sku: str
+    qty: int
+    eta: Optional[date]
+
+
+class InvalidRow(Exception):
+    def __init__(self, line_no: int, reason: str):
+        self.line_no = line_no
+        self.reason = reason
+        self.message = 'Invalid row {}: {}'
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message.format(self.line_no, self.reason)
+
+
+@dataclass
+class IngestionReport:
+    rows: int = 0  # прочитано корректных строк
+    inserted: int = 0
+    duplicates: int = 0  # reference уже был в БД или раньше в файле
+    invalid: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+    errors: List[str] = field(default_factory=list)  # первые MAX_REPORTED_ERRORS ошибок разбора
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return dict(
+            rows=self.rows,
+            inserted=self.inserted,
+            duplicates=self.duplicates,
+            invalid=self.invalid,
+            chunks=self.chunks,
+            seconds=self.seconds,
+            rows_per_second=self.rows_per_second,
+            errors=self.errors,
+        )
+
+
+def parse_row(line_no: int, record: dict) -> BatchRow:
+    try:
+        ref, sku, qty = str(record["ref"]).strip(), str(record["sku"]).strip(), int(record["qty"])
+        eta = record.get("eta") or None
+        eta = date.fromisoformat(eta) if eta is not None else None
+    except (KeyError, TypeError, ValueError) as e:
+        raise InvalidRow(line_no, repr(e)) from e
+    if not ref or not sku or qty <= 0:
+        raise InvalidRow(line_no, "ref and sku must be non-empty, qty must be positive")
+    return BatchRow(ref, sku, qty, eta)
+
+
+def read_records(stream: TextIO, fmt: str) -> Iterator[tuple]:
+    """
+    (номер строки, запись или ошибка разбора) - построчно, без чтения файла целиком
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == "ndjson":
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as e:
+                yield line_no, InvalidRow(line_no, repr(e))
+    else:
+        raise ValueError(f"unknown format {fmt}, expected one of {FORMATS}")
+
+
+class AbstractBatchWriter(abc.ABC):
+    @abc.abstractmethod
+    def write(self, connection: Connection, rows: List[BatchRow]) -> int:
+        """
+        Пишет пачку в открытой транзакции, возвращает кол-во вставленных партий
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _bump_versions(connection: Connection, skus: Iterable[str]):
+        """
+        Новые партии - новая версия агрегата; только у продуктов, куда партии действительно добавлены,
+        иначе повторная загрузка файла зря ломала бы кэш и оптимистичные блокировки
+        """
+        skus = sorted(skus)  # строки продуктов блокируются в одном порядке у всех загрузок
+        if skus:
+            connection.execute(
+                update(orm.products).where(orm.products.c.sku.in_(skus)).values(version=orm.products.c.version + 1)
+            )
+
+
+class CopyBatchWriter(AbstractBatchWriter):
+    """
+    PostgreSQL: COPY пачки во временную таблицу и INSERT ... SELECT в batches
+    """
+    def write(self, connection: Connection, rows: List[BatchRow]) -> int:
+        connection.execute(text(
+            "CREATE TEMP TABLE IF NOT EXISTS batches_staging"
+            " (position integer, reference varchar(255), sku varchar(255), _purchased_quantity integer, eta date)"
+            " ON COMMIT DELETE ROWS"
+        ))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for position, row in enumerate(rows):
+            writer.writerow((position, row.ref, row.sku, row.qty, row.eta.isoformat() if row.eta else ""))
+        buffer.seek(0)
+        with connection.connection.cursor() as cursor:  # COPY есть только у DBAPI-курсора psycopg2
+            cursor.copy_expert(
+                "COPY batches_staging (position, reference, sku, _purchased_quantity, eta)"
+                " FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+
+        created = set(connection.execute(
+            postgresql.insert(orm.products)
+            .values([dict(sku=sku, version=0) for sku in sorted({row.sku for row in rows})])
+            .on_conflict_do_nothing(index_elements=[orm.products.c.sku])
+            .returning(orm.products.c.sku)
+        ).scalars())
+        inserted_skus = connection.execute(text(
+            "INSERT INTO batches (reference, sku, _purchased_quantity, eta)"
+            " SELECT DISTINCT ON (reference) reference, sku, _purchased_quantity, eta FROM batches_staging"
+            " ORDER BY reference, position"  # из повторов reference в пачке - первая строка файла
+            " ON CONFLICT (reference) DO NOTHING"
+            " RETURNING sku"
+        )).scalars().all()
+        self._bump_versions(connection, set(inserted_skus) - created)
+        return len(inserted_skus)
+
+
+class InsertBatchWriter(AbstractBatchWriter):
+    """
+    Без COPY (SQLite в тестах): новые строки определяются заранее запросом существующих reference
+    (RETURNING с executemany недоступен), затем executemany через INSERT ... ON CONFLICT DO NOTHING
+    """
+    def write(self, connection: Connection, rows: List[BatchRow]) -> int:
+        skus = {row.sku for row in rows}
+        existing_products = self._existing(connection, orm.products.c.sku, skus)
+        if skus - existing_products:
+            connection.execute(
+                sqlite.insert(orm.products).on_conflict_do_nothing(index_elements=[orm.products.c.sku]),
+                [dict(sku=sku, version=0) for sku in sorted(skus - existing_products)],
+            )
+        seen = self._existing(connection, orm.batches.c.reference, {row.ref for row in rows})
+        new_rows = []
+        for row in rows:  # из повторов reference в пачке - первая строка файла
+            if row.ref not in seen:
+                seen.add(row.ref)
+                new_rows.append(row)
+        if not new_rows:
+            return 0
+        inserted = connection.execute(
+            sqlite.insert(orm.batches).on_conflict_do_nothing(index_elements=[orm.batches.c.reference]),
+            [dict(reference=row.ref, sku=row.sku, _purchased_quantity=row.qty, eta=row.eta) for row in new_rows],
+        ).rowcount
+        self._bump_versions(connection, {row.sku for row in new_rows} & existing_products)
+        return inserted
+
+    @staticmethod
+    def _existing(connection: Connection, column, values: Set[str]) -> Set[str]:
+        return set(connection.execute(select(column).where(column.in_(sorted(values)))).scalars())
+
+
+def writer_for(engine: Engine) -> AbstractBatchWriter:
+    return CopyBatchWriter() if engine.dialect.name == "postgresql" else InsertBatchWriter()
+
+
+def ingest(
+    engine: Engine,
+    stream: TextIO,
+    fmt: str = "csv",
+    chunk_size: int = app_settings.bulk_ingestion_chunk_size,
+    on_chunk: Optional[Callable[[IngestionReport], None]] = None,
+) -> IngestionReport:
+    """
+    Загружает партии из stream пачками по chunk_size; on_chunk вызывается после каждой зафиксированной пачки
+    """
+    if chunk_size <= 0:  # с 0 цикл по пачкам закончился бы сразу, и загрузка "удалась" бы пустой
+        raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+    writer = writer_for(engine)
+    report = IngestionReport()
+    start = time.perf_counter()
+
+    def valid_rows() -> Iterator[BatchRow]:
+        for line_no, record in read_records(stream, fmt):
+            try:
+                if isinstance(record, InvalidRow):
+                    raise record
+                yield parse_row(line_no, record)
+            except InvalidRow as e:
+                report.invalid += 1
+                if len(report.errors) < MAX_REPORTED_ERRORS:
+                    report.errors.append(str(e))
+
+    rows = valid_rows()
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        with engine.begin() as connection:
+            inserted = writer.write(connection, chunk)
+        report.rows += len(chunk)
+        report.inserted += inserted
+        report.duplicates += len(chunk) - inserted
+        report.chunks += 1
+        report.seconds = time.perf_counter() - start
+        if on_chunk is not None:
+            on_chunk(report)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be positive, got {value}")
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="файл с партиями, '-' - stdin")
+    parser.add_argument("--format", choices=FORMATS, help="по умолчанию - по расширению файла, иначе csv")
+    parser.add_argument("--chunk-size", type=positive_int, default=app_settings.bulk_ingestion_chunk_size)
+    parser.add_argument("--database-url", help="по умолчанию - из настроек postgres_*")
+    args = parser.parse_args()
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+
+    engine = database.create_db_engine(args.database_url)
+    progress = lambda r: print(f"{r.rows} rows, {r.rows_per_second:.0f} rows/s", file=sys.stderr)
+    stream = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    with stream:
+        report = ingest(engine, stream, fmt, args.chunk_size, on_chunk=progress)
+    print(json.dumps(report.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
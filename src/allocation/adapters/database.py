@@ -0,0 +1,129 @@
+"""
+Engine БД с настраиваемым и наблюдаемым пулом соединений.
+
+Размеры пула, таймауты, recycle и pre-ping берутся из DatabaseSettings (config.get_engine_options);
+пул считает, сколько соединения ждали при выдаче, сколько раз ожидание кончилось TimeoutError
+и сколько соединений было занято одновременно - pool_status(engine) отдает срез этих данных.
+"""
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Union
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from src.allocation.core import config
+
+
+class PoolStats:
+    """
+    Счетчики выдачи соединений; ожидания последних recent_size выдач хранятся для перцентилей
+    """
+    def __init__(self, recent_size: int = 1024):
+        self._lock = threading.Lock()
+        self._recent_waits = deque(maxlen=recent_size)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0  # секунды
+        self.wait_max = 0.0
+        self.in_use_max = 0
+
+    def record(self, wait: float, in_use: int, timed_out: bool = False):
+        with self._lock:
+            self._recent_waits.append(wait)
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.in_use_max = max(self.in_use_max, in_use)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            recent = sorted(self._recent_waits)
+            requests = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "in_use_max": self.in_use_max,
+                "wait_mean_ms": self.wait_total / requests * 1e3 if requests else 0.0,
+                "wait_max_ms": self.wait_max * 1e3,
+                "wait_p50_ms": statistics.median(recent) * 1e3 if recent else 0.0,
+                "wait_p95_ms": recent[int(len(recent) * 0.95)] * 1e3 if recent else 0.0,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool, замеряющий время получения соединения (ожидание в очереди + открытие нового соединения)
+    """
+    def __init__(self, *args, max_overflow: int = 10, **kwargs):
+        super().__init__(*args, max_overflow=max_overflow, **kwargs)
+        self.max_overflow = max_overflow  # как настроено; у QueuePool оно только в приватном атрибуте
+        self.stats = PoolStats()
+
+    def recreate(self):
+        # engine.dispose() пересоздает пул - статистика продолжается
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - start, self.checkedout(), timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start, self.checkedout())
+        return connection
+
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """
+    То же для async engine: очередь пула на asyncio
+    """
+
+
+def create_db_engine(uri: Optional[str] = None, **overrides) -> Engine:
+    """
+    Engine с InstrumentedQueuePool и настройками пула из DatabaseSettings; overrides - любые аргументы create_engine
+    """
+    options = {"poolclass": InstrumentedQueuePool, **config.get_engine_options(), **overrides}
+    return create_engine(uri or config.get_postgres_uri(), **options)
+
+
+def create_async_db_engine(uri: Optional[str] = None, **overrides) -> AsyncEngine:
+    """
+    AsyncEngine (по умолчанию asyncpg) с теми же настройками пула. asyncpg готовит запросы на сервере
+    и держит их в кэше соединения - повторный запрос с тем же SQL не разбирается и не планируется заново
+    """
+    url = make_url(uri or config.get_postgres_async_uri())
+    options = {"poolclass": InstrumentedAsyncAdaptedQueuePool, **config.get_engine_options(), **overrides}
+    if url.get_driver_name() == "asyncpg":
+        options["connect_args"] = {
+            "prepared_statement_cache_size": config.db_settings.prepared_statement_cache_size,
+            **options.get("connect_args", {}),
+        }
+    return create_async_engine(url, **options)
+
+
+def pool_status(engine: Union[Engine, AsyncEngine]) -> Dict:
+    pool = engine.sync_engine.pool if isinstance(engine, AsyncEngine) else engine.pool
+    status = {"pool_class": type(pool).__name__}
+    if not isinstance(pool, QueuePool):  # например, StaticPool у SQLite в памяти
+        return status
+    status.update(
+        size=pool.size(),
+        in_use=pool.checkedout(),
+        idle=pool.checkedin(),
+        overflow=max(pool.overflow(), 0),  # отрицательно, пока постоянные соединения не открыты
+    )
+    if isinstance(pool, InstrumentedQueuePool):
+        status.update(max_overflow=pool.max_overflow, **pool.stats.snapshot())
+    return status
@@ -0,0 +1,136 @@
+"""
+Версионные миграции схемы БД.
+
+Примененные версии хранятся в таблице schema_migrations, каждая миграция идемпотентна
+(проверяет текущее состояние схемы), поэтому запуск безопасен при старте любого сервиса.
+
+Запуск из корня репозитория:
+    python -m src.allocation.adapters.migrations          # применить недостающие миграции
+    python -m src.allocation.adapters.migrations --list   # показать состояние
+"""
+import argparse
+import logging
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from src.allocation.adapters import orm
+from src.allocation.core import config
+from src.allocation.helpers.utils import wait_for_postgres_to_come_up
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_LOCK_KEY = 20230401  # ключ pg_advisory_xact_lock: миграции не запускаются параллельно
+
+migrations_metadata = MetaData(schema=orm.metadata.schema)
+
+schema_migrations = Table(
+    "schema_migrations",
+    migrations_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False, server_default=func.now()),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+def _create_tables(connection: Connection):
+    orm.metadata.create_all(connection, checkfirst=True)
+
+
+def _create_hot_query_indexes(connection: Connection):
+    # на уже существующих таблицах create_all индексы не добавляет
+    for index in orm.hot_query_indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _add_allocations_view_primary_key(connection: Connection):
+    pk = inspect(connection).get_pk_constraint(orm.allocations_view.name, schema=orm.metadata.schema)
+    if pk["constrained_columns"]:
+        return
+    # до миграции в представление могли попасть повторы (order_id, sku) - оставляем последнюю строку
+    connection.execute(text(
+        "DELETE FROM allocations_view a USING allocations_view b"
+        " WHERE a.ctid < b.ctid AND a.order_id = b.order_id AND a.sku = b.sku"
+    ))
+    connection.execute(text("ALTER TABLE allocations_view ADD PRIMARY KEY (order_id, sku)"))
+
+
+def _create_archive_tables(connection: Connection):
+    for table in (orm.batches_archive, orm.order_lines_archive, orm.allocations_archive):
+        table.create(connection, checkfirst=True)
+    for index in orm.archival_indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _create_outbox(connection: Connection):
+    orm.outbox.create(connection, checkfirst=True)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "create tables", _create_tables),
+    Migration(2, "indexes for repository and view queries", _create_hot_query_indexes),
+    Migration(3, "primary key on allocations_view (order_id, sku)", _add_allocations_view_primary_key),
+    Migration(4, "archive tables for closed batches", _create_archive_tables),
+    Migration(5, "outbox for events published to Redis", _create_outbox),
+]
+
+
+def applied_versions(connection: Connection) -> Set[int]:
+    return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def migrate(engine: Optional[Engine] = None) -> List[Migration]:
+    """
+    Применяет недостающие миграции в одной транзакции; возвращает примененные
+    """
+    engine = engine or create_engine(config.get_postgres_uri())
+    applied = []
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), dict(key=MIGRATIONS_LOCK_KEY))
+        migrations_metadata.create_all(connection, checkfirst=True)
+        done = applied_versions(connection)
+        for migration in MIGRATIONS:
+            if migration.version in done:
+                continue
+            logger.info("applying migration %s: %s", migration.version, migration.description)
+            migration.apply(connection)
+            connection.execute(
+                schema_migrations.insert().values(version=migration.version, description=migration.description)
+            )
+            applied.append(migration)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--list", action="store_true", help="показать примененные и ожидающие миграции")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    engine = create_engine(config.get_postgres_uri())
+    wait_for_postgres_to_come_up(engine)  # контейнер api может стартовать раньше, чем БД примет соединения
+    if args.list:
+        with engine.begin() as connection:
+            migrations_metadata.create_all(connection, checkfirst=True)
+            done = applied_versions(connection)
+        for migration in MIGRATIONS:
+            status = "applied" if migration.version in done else "pending"
+            print(f"{migration.version:>4}  {status:<8} {migration.description}")
+        return
+
+    applied = migrate(engine)
+    print(f"applied {len(applied)} migration(s)")
+
+
+if __name__ == "__main__":
+    main()
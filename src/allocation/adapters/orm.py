@@ -1,4 +1,6 @@
-from sqlalchemy import Table, Column, Integer, String, Date, ForeignKey, event
+from datetime import datetime
+
+from sqlalchemy import Table, Column, Integer, String, Text, Date, DateTime, ForeignKey, Index, event, func
 from sqlalchemy.orm import registry, relationship
 
 from src.allocation.models import domain
@@ -45,11 +47,65 @@ allocations = Table(
 allocations_view = Table(
     "allocations_view",
     metadata,
-    Column("order_id", String(255)),
-    Column("sku", String(255)),
+    Column("order_id", String(255), primary_key=True),
+    Column("sku", String(255), primary_key=True),
     Column("batchref", String(255)),
 )
 
+# архив закрытых партий (Product.archive_closed_batches) вместе с их размещениями и позициями;
+# без внешних ключей - строки только копируются сюда из рабочих таблиц
+batches_archive = Table(
+    "batches_archive",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("reference", String(255)),
+    Column("sku", String(255)),
+    Column("_purchased_quantity", Integer, nullable=False),
+    Column("eta", Date, nullable=True),
+    Column("archived_at", DateTime, nullable=False, server_default=func.now()),
+)
+
+order_lines_archive = Table(
+    "order_lines_archive",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("sku", String(255)),
+    Column("qty", Integer, nullable=False),
+    Column("orderid", String(255)),
+)
+
+allocations_archive = Table(
+    "allocations_archive",
+    metadata,
+    Column("orderline_id", Integer, primary_key=True),
+    Column("batch_id", Integer, primary_key=True),
+)
+
+# transactional outbox: события для Redis пишутся в одной транзакции с изменением продукта,
+# adapters/outbox.OutboxRelay публикует их пачками и удаляет
+outbox = Table(
+    "outbox",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("channel", String(255), nullable=False),
+    Column("payload", Text, nullable=False),  # JSON события
+    Column("created_at", DateTime, nullable=False, default=datetime.utcnow),  # UTC, для лага публикации
+)
+
+# индексы под горячие запросы; на существующей БД их создают миграции (adapters/migrations.py)
+hot_query_indexes = [
+    Index("ux_batches_reference", batches.c.reference, unique=True),  # get_by_batchref
+    Index("ix_batches_sku", batches.c.sku),  # загрузка партий продукта
+    Index("ix_order_lines_orderid_sku", order_lines.c.orderid, order_lines.c.sku),
+    Index("ux_allocations_orderline_id_batch_id", allocations.c.orderline_id, allocations.c.batch_id, unique=True),
+    Index("ix_allocations_batch_id", allocations.c.batch_id),  # загрузка размещений партий
+]
+
+# поиск закрытых партий для архивации
+archival_indexes = [
+    Index("ix_batches_eta", batches.c.eta),
+]
+
 
 def start_mappers():
     """
@@ -61,14 +117,35 @@ def start_mappers():
         batches,
         properties={
             "_allocations": relationship(
-                lines_mapper, secondary=allocations, collection_class=set,
+                lines_mapper,
+                secondary=allocations,
+                collection_class=domain.AllocationSet,
+                order_by=allocations.c.id,  # порядок размещения нужен политикам вытеснения
             )
         },
     )
-    mapper_registry.map_imperatively(domain.Product, products, properties={"batches": relationship(batches_mapper)})
+    mapper_registry.map_imperatively(
+        domain.Product,
+        products,
+        properties={"batches": relationship(batches_mapper)},
+        # UPDATE products ... WHERE version = <прочитанная версия>; новую версию выставляет сам агрегат
+        version_id_col=products.c.version,
+        version_id_generator=False,
+    )
 
 
 @event.listens_for(domain.Product, "load")
 def receive_load(product, _):
     product.events = []
+    product._reset_indexes()
+
+
+@event.listens_for(domain.Batch, "load")
+@event.listens_for(domain.Batch, "refresh")
+def receive_batch_load(batch, *_):
+    """
+    SQLAlchemy не вызывает __init__ и заполняет _allocations сам,
+    поэтому сбрасываем счетчик размещенного кол-ва: он пересчитается при первом обращении
+    """
+    batch._allocated_quantity = None
 
@@ -0,0 +1,128 @@
+"""
+Transactional outbox для событий, публикуемых в Redis.
+
+UoW при commit пишет события из OUTBOX_CHANNELS в таблицу outbox той же транзакцией, что и изменения
+продукта, поэтому событие не теряется и не публикуется без зафиксированного изменения. OutboxRelay
+(entrypoints/outbox_relay.py) забирает строки пачками, публикует их через Redis pipeline одним round trip
+и удаляет. Доставка - at least once: если удаление не зафиксировалось, пачка будет опубликована снова.
+"""
+import json
+import threading
+from dataclasses import asdict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Type
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.engine import Connection, Engine
+
+from src.allocation.adapters import orm
+from src.allocation.models import domain, events
+
+# события, которые публикуются в Redis, и их каналы
+OUTBOX_CHANNELS: Dict[Type[events.Event], str] = {
+    events.Allocated: "line_allocated",
+}
+
+
+class Outbox:
+    """
+    Отбирает у продуктов события для публикации и готовит строки outbox; сами события остаются
+    у продуктов - их, как обычно, заберет шина через collect_new_events
+    """
+    def __init__(self, channels: Optional[Dict[Type[events.Event], str]] = None):
+        self.channels = OUTBOX_CHANNELS if channels is None else channels
+
+    def rows(self, products: Iterable[domain.Product], staged: set) -> List[Dict]:
+        """
+        staged - id уже записанных событий: при нескольких commit в одном uow событие пишется один раз
+        """
+        rows = []
+        for product in products:
+            for event in product.events:
+                channel = self.channels.get(type(event))
+                if channel is None or id(event) in staged:
+                    continue
+                staged.add(id(event))
+                rows.append(dict(channel=channel, payload=json.dumps(asdict(event))))
+        return rows
+
+
+class RelayStats:
+    """
+    Счетчики релея; lag - сколько самое старое событие пачки ждало публикации
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.published = 0
+        self.batches = 0
+        self.lag_last = 0.0  # секунды
+        self.lag_max = 0.0
+
+    def record(self, published: int, lag: float):
+        with self._lock:
+            self.published += published
+            self.batches += 1
+            self.lag_last = lag
+            self.lag_max = max(self.lag_max, lag)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "published": self.published,
+                "batches": self.batches,
+                "lag_last_ms": self.lag_last * 1e3,
+                "lag_max_ms": self.lag_max * 1e3,
+            }
+
+
+class OutboxRelay:
+    def __init__(
+        self,
+        engine: Engine,
+        publish_many: Callable[[List[Tuple[str, str]]], None],
+        batch_size: int = 500,
+        flush_interval: float = 0.1,
+    ):
+        self.engine = engine
+        self.publish_many = publish_many
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # секунды паузы, когда outbox разобран
+        self.stats = RelayStats()
+
+    def relay_batch(self) -> int:
+        """
+        Публикует и удаляет одну пачку, возвращает ее размер. В PostgreSQL строки берутся
+        FOR UPDATE SKIP LOCKED - несколько релеев не публикуют одну пачку дважды
+        """
+        statement = (
+            select(orm.outbox).order_by(orm.outbox.c.id).limit(self.batch_size).with_for_update(skip_locked=True)
+        )
+        with self.engine.begin() as connection:
+            rows = connection.execute(statement).all()
+            if not rows:
+                return 0
+            self.publish_many([(row.channel, row.payload) for row in rows])
+            connection.execute(delete(orm.outbox).where(orm.outbox.c.id.in_([row.id for row in rows])))
+        oldest = min(row.created_at for row in rows)
+        self.stats.record(len(rows), (datetime.utcnow() - oldest).total_seconds())
+        return len(rows)
+
+    def run(self, stop: Optional[threading.Event] = None):
+        """
+        Разбирает outbox, пока есть полные пачки; затем ждет flush_interval. stop - для остановки из другого потока
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            if self.relay_batch() < self.batch_size:
+                stop.wait(self.flush_interval)
+
+
+def outbox_status(connection: Connection) -> Dict:
+    """
+    Сколько событий ждут публикации и возраст самого старого - лаг, который еще не разобран релеем
+    """
+    pending, oldest = connection.execute(select(func.count(), func.min(orm.outbox.c.created_at))).one()
+    return {
+        "pending": pending,
+        "oldest_age_ms": (datetime.utcnow() - oldest).total_seconds() * 1e3 if oldest is not None else 0.0,
+    }
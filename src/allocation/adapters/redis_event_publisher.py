@@ -4,6 +4,8 @@ Event publisher to Redis
 import json
 import logging
 from dataclasses import asdict
+from typing import Iterable, Tuple
+
 import redis
 
 from src.allocation.core import config
@@ -17,3 +19,13 @@ r = redis.Redis(**config.get_redis_host_and_port())
 def publish(channel, event: events.Event):
     logging.info("publishing: channel=%s, event=%s", channel, event)
     r.publish(channel, json.dumps(asdict(event)))
+
+
+def publish_many(messages: Iterable[Tuple[str, str]]):
+    """
+    Публикует уже сериализованные (channel, payload) одним round trip через pipeline
+    """
+    pipe = r.pipeline(transaction=False)
+    for channel, payload in messages:
+        pipe.publish(channel, payload)
+    pipe.execute()
@@ -1,8 +1,16 @@
 import abc
+import enum
+import functools
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, select, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapper, Session, selectinload, joinedload
+from sqlalchemy.sql import Select
 
+from src.allocation.adapters import orm
 from src.allocation.models import domain
 
 
@@ -29,10 +37,37 @@ class AbstractRepository(abc.ABC):
             self.seen.add(product)
         return product
 
+    def get_many(self, skus: Iterable[str]) -> List[domain.Product]:
+        """
+        Найденные продукты по списку артикулов (порядок не гарантируется), отсутствующие пропускаются
+        """
+        products = self._get_many(set(skus))
+        self.seen.update(products)
+        return products
+
+    def get_many_by_batchrefs(self, batchrefs: Iterable[str]) -> List[domain.Product]:
+        """
+        Продукты, которым принадлежат партии; каждый продукт - один раз
+        """
+        products = self._get_many_by_batchrefs(set(batchrefs))
+        self.seen.update(products)
+        return products
+
+    def archive(self, batches: List[domain.Batch]):
+        """
+        Переносит в архив партии, убранные из агрегата (Product.archive_closed_batches), с их размещениями
+        """
+        if batches:
+            self._archive(batches)
+
     @abc.abstractmethod
     def _add(self, product: domain.Product):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def _archive(self, batches: List[domain.Batch]):
+        raise NotImplementedError
+
     @abc.abstractmethod
     def _get(self, sku) -> domain.Product:
         raise NotImplementedError
@@ -41,28 +76,364 @@ class AbstractRepository(abc.ABC):
     def _get_by_batchref(self, batchref) -> domain.Product:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def _get_many(self, skus: set) -> List[domain.Product]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _get_many_by_batchrefs(self, batchrefs: set) -> List[domain.Product]:
+        raise NotImplementedError
+
+
+class LoadingStrategy(str, enum.Enum):
+    """
+    Как SqlAlchemyRepository загружает партии и размещения продукта
+    """
+    SELECTIN = "selectin"  # продукт, партии и размещения - по запросу на уровень (3 запроса)
+    JOINED = "joined"  # весь граф одним запросом через LEFT OUTER JOIN
+    AGGREGATE_ONLY = "aggregate_only"  # только строка products, остальное лениво при обращении (N+1)
+
+
+def product_by_sku():
+    return select(domain.Product).where(domain.Product.sku == bindparam("sku"))
+
+
+def product_by_batchref():
+    return select(domain.Product).join(domain.Batch).where(domain.Batch.reference == bindparam("batchref"))
+
+
+def products_by_skus():
+    return select(domain.Product).where(domain.Product.sku.in_(bindparam("skus", expanding=True)))
+
+
+def products_by_batchrefs():
+    return (
+        select(domain.Product).join(domain.Batch)
+        .where(domain.Batch.reference.in_(bindparam("batchrefs", expanding=True)))
+    )
+
+
+def product_versions_by_skus():
+    return (
+        select(domain.Product.sku, domain.Product.version)
+        .where(domain.Product.sku.in_(bindparam("skus", expanding=True)))
+    )
+
+
+def product_versions_by_batchrefs():
+    return (
+        select(domain.Product.sku, domain.Product.version).distinct()
+        .join(domain.Batch, domain.Batch.sku == domain.Product.sku)
+        .where(domain.Batch.reference.in_(bindparam("batchrefs", expanding=True)))
+    )
+
+
+def with_loading_strategy(statement, strategy: LoadingStrategy):
+    if strategy == LoadingStrategy.SELECTIN:
+        return statement.options(selectinload(domain.Product.batches).selectinload(domain.Batch._allocations))
+    if strategy == LoadingStrategy.JOINED:
+        return statement.options(joinedload(domain.Product.batches).joinedload(domain.Batch._allocations))
+    return statement
+
+
+def cached_statement(builder: Callable[[], Select], strategy: Optional[LoadingStrategy] = None) -> Select:
+    """
+    Выражение запроса (значения - через bindparam) строится один раз, а не на каждый вызов:
+    повторно используется и сам объект, и его ключ кэша скомпилированного SQL.
+    Маппер входит в ключ, т.к. тесты пересоздают маппинг (clear_mappers/start_mappers)
+    """
+    return _cached_statement(builder, strategy, inspect(domain.Product))
+
+
+@functools.lru_cache(maxsize=128)
+def _cached_statement(builder: Callable[[], Select], strategy: Optional[LoadingStrategy], mapper: Mapper) -> Select:
+    statement = builder()
+    return statement if strategy is None else with_loading_strategy(statement, strategy)
+
 
 class SqlAlchemyRepository(AbstractRepository):
     """
     Репозиторий для реального использования
     """
-    def __init__(self, session: Session):
+    def __init__(self, session: Session, loading_strategy: LoadingStrategy = LoadingStrategy.SELECTIN):
         super().__init__()
         self.session = session
+        self.loading_strategy = LoadingStrategy(loading_strategy)
 
     def _add(self, product: domain.Product):
         self.session.add(product)
 
+    def _archive(self, batches: List[domain.Batch]):
+        # копии строк берутся из объектов: при autoflush рабочие строки уже могут быть удалены
+        lines = [(batch, line) for batch in batches for line in batch.allocations]
+        self.session.execute(orm.batches_archive.insert(), [
+            dict(id=b.id, reference=b.reference, sku=b.sku, _purchased_quantity=b._purchased_quantity, eta=b.eta)
+            for b in batches
+        ])
+        if lines:
+            self.session.execute(orm.order_lines_archive.insert(), [
+                dict(id=line.id, sku=line.sku, qty=line.qty, orderid=line.orderid) for _, line in lines
+            ])
+            self.session.execute(orm.allocations_archive.insert(), [
+                dict(orderline_id=line.id, batch_id=batch.id) for batch, line in lines
+            ])
+        # строки allocations удаляются вместе с партией (secondary), order_lines - явно
+        for batch, line in lines:
+            self.session.delete(line)
+        for batch in batches:
+            self.session.delete(batch)
+
     def _get(self, sku) -> domain.Product:
         res = self.session.execute(
-            select(domain.Product).where(domain.Product.sku == sku)
-        ).scalars().first()
+            self._statement(product_by_sku), dict(sku=sku)
+        ).unique().scalars().first()
 
         return res
 
     def _get_by_batchref(self, batchref) -> domain.Product:
         res = self.session.execute(
-            select(domain.Product).join(domain.Batch).where(domain.Batch.reference == batchref)
-        ).scalars().first()
+            self._statement(product_by_batchref), dict(batchref=batchref)
+        ).unique().scalars().first()
 
         return res
+
+    def _get_many(self, skus: set) -> List[domain.Product]:
+        if not skus:
+            return []
+        return self.session.execute(
+            self._statement(products_by_skus), dict(skus=list(skus))
+        ).unique().scalars().all()
+
+    def _get_many_by_batchrefs(self, batchrefs: set) -> List[domain.Product]:
+        if not batchrefs:
+            return []
+        return self.session.execute(
+            self._statement(products_by_batchrefs), dict(batchrefs=list(batchrefs))
+        ).unique().scalars().all()
+
+    def _statement(self, builder: Callable[[], Select], strategy: LoadingStrategy = None) -> Select:
+        return cached_statement(builder, strategy or self.loading_strategy)
+
+
+class AbstractAsyncRepository(abc.ABC):
+    """
+    Асинхронный вариант AbstractRepository: чтение из БД - корутины, add, как и в Session, синхронный
+    """
+    def __init__(self):
+        self.seen = set()  # type Set[model.Product]
+
+    def add(self, product: domain.Product):
+        self._add(product)
+        self.seen.add(product)
+
+    async def get(self, sku) -> domain.Product:
+        product = await self._get(sku)
+        if product:
+            self.seen.add(product)
+        return product
+
+    async def get_by_batchref(self, batchref) -> domain.Product:
+        product = await self._get_by_batchref(batchref)
+        if product:
+            self.seen.add(product)
+        return product
+
+    async def get_many(self, skus: Iterable[str]) -> List[domain.Product]:
+        products = await self._get_many(set(skus))
+        self.seen.update(products)
+        return products
+
+    async def get_many_by_batchrefs(self, batchrefs: Iterable[str]) -> List[domain.Product]:
+        products = await self._get_many_by_batchrefs(set(batchrefs))
+        self.seen.update(products)
+        return products
+
+    @abc.abstractmethod
+    def _add(self, product: domain.Product):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def _get(self, sku) -> domain.Product:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def _get_by_batchref(self, batchref) -> domain.Product:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def _get_many(self, skus: set) -> List[domain.Product]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def _get_many_by_batchrefs(self, batchrefs: set) -> List[domain.Product]:
+        raise NotImplementedError
+
+
+class AsyncSqlAlchemyRepository(AbstractAsyncRepository):
+    """
+    Репозиторий поверх AsyncSession. Ленивой загрузки в async нет (обращение к незагруженной
+    связи падает с MissingGreenlet), поэтому AGGREGATE_ONLY заменяется на SELECTIN
+    """
+    def __init__(self, session: AsyncSession, loading_strategy: LoadingStrategy = LoadingStrategy.SELECTIN):
+        super().__init__()
+        self.session = session
+        loading_strategy = LoadingStrategy(loading_strategy)
+        if loading_strategy == LoadingStrategy.AGGREGATE_ONLY:
+            loading_strategy = LoadingStrategy.SELECTIN
+        self.loading_strategy = loading_strategy
+
+    def _add(self, product: domain.Product):
+        self.session.add(product)
+
+    async def _get(self, sku) -> domain.Product:
+        result = await self.session.execute(
+            cached_statement(product_by_sku, self.loading_strategy), dict(sku=sku)
+        )
+        return result.unique().scalars().first()
+
+    async def _get_by_batchref(self, batchref) -> domain.Product:
+        result = await self.session.execute(
+            cached_statement(product_by_batchref, self.loading_strategy), dict(batchref=batchref)
+        )
+        return result.unique().scalars().first()
+
+    async def _get_many(self, skus: set) -> List[domain.Product]:
+        if not skus:
+            return []
+        result = await self.session.execute(
+            cached_statement(products_by_skus, self.loading_strategy), dict(skus=list(skus))
+        )
+        return result.unique().scalars().all()
+
+    async def _get_many_by_batchrefs(self, batchrefs: set) -> List[domain.Product]:
+        if not batchrefs:
+            return []
+        result = await self.session.execute(
+            cached_statement(products_by_batchrefs, self.loading_strategy), dict(batchrefs=list(batchrefs))
+        )
+        return result.unique().scalars().all()
+
+
+class ProductCache:
+    """
+    Общий для всех UoW in-process кэш продуктов по артикулу: LRU с ограничением
+    по кол-ву продуктов и по "весу" (продукт + партии + размещения ~ строки в БД).
+    Хранит отсоединенные от сессии (detached) продукты вместе с версией, при которой они были прочитаны
+    """
+    def __init__(self, max_products: int = 1024, max_weight: int = 1_000_000):
+        self.max_products = max_products
+        self.max_weight = max_weight
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._weight = 0
+        self._products = OrderedDict()  # type OrderedDict[str, Tuple[int, domain.Product, int]]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _weight_of(product: domain.Product) -> int:
+        return 1 + len(product.batches) + sum(len(b.allocations) for b in product.batches)
+
+    def get(self, sku: str, version: int) -> Optional[domain.Product]:
+        with self._lock:
+            entry = self._products.get(sku)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._products.move_to_end(sku)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, product: domain.Product):
+        weight = self._weight_of(product)
+        with self._lock:
+            self._discard(product.sku)
+            if weight > self.max_weight:
+                return
+            self._products[product.sku] = (product.version, product, weight)
+            self._weight += weight
+            while len(self._products) > self.max_products or self._weight > self.max_weight:
+                self._discard(next(iter(self._products)))
+                self.evictions += 1
+
+    def _discard(self, sku: str):
+        entry = self._products.pop(sku, None)
+        if entry is not None:
+            self._weight -= entry[2]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                size=len(self._products),
+                weight=self._weight,
+            )
+
+
+class CachingSqlAlchemyRepository(SqlAlchemyRepository):
+    """
+    Репозиторий с кэшем продуктов: на каждый get одним легким запросом читаем products.version
+    и перечитываем весь граф продукта только если версия сдвинулась
+    """
+    def __init__(
+        self,
+        session: Session,
+        cache: ProductCache,
+        loading_strategy: LoadingStrategy = LoadingStrategy.SELECTIN,
+    ):
+        super().__init__(session, loading_strategy)
+        self.cache = cache
+
+    def _get(self, sku) -> domain.Product:
+        return next(iter(self._get_many({sku})), None)
+
+    def _get_by_batchref(self, batchref) -> domain.Product:
+        return next(iter(self._get_many_by_batchrefs({batchref})), None)
+
+    def _get_many(self, skus: set) -> List[domain.Product]:
+        if not skus:
+            return []
+        versions = self.session.execute(cached_statement(product_versions_by_skus), dict(skus=list(skus))).all()
+        return self._from_cache_or_load(versions)
+
+    def _get_many_by_batchrefs(self, batchrefs: set) -> List[domain.Product]:
+        if not batchrefs:
+            return []
+        versions = self.session.execute(
+            cached_statement(product_versions_by_batchrefs), dict(batchrefs=list(batchrefs))
+        ).all()
+        return self._from_cache_or_load(versions)
+
+    def _from_cache_or_load(self, versions: List[Tuple[str, int]]) -> List[domain.Product]:
+        products, missing = [], []
+        for sku, version in versions:
+            cached = self.cache.get(sku, version)
+            if cached is None:
+                missing.append(sku)
+            else:
+                # копия кэшированного графа в текущей сессии без запросов в БД; сам кэш не меняется
+                products.append(self.session.merge(cached, load=False))
+        if missing:
+            # граф читается целиком, иначе после закрытия сессии его нельзя будет положить в кэш
+            strategy = self.loading_strategy
+            if strategy == LoadingStrategy.AGGREGATE_ONLY:
+                strategy = LoadingStrategy.SELECTIN
+            products.extend(self.session.execute(
+                self._statement(products_by_skus, strategy), dict(skus=missing)
+            ).unique().scalars().all())
+        return products
+
+    def cache_seen(self):
+        """
+        Вызывается после commit и закрытия сессии: все продукты в seen соответствуют зафиксированному состоянию
+        """
+        for product in self.seen:
+            if self._fully_loaded(product):
+                self.cache.put(product)
+
+    @staticmethod
+    def _fully_loaded(product: domain.Product) -> bool:
+        # после rollback объекты протухают (expired) - такие в кэш не кладем
+        return not inspect(product).unloaded and all(not inspect(b).unloaded for b in product.batches)
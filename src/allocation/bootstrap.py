@@ -1,11 +1,14 @@
-from typing import Callable, Type
+import functools
+from typing import Callable, Optional, Type
 
 from src.allocation.adapters import orm
 from src.allocation.adapters import notifications
+from src.allocation.adapters import outbox
 from src.allocation.adapters import redis_event_publisher
+from src.allocation.adapters import repository
 from src.allocation.core.config import app_settings
-from src.allocation.models import events, commands
-from src.allocation.services import unit_of_work, messagebus, handlers
+from src.allocation.models import events, commands, domain
+from src.allocation.services import unit_of_work, messagebus, handlers, async_handlers, executor, metrics, views
 
 
 def bootstrap(
@@ -13,7 +16,10 @@ def bootstrap(
     uow: unit_of_work.AbstractUnitOfWork = unit_of_work.SqlAlchemyUnitOfWork(),
     notification: notifications.AbstractNotification = notifications.EmailNotification(),
     publish: Callable = redis_event_publisher.publish,
-    message_bus: Type[messagebus.AbstractMessageBus] = messagebus.MessageBus
+    message_bus: Type[messagebus.AbstractMessageBus] = messagebus.MessageBus,
+    eviction_policy: domain.AbstractEvictionPolicy = domain.LargestFirstEvictionPolicy(),
+    batch_projections: bool = False,
+    bus_metrics: Optional[metrics.AbstractBusMetrics] = None,
 ) -> messagebus.AbstractMessageBus:
     """
     Production Use Bootstrap
@@ -21,14 +27,16 @@ def bootstrap(
     if start_orm:
         orm.start_mappers()
 
+    # пакетный режим allocations_view: одна транзакция на каскад вместо транзакции на событие
+    view_buffer = handlers.AllocationsViewBuffer(uow) if batch_projections else None
+
     # FOR PRODUCTION USE
     injected_event_handlers = {
         events.Allocated: [
-            handlers.PublishAllocatedEventHandler(publish),
-            handlers.AddAllocationToViewHandler(uow),
+            handlers.AddAllocationToViewHandler(uow, view_buffer),
         ],
         events.Deallocated: [
-            handlers.RemoveAllocationFromView(uow),
+            handlers.RemoveAllocationFromView(uow, view_buffer),
             handlers.ReAllocateHandler(uow),
         ],
         events.OutOfStock: [
@@ -37,17 +45,126 @@ def bootstrap(
     }
     injected_command_handlers = {
         commands.Allocate: handlers.AllocateHandler(uow),
+        commands.AllocateMany: handlers.AllocateManyHandler(uow),
         commands.Deallocate: handlers.DeAllocateHandler(uow),
         commands.CreateBatch: handlers.AddBatchHandler(uow),
-        commands.ChangeBatchQuantity: handlers.ChangeBatchQuantityHandler(uow),
+        commands.ChangeBatchQuantity: handlers.ChangeBatchQuantityHandler(uow, eviction_policy),
+        commands.ArchiveClosedBatches: handlers.ArchiveClosedBatchesHandler(uow),
     }
+    if uow.outbox is None:  # с outbox событие публикует релей после commit
+        injected_event_handlers[events.Allocated].insert(0, handlers.PublishAllocatedEventHandler(publish))
 
     return message_bus(
         uow=uow,
         event_handlers=injected_event_handlers,
         command_handlers=injected_command_handlers,
+        after_handle=[view_buffer] if view_buffer is not None else [],
+        metrics=bus_metrics,
     )
 
 
+def bootstrap_async(
+    start_orm: bool = True,
+    uow: unit_of_work.AbstractAsyncUnitOfWork = unit_of_work.AsyncSqlAlchemyUnitOfWork(),
+    notification: notifications.AbstractNotification = notifications.EmailNotification(),
+    publish: Callable = redis_event_publisher.publish,
+    eviction_policy: domain.AbstractEvictionPolicy = domain.LargestFirstEvictionPolicy(),
+    concurrent_event_handlers: bool = True,
+    bus_metrics: Optional[metrics.AbstractBusMetrics] = None,
+) -> messagebus.AsyncMessageBus:
+    """
+    Шина на asyncio для async-маршрутов API; обработчики без БД общие с синхронной шиной
+    """
+    if start_orm:
+        orm.start_mappers()
+
+    injected_event_handlers = {
+        events.Allocated: [
+            async_handlers.AddAllocationToViewHandler(uow),
+        ],
+        events.Deallocated: [
+            async_handlers.RemoveAllocationFromView(uow),
+            async_handlers.ReAllocateHandler(uow),
+        ],
+        events.OutOfStock: [
+            handlers.SendOutOfStackNotificationHandler(notification)
+        ]
+    }
+    injected_command_handlers = {
+        commands.Allocate: async_handlers.AllocateHandler(uow),
+        commands.AllocateMany: async_handlers.AllocateManyHandler(uow),
+        commands.Deallocate: async_handlers.DeAllocateHandler(uow),
+        commands.CreateBatch: async_handlers.AddBatchHandler(uow),
+        commands.ChangeBatchQuantity: async_handlers.ChangeBatchQuantityHandler(uow, eviction_policy),
+    }
+    if uow.outbox is None:
+        injected_event_handlers[events.Allocated].insert(0, handlers.PublishAllocatedEventHandler(publish))
+
+    return messagebus.AsyncMessageBus(
+        uow=uow,
+        event_handlers=injected_event_handlers,
+        command_handlers=injected_command_handlers,
+        concurrent_event_handlers=concurrent_event_handlers,
+        metrics=bus_metrics,
+    )
+
+
+async_bus = None  # AsyncMessageBus, если включен app_async_api_enabled
+command_executor = None  # PartitionedExecutor, если app_command_workers > 0
+bus_metrics = None  # BusMetrics всех шин процесса, если включен app_bus_metrics_enabled
+async_read_uow = None
 if app_settings.bus_init_need:
-    bus = bootstrap()
+    product_cache = None
+    if app_settings.product_cache_enabled:
+        product_cache = repository.ProductCache(
+            max_products=app_settings.product_cache_max_products,
+            max_weight=app_settings.product_cache_max_weight,
+        )
+    concurrency_mode = unit_of_work.ConcurrencyMode(app_settings.concurrency_mode)
+    loading_strategy = repository.LoadingStrategy(app_settings.repository_loading_strategy)
+    conflict_retry = unit_of_work.ConflictRetryPolicy(
+        max_attempts=app_settings.conflict_retry_attempts,
+        base_delay=app_settings.conflict_retry_base_delay,
+        max_delay=app_settings.conflict_retry_max_delay,
+    )
+    event_outbox = outbox.Outbox() if app_settings.outbox_enabled else None
+    if app_settings.bus_metrics_enabled:
+        bus_metrics = metrics.BusMetrics()
+    session_factory = unit_of_work.make_session_factory(concurrency_mode)
+
+    def make_uow() -> unit_of_work.SqlAlchemyUnitOfWork:
+        return unit_of_work.SqlAlchemyUnitOfWork(
+            session_factory=session_factory,
+            product_cache=product_cache,
+            loading_strategy=loading_strategy,
+            conflict_retry=conflict_retry,
+            outbox=event_outbox,
+        )
+
+    bus = bootstrap(
+        uow=make_uow(), batch_projections=app_settings.projection_batching, bus_metrics=bus_metrics
+    )
+    read_uow = unit_of_work.ReadOnlyUnitOfWork()  # представления читают через свой engine и пул
+    if app_settings.command_workers > 0:
+        # у каждого воркера своя шина и свой UoW; engine, кэш продуктов и outbox общие
+        command_executor = executor.PartitionedExecutor(
+            lambda: bootstrap(
+                start_orm=False,
+                uow=make_uow(),
+                batch_projections=app_settings.projection_batching,
+                bus_metrics=bus_metrics,
+            ),
+            workers=app_settings.command_workers,
+            # с primary, а не через read_uow: на отстающей реплике новой партии может еще не быть
+            sku_by_batchref=functools.partial(
+                views.sku_by_batchref, unit_of_work.ReadOnlyUnitOfWork(session_factory.kw["bind"])
+            ),
+        )
+    if app_settings.async_api_enabled:
+        async_read_uow = unit_of_work.AsyncReadOnlyUnitOfWork()
+        async_bus = bootstrap_async(start_orm=False, uow=unit_of_work.AsyncSqlAlchemyUnitOfWork(
+            session_factory=unit_of_work.make_async_session_factory(concurrency_mode),
+            loading_strategy=loading_strategy,
+            conflict_retry=conflict_retry,
+            outbox=event_outbox,
+        ), bus_metrics=bus_metrics)
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseSettings
 
 
@@ -7,6 +9,26 @@ class AppSettings(BaseSettings):
     redis_url: str
     redis_port: int = 6379
     bus_init_need: bool = True
+    migrate_on_startup: bool = False  # применять миграции схемы при старте API
+    repository_loading_strategy: str = "selectin"  # selectin | joined | aggregate_only
+    product_cache_enabled: bool = False  # in-process кэш продуктов перед SqlAlchemyRepository
+    product_cache_max_products: int = 1024
+    product_cache_max_weight: int = 1_000_000  # ~ кол-во строк продуктов, партий и размещений в кэше
+    concurrency_mode: str = "isolation"  # isolation | optimistic
+    conflict_retry_attempts: int = 5  # попыток команды при конкурентном изменении продукта, 1 - без повторов
+    conflict_retry_base_delay: float = 0.01  # секунды, база экспоненциальной паузы со случайным разбросом
+    conflict_retry_max_delay: float = 0.5
+    archive_after_days: int = 90  # полностью размещенные партии с eta старше стольких дней уходят в архив
+    bulk_ingestion_chunk_size: int = 10_000  # строк в одной транзакции массовой загрузки партий
+    projection_batching: bool = False  # allocations_view пишется одной транзакцией в конце каскада шины
+    outbox_enabled: bool = False  # события для Redis пишутся в outbox транзакцией UoW и публикуются релеем
+    outbox_relay_batch_size: int = 500  # событий в одной пачке релея (один pipeline в Redis)
+    outbox_relay_flush_interval: float = 0.1  # секунды паузы релея, когда outbox разобран
+    # воркеров PartitionedExecutor (команды разных sku параллельно, одного - по порядку); 0 - одна шина, как раньше.
+    # каждому воркеру нужно соединение: pool_size + pool_max_overflow должно быть больше кол-ва воркеров
+    command_workers: int = 0
+    bus_metrics_enabled: bool = True  # задержки обработчиков, повторы и глубина очереди шины для GET /metrics
+    async_api_enabled: bool = False  # маршруты API работают через AsyncMessageBus (asyncpg) без блокировки event loop
 
     class Config:
         env_file = ".env"
@@ -20,6 +42,14 @@ class DatabaseSettings(BaseSettings):
     host: str
     scheme: str
     port: int = 5432
+    pool_size: int = 5  # постоянных соединений в пуле
+    pool_max_overflow: int = 10  # временных соединений сверх pool_size
+    pool_timeout: float = 30.0  # секунды ожидания свободного соединения, затем TimeoutError
+    pool_recycle: int = 1800  # секунды жизни соединения, -1 - без ограничения
+    pool_pre_ping: bool = True  # проверять соединение перед выдачей из пула
+    query_cache_size: int = 500  # кэш скомпилированных SQLAlchemy выражений, 0 - выключен
+    prepared_statement_cache_size: int = 100  # asyncpg: подготовленных на сервере запросов на соединение, 0 - выкл.
+    read_url: Optional[str] = None  # отдельная БД (реплика) для представлений, по умолчанию - основная
 
     class Config:
         env_file = ".env"
@@ -39,6 +69,29 @@ def get_postgres_uri():
     return f"postgresql://{user}:{password}@{host}:{port}/{db_name}"
 
 
+def get_postgres_async_uri():
+    return get_postgres_uri().replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+def get_postgres_read_uri():
+    return db_settings.read_url or get_postgres_uri()
+
+
+def get_postgres_async_read_uri():
+    return get_postgres_read_uri().replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+def get_engine_options():
+    return dict(
+        pool_size=db_settings.pool_size,
+        max_overflow=db_settings.pool_max_overflow,
+        pool_timeout=db_settings.pool_timeout,
+        pool_recycle=db_settings.pool_recycle,
+        pool_pre_ping=db_settings.pool_pre_ping,
+        query_cache_size=db_settings.query_cache_size,
+    )
+
+
 def get_api_url():
     host = app_settings.api_url
     port = app_settings.api_port
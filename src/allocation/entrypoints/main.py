@@ -1,11 +1,19 @@
 import uvicorn
 from fastapi import FastAPI
 
+from src.allocation.adapters import migrations
+from src.allocation.core.config import app_settings
 from src.allocation.entrypoints.routes.main import api_router
 
 
 fastapi_app = FastAPI()
 fastapi_app.include_router(api_router)
 
+
+@fastapi_app.on_event("startup")
+def apply_migrations():
+    if app_settings.migrate_on_startup:
+        migrations.migrate()
+
 if __name__ == "__main__":
     uvicorn.run(fastapi_app, host="0.0.0.0", port=8000, log_level="debug")
@@ -0,0 +1,43 @@
+"""
+Релей transactional outbox: публикует события из таблицы outbox в Redis пачками и удаляет опубликованные.
+
+Запускается отдельным процессом рядом с API при outbox_enabled; релеев может быть несколько -
+в PostgreSQL строки разбираются FOR UPDATE SKIP LOCKED. Доставка at least once.
+
+    python -m src.allocation.entrypoints.outbox_relay --batch-size 500 --flush-interval 0.1
+"""
+import argparse
+import logging
+
+from src.allocation.adapters import database, outbox, redis_event_publisher
+from src.allocation.core.config import app_settings
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--batch-size", type=int, default=app_settings.outbox_relay_batch_size, help="событий в одной пачке"
+    )
+    parser.add_argument(
+        "--flush-interval", type=float, default=app_settings.outbox_relay_flush_interval,
+        help="секунды паузы, когда outbox разобран",
+    )
+    args = parser.parse_args()
+
+    logger.info("Outbox relay starting")
+    relay = outbox.OutboxRelay(
+        database.create_db_engine(),
+        redis_event_publisher.publish_many,
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
+    )
+    try:
+        relay.run()
+    finally:
+        logger.info("Outbox relay stopped: %s", relay.stats.snapshot())
+
+
+if __name__ == "__main__":
+    main()
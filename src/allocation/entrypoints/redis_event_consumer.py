@@ -5,7 +5,7 @@ import json
 import logging
 import redis
 
-from src.allocation.bootstrap import bus
+from src.allocation.bootstrap import bus, command_executor
 from src.allocation.core import config
 from src.allocation.models import commands
 
@@ -20,14 +20,26 @@ def main():
     pubsub.subscribe("change_batch_quantity")
 
     for m in pubsub.listen():
-        handle_change_batch_quantity(m, bus)
+        if command_executor is not None:
+            # не ждем выполнения: сообщения других продуктов идут параллельно, одного - по порядку
+            command_executor.submit(change_batch_quantity(m)).add_done_callback(log_failure)
+        else:
+            handle_change_batch_quantity(m, bus)
 
 
-def handle_change_batch_quantity(m, mbus):
+def change_batch_quantity(m) -> commands.ChangeBatchQuantity:
     logger.info("handling %s", m)
     data = json.loads(m["data"])
-    cmd = commands.ChangeBatchQuantity(ref=data["batchref"], qty=data["qty"])
-    mbus.handle(cmd)
+    return commands.ChangeBatchQuantity(ref=data["batchref"], qty=data["qty"])
+
+
+def handle_change_batch_quantity(m, mbus):
+    mbus.handle(change_batch_quantity(m))
+
+
+def log_failure(future):
+    if future.exception() is not None:
+        logger.error("command failed: %s", future.exception())
 
 
 if __name__ == "__main__":
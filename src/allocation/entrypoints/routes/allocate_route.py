@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import ORJSONResponse
 
-from src.allocation.bootstrap import bus
+from src.allocation.entrypoints.routes import dispatch
 from src.allocation.models import commands
 from src.allocation.models.api_models.assertion_api_models import (
     POSTAllocateResponse,
@@ -9,8 +9,7 @@ from src.allocation.models.api_models.assertion_api_models import (
     DELETEAllocateResponse,
     DELETEAllocateRequest, GetOrderAllocationsResponse, GetAllocationResponse
 )
-from src.allocation.services import views
-from src.allocation.models.exceptions import InvalidSku
+from src.allocation.models.exceptions import ConcurrencyConflict, InvalidSku
 
 router = APIRouter(prefix='/allocate')
 
@@ -18,8 +17,7 @@ router = APIRouter(prefix='/allocate')
 @router.get("/{order_id}", response_model=GetOrderAllocationsResponse)
 async def get_order_allocations(order_id: str):
     try:
-        uow = bus.uow
-        result = views.allocations(uow, order_id)
+        result = await dispatch.allocations(order_id)
     except Exception:
         raise HTTPException(status_code=500, detail="Internal Server Error")
     if not result:
@@ -38,8 +36,7 @@ async def get_order_allocations(order_id: str):
 @router.get("/{order_id}/{sku}", response_model=GetAllocationResponse)
 async def get_allocation(order_id: str, sku: str):
     try:
-        uow = bus.uow
-        result = views.allocation(uow, order_id, sku)
+        result = await dispatch.allocation(order_id, sku)
     except Exception:
         raise HTTPException(status_code=500, detail="Internal Server Error")
     if not result:
@@ -65,9 +62,11 @@ async def post_allocate_api(order_line: POSTAllocateRequest):
             qty=order_line.qty,
         )
         # send it to messagebus and wait for result
-        result = bus.handle(command)
+        result = await dispatch.handle(command)
     except InvalidSku as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except ConcurrencyConflict as e:  # повторы исчерпаны
+        raise HTTPException(status_code=409, detail=str(e))
     return {'batchref': result.pop(0)}
 
 
@@ -79,7 +78,9 @@ async def delete_allocate_api(order_line: DELETEAllocateRequest):
             sku=order_line.sku,
             qty=order_line.qty,
         )
-        result = bus.handle(command)
+        result = await dispatch.handle(command)
     except InvalidSku as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except ConcurrencyConflict as e:  # повторы исчерпаны
+        raise HTTPException(status_code=409, detail=str(e))
     return {'batchref': result.pop(0)}
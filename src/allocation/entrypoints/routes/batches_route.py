@@ -1,12 +1,21 @@
-from fastapi import APIRouter, HTTPException
+import io
+import tempfile
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import ORJSONResponse
 
+from src.allocation.adapters import bulk_ingestion
 from src.allocation.bootstrap import bus
+from src.allocation.core.config import app_settings
+from src.allocation.entrypoints.routes import dispatch
 from src.allocation.models import commands
 from src.allocation.models.api_models.batches_api_models import POSTBatchesResponse, POSTBatchesRequest
 
 router = APIRouter(prefix='/batches')
 
+UPLOAD_WRITE_SIZE = 1 << 20  # байт тела запроса, копящихся в памяти перед записью во временный файл
+
 
 @router.post("")
 async def post_allocate_api(new_batch: POSTBatchesRequest):
@@ -17,7 +26,7 @@ async def post_allocate_api(new_batch: POSTBatchesRequest):
             qty=new_batch.qty,
             eta=new_batch.eta,
         )
-        bus.handle(command)
+        await dispatch.handle(command)
     except Exception:
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
@@ -25,3 +34,37 @@ async def post_allocate_api(new_batch: POSTBatchesRequest):
         content={},
         status_code=200
     )
+
+
+@router.post("/bulk")
+async def post_batches_bulk_api(
+    request: Request,
+    fmt: str = "csv",
+    chunk_size: int = Query(app_settings.bulk_ingestion_chunk_size, gt=0),
+):
+    """
+    Тело запроса - файл партий (CSV с заголовком ref,sku,qty,eta или NDJSON);
+    тело складывается во временный файл частями по UPLOAD_WRITE_SIZE, запись на диск и загрузка
+    идут в потоке, вне event loop
+    """
+    if fmt not in bulk_ingestion.FORMATS:
+        raise HTTPException(status_code=400, detail=f"fmt must be one of {bulk_ingestion.FORMATS}")
+    body = await run_in_threadpool(tempfile.TemporaryFile)
+    try:
+        pending = bytearray()
+        async for part in request.stream():
+            pending += part
+            if len(pending) >= UPLOAD_WRITE_SIZE:
+                await run_in_threadpool(body.write, bytes(pending))
+                pending.clear()
+        await run_in_threadpool(body.write, bytes(pending))
+        body.seek(0)
+        stream = io.TextIOWrapper(body, encoding="utf-8", newline="")
+        report = await run_in_threadpool(bulk_ingestion.ingest, bus.uow.engine, stream, fmt, chunk_size)
+    finally:
+        await run_in_threadpool(body.close)
+
+    return ORJSONResponse(
+        content=report.as_dict(),
+        status_code=200
+    )
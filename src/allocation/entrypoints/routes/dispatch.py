@@ -0,0 +1,34 @@
+"""
+Вызов шины и представлений из async-маршрутов: через AsyncMessageBus, если она включена
+(app_async_api_enabled), через воркеры PartitionedExecutor (app_command_workers), иначе через
+синхронную шину прямо в event loop, как раньше.
+Представления читают через read-only uow со своим пулом; синхронный вариант - в threadpool,
+чтобы чтение не ждало команд, выполняющихся в event loop
+"""
+import asyncio
+
+from fastapi.concurrency import run_in_threadpool
+
+from src.allocation.bootstrap import async_bus, async_read_uow, bus, command_executor, read_uow
+from src.allocation.models.messages import Message
+from src.allocation.services import async_views, views
+
+
+async def handle(message: Message) -> list:
+    if async_bus is not None:
+        return await async_bus.handle(message)
+    if command_executor is not None:
+        return await asyncio.wrap_future(command_executor.submit(message))
+    return bus.handle(message)
+
+
+async def allocations(order_id: str):
+    if async_read_uow is not None:
+        return await async_views.allocations(async_read_uow, order_id)
+    return await run_in_threadpool(views.allocations, read_uow, order_id)
+
+
+async def allocation(order_id: str, sku: str):
+    if async_read_uow is not None:
+        return await async_views.allocation(async_read_uow, order_id, sku)
+    return await run_in_threadpool(views.allocation, read_uow, order_id, sku)
@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+
+from src.allocation.adapters import database, outbox
+from src.allocation.bootstrap import async_bus, async_read_uow, bus, read_uow
+
+router = APIRouter(prefix='/health')
+
+
+@router.get("/db-pool")
+def get_db_pool_status():
+    # занятые и простаивающие соединения, переполнение пула и ожидание соединений
+    content = database.pool_status(bus.uow.engine)
+    content["read"] = database.pool_status(read_uow.engine)
+    if async_bus is not None:
+        content["async"] = database.pool_status(async_bus.uow.engine)
+        content["async_read"] = database.pool_status(async_read_uow.engine)
+    return ORJSONResponse(
+        content=content,
+        status_code=200
+    )
+
+
+@router.get("/outbox")
+def get_outbox_status():
+    # сколько событий ждут релея и как давно ждет самое старое; читаем с primary - реплика сама отстает
+    with bus.uow.engine.connect() as connection:
+        content = outbox.outbox_status(connection)
+    return ORJSONResponse(
+        content=content,
+        status_code=200
+    )
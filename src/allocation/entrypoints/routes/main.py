@@ -1,8 +1,10 @@
 from fastapi import APIRouter
 
-from src.allocation.entrypoints.routes import allocate_route, batches_route
+from src.allocation.entrypoints.routes import allocate_route, batches_route, health_route, metrics_route
 
 api_router = APIRouter()
 
 api_router.include_router(allocate_route.router)
 api_router.include_router(batches_route.router)
+api_router.include_router(health_route.router)
+api_router.include_router(metrics_route.router)
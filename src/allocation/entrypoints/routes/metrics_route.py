@@ -0,0 +1,18 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from src.allocation.bootstrap import bus_metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+def get_metrics():
+    # метрики шины в текстовом формате Prometheus
+    if bus_metrics is None:
+        raise HTTPException(status_code=404, detail="bus metrics are disabled")
+    return PlainTextResponse(
+        content=bus_metrics.render(),
+        media_type="text/plain; version=0.0.4",
+        status_code=200
+    )
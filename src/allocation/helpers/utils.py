@@ -2,7 +2,6 @@ import time
 import uuid
 
 from sqlalchemy.exc import OperationalError
-from sqlalchemy.orm import sessionmaker
 
 
 def random_suffix():
@@ -25,7 +24,7 @@ def wait_for_postgres_to_come_up(engine):
     deadline = time.time() + 10
     while time.time() < deadline:
         try:
-            sessionmaker(bind=engine)  # соединяемся с БД
+            engine.connect().close()  # соединяемся с БД
             return engine
         except OperationalError:
             time.sleep(0.5)
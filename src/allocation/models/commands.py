@@ -1,13 +1,13 @@
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional
+from typing import Optional, List
 
 
 class Command:
-    pass
+    __slots__ = ()  # без __dict__, чтобы наследники-dataclass(slots=True) были компактными
 
 
-@dataclass
+@dataclass(slots=True)
 class CreateBatch(Command):
     ref: str
     sku: str
@@ -15,21 +15,33 @@ class CreateBatch(Command):
     eta: Optional[date] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Allocate(Command):
     order_id: str
     sku: str
     qty: int
 
 
-@dataclass
+@dataclass(slots=True)
+class AllocateMany(Command):
+    sku: str
+    lines: List[Allocate]  # позиции одного артикула, размещаются в одной транзакции
+
+
+@dataclass(slots=True)
 class Deallocate(Command):
     order_id: str
     sku: str
     qty: int
 
 
-@dataclass
+@dataclass(slots=True)
 class ChangeBatchQuantity(Command):
     ref: str
     qty: int
+
+
+@dataclass(slots=True)
+class ArchiveClosedBatches(Command):
+    sku: str
+    cutoff: date  # архивируются полностью размещенные партии с eta раньше этой даты
@@ -1,6 +1,10 @@
+import abc
+import heapq
+from bisect import insort
+from itertools import accumulate, islice
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional, List
+from typing import Optional, List, Tuple, Dict, Union, Iterable
 
 from src.allocation.models import commands, events
 from src.allocation.models.exceptions import NoOrderInBatch, OutOfStock
@@ -19,6 +23,43 @@ class OrderLine:
     qty: int  # quantity кол-во
 
 
+class AllocationSet:
+    """
+    Множество OrderLine, помнящее порядок размещения (старые позиции идут первыми);
+    используется как collection_class для Batch._allocations в orm.py
+    """
+    def __init__(self, lines: Iterable[OrderLine] = ()):
+        self._lines = dict.fromkeys(lines)  # dict как упорядоченное множество
+
+    def add(self, line: OrderLine):
+        self._lines[line] = None
+
+    def remove(self, line: OrderLine):
+        del self._lines[line]
+
+    def discard(self, line: OrderLine):
+        self._lines.pop(line, None)
+
+    def pop(self) -> OrderLine:
+        line, _ = self._lines.popitem()  # последняя размещенная позиция
+        return line
+
+    def __iter__(self):
+        return iter(self._lines)
+
+    def __reversed__(self):
+        return reversed(self._lines)
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __contains__(self, line):
+        return line in self._lines
+
+    def __repr__(self):
+        return f"<AllocationSet {list(self._lines)}>"
+
+
 class Batch:
     """
     Модель партии товара (то, что можно купить)
@@ -29,8 +70,9 @@ class Batch:
         self.reference = ref
         self.sku = sku # stock-keeping unit, артикул
         self.eta = eta  # estimated-time-arrived, ожидаемое время прибытия
-        self._allocations = set()  # храним OrderLine
+        self._allocations = AllocationSet()  # храним OrderLine в порядке размещения
         self._purchased_quantity = qty
+        self._allocated_quantity = 0  # сумма qty в _allocations, поддерживается инкрементально
 
     def __repr__(self):
         return f"<Batch {self.reference}>"
@@ -53,6 +95,14 @@ class Batch:
             return True
         return self.eta > other.eta
 
+    @property
+    def eta_key(self) -> Tuple[bool, date, str]:
+        """
+        Ключ сортировки, согласованный с __gt__: партии на складе (eta=None) идут раньше партий в пути;
+        при равных eta - по reference, чтобы порядок не зависел от порядка в self.batches
+        """
+        return self.eta is not None, self.eta or date.min, self.reference
+
     def __hash__(self):
         """
         Управления поведением объектов, когда вы
@@ -61,9 +111,19 @@ class Batch:
         """
         return hash(self.reference)
 
+    @property
+    def allocations(self) -> AllocationSet:
+        """
+        Размещенные позиции, только для чтения; менять через allocate/deallocate
+        """
+        return self._allocations
+
     @property  # вычисляемое свойство
     def allocated_quantity(self) -> int:
-        return sum(line.qty for line in self._allocations)
+        if self._allocated_quantity is None:
+            # счетчик сброшен при загрузке из БД (см. orm.py) - пересчитываем один раз
+            self._allocated_quantity = sum(line.qty for line in self._allocations)
+        return self._allocated_quantity
     
     @property
     def available_quantity(self) -> int:  # доступно для заказа
@@ -76,15 +136,77 @@ class Batch:
         return line in self._allocations
 
     def allocate(self, line: OrderLine):
-        if self.can_allocate(line):
+        if self.can_allocate(line) and line not in self._allocations:
+            self._allocated_quantity = self.allocated_quantity + line.qty
             self._allocations.add(line)
 
     def deallocate(self, line: OrderLine):
         if self.can_deallocate(line):
+            self._allocated_quantity = self.allocated_quantity - line.qty
             self._allocations.remove(line)
 
     def deallocate_random_one(self) -> OrderLine:
-        return self._allocations.pop()
+        allocated_quantity = self.allocated_quantity
+        line = self._allocations.pop()
+        self._allocated_quantity = allocated_quantity - line.qty
+        return line
+
+
+class AbstractEvictionPolicy(abc.ABC):
+    """
+    Политика вытеснения позиций из партии, в которой товара стало меньше, чем размещено
+    """
+    @abc.abstractmethod
+    def select(self, batch: Batch, excess: int) -> List[OrderLine]:
+        """
+        За один проход выбирает позиции, суммарно освобождающие не меньше excess шт
+        """
+        raise NotImplementedError
+
+
+class LargestFirstEvictionPolicy(AbstractEvictionPolicy):
+    """
+    Вытесняем позиции с наибольшим qty - вытесненных позиций получается меньше всего;
+    при равном qty первыми вытесняются позже размещенные
+    """
+    def select(self, batch: Batch, excess: int) -> List[OrderLine]:
+        # индекс в кортеже - порядок размещения, до сравнения самих OrderLine не доходит
+        heap = [(-line.qty, -i, line) for i, line in enumerate(batch.allocations)]
+        heapq.heapify(heap)
+        evicted = []
+        while excess > 0 and heap:
+            *_, line = heapq.heappop(heap)
+            evicted.append(line)
+            excess -= line.qty
+        return evicted
+
+
+class LatestFirstEvictionPolicy(AbstractEvictionPolicy):
+    """
+    Вытесняем сначала самые поздние размещения
+    """
+    def select(self, batch: Batch, excess: int) -> List[OrderLine]:
+        evicted = []
+        for line in reversed(batch.allocations):
+            if excess <= 0:
+                break
+            evicted.append(line)
+            excess -= line.qty
+        return evicted
+
+
+class ArbitraryEvictionPolicy(AbstractEvictionPolicy):
+    """
+    Прежнее поведение: позиции в порядке хранения в партии, без учета qty и времени размещения
+    """
+    def select(self, batch: Batch, excess: int) -> List[OrderLine]:
+        evicted = []
+        for line in batch.allocations:
+            if excess <= 0:
+                break
+            evicted.append(line)
+            excess -= line.qty
+        return evicted
 
 
 class Product:
@@ -94,8 +216,83 @@ class Product:
     def __init__(self, sku: str, batches: List[Batch], version: int = 0):
         self.sku = sku  # идентифицирует каждый "продукт"
         self.batches = batches  # все партии этого артикула
-        self.version = version  # UUID can be there instead of counter
+        self.version = version  # UUID can be there instead of counter; растет при любом изменении агрегата
         self.events = []  # тип: List[events.Event]
+        self._reset_indexes()
+
+    def _reset_indexes(self):
+        """
+        Сбрасывает индексы партий; вызывается при замене self.batches (в т.ч. ORM при загрузке)
+        и при изменении списка в обход add_batch
+        """
+        self._indexed_batches = None  # список self.batches, по которому построены индексы
+        self._batches_by_eta = None  # тип: List[Batch]; партии по возрастанию eta, строится лениво
+        self._batches_by_ref = None  # тип: Dict[str, Batch]; партия по reference, строится лениво
+        self._batches_by_line = None  # тип: Dict[OrderLine, Batch]; партия, где размещена позиция
+
+    def _validate_indexes(self):
+        # SQLAlchemy подменяет список целиком, например при ленивой загрузке после expire_on_commit
+        if self._indexed_batches is not self.batches:
+            self._reset_indexes()
+            self._indexed_batches = self.batches
+
+    @property
+    def batches_by_eta(self) -> List[Batch]:
+        """
+        Партии, упорядоченные по eta; сортируем один раз, дальше поддерживаем порядок вставками
+        """
+        self._validate_indexes()
+        if self._batches_by_eta is None:
+            self._batches_by_eta = sorted(self.batches, key=lambda b: b.eta_key)
+        return self._batches_by_eta
+
+    def _get_batch(self, ref: str) -> Batch:
+        self._validate_indexes()
+        if self._batches_by_ref is None:
+            self._batches_by_ref = {b.reference: b for b in self.batches}
+        return self._batches_by_ref[ref]
+
+    def _get_line_batch(self, line: OrderLine) -> Optional[Batch]:
+        self._validate_indexes()
+        if self._batches_by_line is None:
+            # строим только при первой отмене размещения: нужно загрузить все _allocations
+            self._batches_by_line = {
+                allocated: b for b in self.batches for allocated in b._allocations
+            }
+        return self._batches_by_line.get(line)
+
+    def add_batch(self, batch: Batch):
+        self._validate_indexes()
+        self.batches.append(batch)
+        if self._batches_by_eta is not None:
+            insort(self._batches_by_eta, batch, key=lambda b: b.eta_key)
+        if self._batches_by_ref is not None:
+            self._batches_by_ref[batch.reference] = batch
+        self.version += 1
+
+    def archive_closed_batches(self, cutoff: date) -> List[Batch]:
+        """
+        Убирает из агрегата закрытые партии и возвращает их: полностью размещенные и с eta раньше cutoff.
+        В такие партии allocate уже ничего не положит; отмену размещения и изменение кол-ва по ним
+        после архивации агрегат не поддерживает. Партии на складе (eta=None) не архивируются:
+        по ним не понять, давно ли они закрыты
+        """
+        closed = [b for b in self.batches if b.eta is not None and b.eta < cutoff and b.available_quantity <= 0]
+        if not closed:
+            return []
+        closed_refs = {b.reference for b in closed}
+        self.batches[:] = [b for b in self.batches if b.reference not in closed_refs]
+        self._reset_indexes()
+        self.version += 1
+        return closed
+
+    def change_batch_eta(self, ref: str, eta: Optional[date]):
+        batch = self._get_batch(ref)
+        batches_by_eta = self.batches_by_eta
+        batches_by_eta.remove(batch)
+        batch.eta = eta
+        insort(batches_by_eta, batch, key=lambda b: b.eta_key)
+        self.version += 1
 
     def allocate(self, line: OrderLine) -> str:
         """
@@ -105,9 +302,11 @@ class Product:
         """
         try:
             batch = next(
-                b for b in sorted(self.batches) if b.can_allocate(line)
+                b for b in self.batches_by_eta if b.can_allocate(line)
             )
             batch.allocate(line)
+            if self._batches_by_line is not None:
+                self._batches_by_line[line] = batch
             self.version += 1
             self.events.append(events.Allocated(
                 order_id=line.orderid, sku=line.sku, qty=line.qty, batchref=batch.reference
@@ -116,21 +315,60 @@ class Product:
         except StopIteration:
             raise OutOfStock(f"Out of stock for sku {line.sku}")
 
+    def allocate_many(self, lines: List[OrderLine]) -> List[Union[str, OutOfStock]]:
+        """
+        Размещение группы товарных позиций за один проход по партиям в порядке eta;
+        для каждой позиции возвращает reference партии или OutOfStock,
+        версия увеличивается один раз, события Allocated добавляются вместе
+        """
+        batches = self.batches_by_eta
+        # min_qty[i] - наименьшее кол-во среди позиций с i-й: партия, где свободно меньше, не примет
+        # ни одну из оставшихся позиций (свободное кол-во по ходу только уменьшается)
+        min_qty = list(accumulate(reversed([line.qty for line in lines]), min))[::-1]
+        start = 0  # партии до start больше не проверяются
+        results = []
+        allocated = []  # тип: List[events.Allocated]
+        for i, line in enumerate(lines):
+            while start < len(batches) and batches[start].available_quantity < min_qty[i]:
+                start += 1
+            batch = next((b for b in islice(batches, start, None) if b.can_allocate(line)), None)
+            if batch is None:
+                results.append(OutOfStock(f"Out of stock for sku {line.sku}"))
+                continue
+            batch.allocate(line)
+            if self._batches_by_line is not None:
+                self._batches_by_line[line] = batch
+            allocated.append(events.Allocated(
+                order_id=line.orderid, sku=line.sku, qty=line.qty, batchref=batch.reference
+            ))
+            results.append(batch.reference)
+        if allocated:
+            self.version += 1
+            self.events.extend(allocated)
+        return results
+
     def deallocate(self, line: OrderLine) -> str:
-        try:
-            batch = next(
-                b for b in sorted(self.batches) if b.can_deallocate(line)
-            )
-            batch.deallocate(line)
-            self.version -= 1
-            return batch.reference
-        except StopIteration:
+        batch = self._get_line_batch(line)
+        if batch is None:
             raise NoOrderInBatch(line.orderid, line.sku, [b.sku for b in self.batches])
+        batch.deallocate(line)
+        del self._batches_by_line[line]
+        self.version += 1
+        return batch.reference
 
-    def change_batch_quantity(self, ref: str, qty: int):
-        batch = next(b for b in self.batches if b.reference == ref)
+    def change_batch_quantity(
+        self, ref: str, qty: int, eviction_policy: Optional[AbstractEvictionPolicy] = None
+    ):
+        batch = self._get_batch(ref)
         batch._purchased_quantity = qty
-        while batch.available_quantity < 0:
-            line = batch.deallocate_random_one()
-            # trying to allocate deallocated order in new batch
-            self.events.append(events.Deallocated(line.orderid, line.sku, line.qty))
+        self.version += 1
+        if batch.available_quantity >= 0:
+            return
+        eviction_policy = eviction_policy or LargestFirstEvictionPolicy()
+        evicted = eviction_policy.select(batch, -batch.available_quantity)
+        for line in evicted:
+            batch.deallocate(line)
+            if self._batches_by_line is not None:
+                del self._batches_by_line[line]
+        # trying to allocate deallocated orders in new batch
+        self.events.extend(events.Deallocated(line.orderid, line.sku, line.qty) for line in evicted)
@@ -4,15 +4,15 @@ from typing import Optional
 
 
 class Event:
-    pass
+    __slots__ = ()  # без __dict__, чтобы наследники-dataclass(slots=True) были компактными
 
 
-@dataclass
+@dataclass(slots=True)
 class OutOfStock(Event):
     sku: str
 
 
-@dataclass
+@dataclass(slots=True)
 class BatchCreated(Event):
     ref: str
     sku: str
@@ -20,28 +20,28 @@ class BatchCreated(Event):
     eta: Optional[date] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class AllocationRequired(Event):
     order_id: str
     sku: str
     qty: int
 
 
-@dataclass
+@dataclass(slots=True)
 class DeAllocationRequired(Event):
     order_id: str
     sku: str
     qty: int
 
 
-@dataclass
+@dataclass(slots=True)
 class BatchQuantityChanged(Event):
     ref: str
     qty: int
 
 
 # -- Redis Events
-@dataclass
+@dataclass(slots=True)
 class Allocated(Event):
     order_id: str
     sku: str
@@ -49,14 +49,14 @@ class Allocated(Event):
     batchref: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ToAllocate(Event):
     order_id: str
     sku: str
     qty: int
 
 
-@dataclass
+@dataclass(slots=True)
 class Deallocated(Event):
     order_id: str
     sku: str
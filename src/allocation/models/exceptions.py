@@ -31,3 +31,13 @@ class InvalidSku(Exception):
 
     def __str__(self):
         return self.message.format(self.sku)
+
+
+class ConcurrencyConflict(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+        self.message = 'Aggregate was changed by a concurrent transaction: {}'
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message.format(self.reason)
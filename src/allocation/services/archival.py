@@ -0,0 +1,69 @@
+"""
+Фоновая архивация закрытых партий: одним запросом находим артикулы, у которых есть полностью
+размещенные партии с eta раньше границы, и по каждому отправляем в шину ArchiveClosedBatches.
+Решение, какие партии закрыты, принимает агрегат (Product.archive_closed_batches) в своей транзакции,
+поэтому конкурентные размещения защищены проверкой версии, как и любые другие команды.
+
+Запуск из корня репозитория (например, по cron):
+    python -m src.allocation.services.archival --older-than-days 90 --limit 1000
+"""
+import argparse
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy import func, select
+
+from src.allocation.adapters import orm
+from src.allocation.core.config import app_settings
+from src.allocation.models import commands
+from src.allocation.services import messagebus, unit_of_work
+
+
+def find_skus_with_closed_batches(
+    uow: unit_of_work.SqlAlchemyUnitOfWork, cutoff: date, limit: Optional[int] = None
+) -> List[str]:
+    allocated = (
+        select(func.coalesce(func.sum(orm.order_lines.c.qty), 0))
+        .select_from(orm.allocations.join(orm.order_lines, orm.allocations.c.orderline_id == orm.order_lines.c.id))
+        .where(orm.allocations.c.batch_id == orm.batches.c.id)
+        .scalar_subquery()
+    )
+    statement = (
+        select(orm.batches.c.sku).distinct()
+        .where(orm.batches.c.eta < cutoff, orm.batches.c._purchased_quantity <= allocated)
+        .order_by(orm.batches.c.sku)
+        .limit(limit)
+    )
+    with uow:
+        return list(uow.session.execute(statement).scalars())
+
+
+def archive_closed_batches(
+    bus: messagebus.AbstractMessageBus, cutoff: date, limit: Optional[int] = None
+) -> Dict[str, List[str]]:
+    """
+    Возвращает заархивированные reference партий по артикулам
+    """
+    archived = {}
+    for sku in find_skus_with_closed_batches(bus.uow, cutoff, limit):
+        [refs] = bus.handle(commands.ArchiveClosedBatches(sku=sku, cutoff=cutoff))
+        if refs:
+            archived[sku] = refs
+            logger.info(f'Archived {len(refs)} closed batches of {sku}')
+    return archived
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than-days", type=int, default=app_settings.archive_after_days)
+    parser.add_argument("--limit", type=int, help="артикулов за один запуск")
+    args = parser.parse_args()
+
+    from src.allocation.bootstrap import bus  # шина собирается при импорте, только для запуска из CLI
+    archived = archive_closed_batches(bus, date.today() - timedelta(days=args.older_than_days), args.limit)
+    print(f"archived {sum(map(len, archived.values()))} batches of {len(archived)} products")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Асинхронные обработчики сервисного слоя для AsyncMessageBus: та же логика, что в handlers.py,
+но ввод-вывод через AbstractAsyncUnitOfWork. Обработчики без БД (уведомления, публикация в Redis)
+берутся из handlers.py - шина выполняет синхронные обработчики в отдельном потоке
+"""
+import abc
+from dataclasses import asdict
+from typing import Any
+
+from src.allocation.models import commands, domain, events
+from src.allocation.models.exceptions import InvalidSku
+from src.allocation.models.messages import Message
+from src.allocation.services import unit_of_work, views
+
+
+class AbstractAsyncHandler(abc.ABC):
+    def __init__(self, uow: unit_of_work.AbstractAsyncUnitOfWork) -> None:
+        self.uow = uow
+
+    @abc.abstractmethod
+    async def __call__(self, message: Message, *args, **kwargs) -> Any:
+        raise NotImplementedError
+
+
+class AddBatchHandler(AbstractAsyncHandler):
+    async def __call__(self, event: commands.CreateBatch, *args, **kwargs) -> None:
+        async with self.uow:
+            product = await self.uow.products.get(sku=event.sku)
+            if product is None:
+                product = domain.Product(event.sku, batches=[])
+                self.uow.products.add(product)
+            product.add_batch(domain.Batch(event.ref, event.sku, event.qty, event.eta))
+            await self.uow.commit()
+
+
+class AllocateHandler(AbstractAsyncHandler):
+    async def __call__(self, event: commands.Allocate, *args, **kwargs) -> str:
+        line = domain.OrderLine(event.order_id, event.sku, event.qty)
+        async with self.uow:
+            product = await self.uow.products.get(line.sku)
+            if product is None:
+                raise InvalidSku(line.sku)
+            batchref = product.allocate(line)
+            await self.uow.commit()
+
+        return batchref
+
+
+class AllocateManyHandler(AbstractAsyncHandler):
+    async def __call__(self, event: commands.AllocateMany, *args, **kwargs) -> list:
+        lines = [domain.OrderLine(line.order_id, line.sku, line.qty) for line in event.lines]
+        async with self.uow:
+            product = await self.uow.products.get(event.sku)
+            if product is None:
+                raise InvalidSku(event.sku)
+            results = product.allocate_many(lines)
+            await self.uow.commit()
+
+        return results
+
+
+class DeAllocateHandler(AbstractAsyncHandler):
+    async def __call__(self, event: commands.Deallocate, *args, **kwargs) -> str:
+        line = domain.OrderLine(event.order_id, event.sku, event.qty)
+        async with self.uow:
+            product = await self.uow.products.get(line.sku)
+            if product is None:
+                raise InvalidSku(line.sku)
+            batchref = product.deallocate(line)
+            await self.uow.commit()
+
+        return batchref
+
+
+class ReAllocateHandler(AbstractAsyncHandler):
+    async def __call__(self, event: events.Deallocated, *args, **kwargs):
+        async with self.uow:
+            product = await self.uow.products.get(sku=event.sku)
+            product.events.append(commands.Allocate(**asdict(event)))
+            await self.uow.commit()
+
+
+class ChangeBatchQuantityHandler(AbstractAsyncHandler):
+    def __init__(
+        self,
+        uow: unit_of_work.AbstractAsyncUnitOfWork,
+        eviction_policy: domain.AbstractEvictionPolicy = domain.LargestFirstEvictionPolicy(),
+    ) -> None:
+        super().__init__(uow)
+        self.eviction_policy = eviction_policy
+
+    async def __call__(self, event: commands.ChangeBatchQuantity, *args, **kwargs):
+        async with self.uow:
+            product = await self.uow.products.get_by_batchref(batchref=event.ref)
+            product.change_batch_quantity(ref=event.ref, qty=event.qty, eviction_policy=self.eviction_policy)
+            await self.uow.commit()
+
+
+class AddAllocationToViewHandler(AbstractAsyncHandler):
+    async def __call__(self, event: events.Allocated, *args, **kwargs):
+        async with self.uow:
+            await self.uow.session.execute(
+                views.UPSERT_ALLOCATION,
+                dict(order_id=event.order_id, sku=event.sku, batchref=event.batchref)
+            )
+            await self.uow.commit()
+
+
+class RemoveAllocationFromView(AbstractAsyncHandler):
+    async def __call__(self, event: events.Deallocated, *args, **kwargs):
+        async with self.uow:
+            await self.uow.session.execute(
+                views.DELETE_ALLOCATION,
+                dict(order_id=event.order_id, sku=event.sku)
+            )
+            await self.uow.commit()
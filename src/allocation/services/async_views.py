@@ -0,0 +1,14 @@
+from src.allocation.services import unit_of_work
+from src.allocation.services.views import ALLOCATION_BY_ORDER_AND_SKU, ALLOCATIONS_BY_ORDER
+
+
+async def allocations(uow: unit_of_work.AsyncReadOnlyUnitOfWork, order_id: str):
+    async with uow:
+        results = await uow.connection.execute(ALLOCATIONS_BY_ORDER, dict(orderid=order_id))
+        return [dict(r) for r in results.mappings()]
+
+
+async def allocation(uow: unit_of_work.AsyncReadOnlyUnitOfWork, order_id: str, sku: str):
+    async with uow:
+        result = await uow.connection.execute(ALLOCATION_BY_ORDER_AND_SKU, dict(orderid=order_id, sku=sku))
+        return dict(result.all())
@@ -0,0 +1,125 @@
+"""
+Параллельное выполнение команд по артикулам.
+
+MessageBus обрабатывает команды по одной, и команды разных продуктов ждут друг друга, хотя
+не пересекаются по данным. PartitionedExecutor раскладывает команды по воркерам по хэшу sku
+(для ChangeBatchQuantity - sku партии): у каждого воркера свой поток, своя очередь и своя шина
+со своим UoW и сессией. Команды одного продукта всегда попадают к одному воркеру и выполняются
+строго в порядке submit, команды разных продуктов - параллельно. События каскада обрабатываются
+шиной того же воркера.
+"""
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from queue import Queue
+from typing import Any, Callable, List, Optional
+
+from src.allocation.models import commands
+from src.allocation.models.messages import Message
+from src.allocation.services.messagebus import AbstractMessageBus
+
+_STOP = object()  # сигнал воркеру завершиться
+
+
+class PartitionedExecutor:
+    def __init__(
+        self,
+        bus_factory: Callable[[], AbstractMessageBus],
+        workers: int = 4,
+        sku_by_batchref: Callable[[str], Optional[str]] = lambda batchref: None,
+        max_cached_batchrefs: int = 100_000,
+    ):
+        """
+        bus_factory - вызывается по разу на воркер, каждая шина должна иметь собственный UoW.
+        sku_by_batchref - поиск sku партии в БД для ChangeBatchQuantity; должен читать с primary:
+        отставшая реплика не найдет новую партию, и команда уйдет не к воркеру своего продукта.
+        Найденное запоминается, как и sku партий из CreateBatch, прошедших через executor
+        (партия не меняет продукт); промахи не запоминаются - партия может появиться позже
+        """
+        self.buses: List[AbstractMessageBus] = [bus_factory() for _ in range(workers)]
+        self.sku_by_batchref = sku_by_batchref
+        self.max_cached_batchrefs = max_cached_batchrefs
+        self._batch_skus: OrderedDict = OrderedDict()  # batchref -> sku, LRU
+        self._batch_skus_lock = threading.Lock()
+        self._queues: List[Queue] = [Queue() for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(bus, queue), name=f"command-worker-{i}", daemon=True)
+            for i, (bus, queue) in enumerate(zip(self.buses, self._queues))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, message: Message) -> Future:
+        """
+        Ставит сообщение в очередь воркера его продукта; Future вернет результат bus.handle или его исключение
+        """
+        future = Future()
+        self._queues[self.partition(message)].put((future, message))
+        return future
+
+    def handle(self, message: Message) -> Any:
+        return self.submit(message).result()
+
+    def partition(self, message: Message) -> int:
+        """
+        Номер воркера: crc32 от sku, чтобы распределение не зависело от PYTHONHASHSEED.
+        Сообщения без sku, в т.ч. ChangeBatchQuantity несуществующей партии, - всегда к воркеру 0
+        """
+        key = self._sku(message)
+        return zlib.crc32(key.encode()) % len(self._queues) if key is not None else 0
+
+    def _sku(self, message: Message) -> Optional[str]:
+        if isinstance(message, commands.ChangeBatchQuantity):
+            return self._batch_sku(message.ref)
+        if isinstance(message, commands.CreateBatch):
+            self._remember_batch(message.ref, message.sku)
+        return getattr(message, "sku", None)
+
+    def _batch_sku(self, batchref: str) -> Optional[str]:
+        with self._batch_skus_lock:
+            sku = self._batch_skus.get(batchref)
+            if sku is not None:
+                self._batch_skus.move_to_end(batchref)
+                return sku
+        sku = self.sku_by_batchref(batchref)
+        if sku is not None:
+            self._remember_batch(batchref, sku)
+        return sku
+
+    def _remember_batch(self, batchref: str, sku: str):
+        with self._batch_skus_lock:
+            self._batch_skus[batchref] = sku
+            self._batch_skus.move_to_end(batchref)
+            if len(self._batch_skus) > self.max_cached_batchrefs:
+                self._batch_skus.popitem(last=False)
+
+    @staticmethod
+    def _work(bus: AbstractMessageBus, queue: Queue):
+        while True:
+            item = queue.get()
+            if item is _STOP:
+                return
+            future, message = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(bus.handle(message))
+            except BaseException as e:  # шина уже залогировала ошибку команды
+                future.set_exception(e)
+
+    def shutdown(self, wait: bool = True):
+        """
+        Воркеры дорабатывают уже поставленные сообщения и завершаются
+        """
+        for queue in self._queues:
+            queue.put(_STOP)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
@@ -4,15 +4,16 @@
 from __future__ import annotations  # TODO узнать для чего это
 
 import abc
+import contextvars
 from dataclasses import asdict
-from typing import Any, Callable
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from src.allocation.adapters import notifications
 from src.allocation.models import domain, commands
 from src.allocation.models import events
 from src.allocation.models.exceptions import InvalidSku
 from src.allocation.models.messages import Message
-from src.allocation.services import unit_of_work
+from src.allocation.services import unit_of_work, views
 
 
 class AbstractHandler(abc.ABC):
@@ -31,7 +32,7 @@ class AddBatchHandler(AbstractHandler):
             if product is None:
                 product = domain.Product(event.sku, batches=[])
                 self.uow.products.add(product)
-            product.batches.append(domain.Batch(event.ref, event.sku, event.qty, event.eta))
+            product.add_batch(domain.Batch(event.ref, event.sku, event.qty, event.eta))
             self.uow.commit()
 
 
@@ -48,6 +49,19 @@ class AllocateHandler(AbstractHandler):
         return batchref
 
 
+class AllocateManyHandler(AbstractHandler):
+    def __call__(self, event: commands.AllocateMany, *args, **kwargs) -> list:
+        lines = [domain.OrderLine(line.order_id, line.sku, line.qty) for line in event.lines]
+        with self.uow:
+            product = self.uow.products.get(event.sku)
+            if product is None:
+                raise InvalidSku(event.sku)
+            results = product.allocate_many(lines)
+            self.uow.commit()
+
+        return results
+
+
 class DeAllocateHandler(AbstractHandler):
     def __call__(self, event: events.DeAllocationRequired, *args, **kwargs) -> str:
         line = domain.OrderLine(event.order_id, event.sku, event.qty)
@@ -61,6 +75,19 @@ class DeAllocateHandler(AbstractHandler):
         return batchref
 
 
+class ArchiveClosedBatchesHandler(AbstractHandler):
+    def __call__(self, event: commands.ArchiveClosedBatches, *args, **kwargs) -> List[str]:
+        with self.uow:
+            product = self.uow.products.get(event.sku)
+            if product is None:
+                raise InvalidSku(event.sku)
+            closed = product.archive_closed_batches(event.cutoff)
+            self.uow.products.archive(closed)
+            self.uow.commit()
+
+        return [batch.reference for batch in closed]
+
+
 class ReAllocateHandler(AbstractHandler):
     def __call__(self, event: events.Deallocated, *args, **kwargs):
         with self.uow:
@@ -70,38 +97,108 @@ class ReAllocateHandler(AbstractHandler):
 
 
 class ChangeBatchQuantityHandler(AbstractHandler):
+    def __init__(
+        self,
+        uow: unit_of_work.AbstractUnitOfWork,
+        eviction_policy: domain.AbstractEvictionPolicy = domain.LargestFirstEvictionPolicy(),
+    ) -> None:
+        super().__init__(uow)
+        self.eviction_policy = eviction_policy
+
     def __call__(self, event: events.BatchQuantityChanged, *args, **kwargs):
         with self.uow:
             product = self.uow.products.get_by_batchref(batchref=event.ref)
-            product.change_batch_quantity(ref=event.ref, qty=event.qty)
+            product.change_batch_quantity(ref=event.ref, qty=event.qty, eviction_policy=self.eviction_policy)
             self.uow.commit()
 
 
-class AddAllocationToViewHandler(AbstractHandler):
+class AllocationsViewBuffer:
+    """
+    Пакетный режим обработчиков allocations_view: изменения за один MessageBus.handle копятся
+    (по ключу (order_id, sku) остается последнее) и в конце каскада пишутся в одной транзакции -
+    одним DELETE по всем удаленным ключам и одним INSERT ... ON CONFLICT по всем добавленным.
+    Изменения лежат в ContextVar, поэтому у параллельных вызовов шины буферы свои.
+    Сам буфер - хук after_handle шины: вызов - flush; если flush не удался и после повторов шины,
+    шина вызывает discard() и логирует потерянные ключи - allocations_view по ним расходится с
+    агрегатами, пока заказ не изменится снова
+    """
     def __init__(self, uow: unit_of_work.SqlAlchemyUnitOfWork) -> None:
+        self.uow = uow
+        self._pending = contextvars.ContextVar(f"allocations_view_buffer_{id(self)}", default=None)
+
+    def upsert(self, order_id: str, sku: str, batchref: str):
+        self._changes()[(order_id, sku)] = batchref
+
+    def delete(self, order_id: str, sku: str):
+        self._changes()[(order_id, sku)] = None
+
+    def _changes(self) -> Dict[Tuple[str, str], Optional[str]]:
+        changes = self._pending.get()
+        if changes is None:
+            changes = {}
+            self._pending.set(changes)
+        return changes
+
+    def flush(self):
+        changes = self._pending.get()
+        if not changes:
+            return
+        deleted = [key for key, batchref in changes.items() if batchref is None]
+        upserted = [
+            dict(order_id=order_id, sku=sku, batchref=batchref)
+            for (order_id, sku), batchref in changes.items() if batchref is not None
+        ]
+        with self.uow:
+            if deleted:
+                self.uow.session.execute(views.DELETE_ALLOCATIONS, dict(keys=deleted))
+            if upserted:
+                dialect_name = self.uow.session.get_bind().dialect.name
+                self.uow.session.execute(views.upsert_allocations(dialect_name), upserted)
+            self.uow.commit()
+        changes.clear()  # при ошибке изменения остаются для повтора flush шиной
+
+    __call__ = flush
+
+    def discard(self) -> List[Tuple[str, str]]:
+        """
+        Сбрасывает незаписанные изменения, возвращает их ключи (order_id, sku)
+        """
+        changes = self._pending.get()
+        self._pending.set(None)
+        return sorted(changes) if changes else []
+
+
+class AddAllocationToViewHandler(AbstractHandler):
+    def __init__(self, uow: unit_of_work.SqlAlchemyUnitOfWork, buffer: Optional[AllocationsViewBuffer] = None) -> None:
         super().__init__(uow)
         self.uow = uow
+        self.buffer = buffer  # пакетный режим: запись откладывается до конца каскада
 
     def __call__(self, event: events.Allocated, *args, **kwargs):
+        if self.buffer is not None:
+            self.buffer.upsert(event.order_id, event.sku, event.batchref)
+            return
         with self.uow:
             self.uow.session.execute(
-                'INSERT INTO allocations_view (order_id, sku, batchref)'
-                ' VALUES (:order_id, :sku, :batchref)',
+                views.UPSERT_ALLOCATION,
                 dict(order_id=event.order_id, sku=event.sku, batchref=event.batchref)
             )
             self.uow.commit()
 
 
 class RemoveAllocationFromView(AbstractHandler):
-    def __init__(self, uow: unit_of_work.SqlAlchemyUnitOfWork) -> None:
+    def __init__(self, uow: unit_of_work.SqlAlchemyUnitOfWork, buffer: Optional[AllocationsViewBuffer] = None) -> None:
         super().__init__(uow)
         self.uow = uow
+        self.buffer = buffer
 
     def __call__(self, event: events.Deallocated, *args, **kwargs):
+        if self.buffer is not None:
+            self.buffer.delete(event.order_id, event.sku)
+            return
         with self.uow:
             self.uow.session.execute(
-                'DELETE FROM allocations_view '
-                ' WHERE order_id = :order_id AND sku = :sku',
+                views.DELETE_ALLOCATION,
                 dict(order_id=event.order_id, sku=event.sku)
             )
 
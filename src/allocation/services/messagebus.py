@@ -1,12 +1,74 @@
 import abc
-from typing import Dict, Type, List, Callable
+import asyncio
+import inspect
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Type, List, Callable, NamedTuple, Optional, Sequence, Tuple
 
 from loguru import logger
-from tenacity import Retrying, stop_after_attempt, wait_exponential, RetryError
 
 from src.allocation.models import events, commands
 from src.allocation.models.messages import Message
 from src.allocation.services import unit_of_work
+from src.allocation.services.metrics import AbstractBusMetrics
+
+
+@dataclass(frozen=True)
+class EventRetryPolicy:
+    """
+    Повтор обработчика события: до max_attempts попыток с экспоненциальной паузой base_delay * 2^(n-1),
+    как wait_exponential() в tenacity. Один объект на шину; на успешном пути обработчик
+    вызывается напрямую, без создания объектов для повторов
+    """
+    max_attempts: int = 3
+    base_delay: float = 1.0  # секунды
+    max_delay: float = 60.0
+
+    def delay(self, attempt: int) -> float:
+        return min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+
+    def call(self, fn: Callable[..., Any], *args) -> Any:
+        attempt = 1
+        while True:
+            try:
+                return fn(*args)
+            except Exception:
+                if attempt >= self.max_attempts:
+                    raise
+            time.sleep(self.delay(attempt))
+            attempt += 1
+
+    async def call_async(self, fn: Callable[..., Any], *args) -> Any:
+        attempt = 1
+        while True:
+            try:
+                return await fn(*args)
+            except Exception:
+                if attempt >= self.max_attempts:
+                    raise
+            await asyncio.sleep(self.delay(attempt))
+            attempt += 1
+
+
+class CallCounter:
+    """
+    Считает вызовы fn - так шина узнает число попыток обработчика, не вмешиваясь в политики повторов
+    """
+    __slots__ = ("fn", "attempts")
+
+    def __init__(self, fn: Callable[..., Any]):
+        self.fn = fn
+        self.attempts = 0
+
+    def __call__(self, *args) -> Any:
+        self.attempts += 1
+        return self.fn(*args)
+
+
+class Route(NamedTuple):
+    is_command: bool
+    handlers: Tuple[Callable, ...]  # у команды - ровно один
 
 
 class AbstractMessageBus(abc.ABC):
@@ -14,66 +76,215 @@ class AbstractMessageBus(abc.ABC):
         self,
         uow: unit_of_work.AbstractUnitOfWork,
         event_handlers: Dict[Type[events.Event], List[Callable]],
-        command_handlers: Dict[Type[commands.Command], Callable]
+        command_handlers: Dict[Type[commands.Command], Callable],
+        event_retry: EventRetryPolicy = EventRetryPolicy(),
+        after_handle: Sequence[Callable[[], Any]] = (),
+        metrics: Optional[AbstractBusMetrics] = None,
     ):
         """
-        Init messagebus with injected handlers and commands +  required unit_of_work
+        Init messagebus with injected handlers and commands +  required unit_of_work;
+        after_handle - вызываются в конце каждого handle (например, сброс пакетных проекций) с повторами
+        event_retry; если все попытки упали, у хука вызывается discard() (если он есть) - хук отдает
+        то, что не удалось записать, и это логируется как потерянное;
+        metrics - хуки задержек, повторов и глубины очереди, без них шина ничего не замеряет
         """
         self.uow = uow
         self.event_handlers = event_handlers
         self.command_handlers = command_handlers
+        self.event_retry = event_retry
+        self.after_handle = list(after_handle)
+        self.metrics = metrics
+        self._routes: Dict[type, Route] = {}  # таблица диспетчеризации по типу сообщения
+        for message_type in (*event_handlers, *command_handlers):
+            self.route(message_type)
+
+    def route(self, message_type: type) -> Route:
+        """
+        Обработчики типа сообщения, включая зарегистрированные для его родителей; считаются один раз на тип
+        """
+        route = self._routes.get(message_type)
+        if route is None:
+            route = self._routes[message_type] = self._build_route(message_type)
+        return route
+
+    def _build_route(self, message_type: type) -> Route:
+        if issubclass(message_type, events.Event):
+            registered = [cls for cls in message_type.__mro__ if cls in self.event_handlers]
+            if not registered:
+                raise KeyError(message_type)
+            return Route(False, tuple(h for cls in registered for h in self.event_handlers[cls]))
+        if issubclass(message_type, commands.Command):
+            for cls in message_type.__mro__:
+                if cls in self.command_handlers:
+                    return Route(True, (self.command_handlers[cls],))
+            raise KeyError(message_type)
+        raise Exception(f'{message_type} was not an Event or Command')
+
+    def _counted(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        return CallCounter(fn) if self.metrics is not None else fn
+
+    def _observe_handler(self, message: Message, handler: Callable, start: float, calls: Callable, failed: bool):
+        if self.metrics is not None:
+            self.metrics.observe_handler(type(message), handler, time.perf_counter() - start, calls.attempts, failed)
+
+    def _observe_handle(self, message: Message, start: float, max_queue_depth: int):
+        if self.metrics is not None:
+            self.metrics.observe_handle(type(message), time.perf_counter() - start, max_queue_depth)
 
     @abc.abstractmethod
     def handle(self, message: Message):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def handle_event(self, event: events.Event, queue: List[Message]):
+    def handle_event(self, event: events.Event, queue: Deque[Message]):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def handle_command(self, command: commands.Command, queue: List[Message]):
+    def handle_command(self, command: commands.Command, queue: Deque[Message]):
         raise NotImplementedError
 
 
 class MessageBus(AbstractMessageBus):
     def handle(self, message: Message):
         results = []  # results in messagebus from service layer
-        queue = [message]  # start queue on first event
-        while queue:
-            message = queue.pop(0)
-            if isinstance(message, events.Event):
-                self.handle_event(message, queue)
-            elif isinstance(message, commands.Command):
-                cmd_result = self.handle_command(message, queue)
-                results.append(cmd_result)
-            else:
-                raise Exception(f'{message} was not an Event or Command')
+        queue = deque([message])  # start queue on first event
+        first, start, max_queue_depth = message, time.perf_counter(), 1
+        try:
+            while queue:
+                if len(queue) > max_queue_depth:
+                    max_queue_depth = len(queue)
+                message = queue.popleft()
+                if self.route(type(message)).is_command:
+                    cmd_result = self.handle_command(message, queue)
+                    results.append(cmd_result)
+                else:
+                    self.handle_event(message, queue)
+        finally:
+            # изменения, зафиксированные до ошибки команды, тоже должны попасть в проекции
+            self._run_after_handle()
+            self._observe_handle(first, start, max_queue_depth)
         return results
 
-    def handle_event(self, event: events.Event, queue: List[Message]):
-        for handler in self.event_handlers[type(event)]:
+    def _run_after_handle(self):
+        for hook in self.after_handle:
+            try:
+                self.event_retry.call(hook)
+            except Exception:
+                # как и ошибка обработчика события, не прерывает обработку
+                discard = getattr(hook, "discard", None)
+                dropped = discard() if discard is not None else None
+                logger.error('Exception in after-handle hook {}, dropped: {}', hook, dropped)
+
+    def handle_event(self, event: events.Event, queue: Deque[Message]):
+        for handler in self.route(type(event)).handlers:
+            calls, start, failed = self._counted(self._handle_event_with), time.perf_counter(), False
             try:
-                for attempt in Retrying(
-                    stop=stop_after_attempt(3),  # retry for 3 times
-                    wait=wait_exponential()  # exponential timeout between attempts
-                ):
-                    with attempt:
-                        logger.debug(f'Handling event {event} with handler {handler}')
-                        handler(event)
-                        queue.extend(self.uow.collect_new_events())
-            except RetryError:
+                self.event_retry.call(calls, handler, event, queue)
+            except Exception:
                 # logging error, but not interrupting message processing
-                logger.error(f'Exception handling event {event}')
-                continue
+                logger.error('Exception handling event {}', event)
+                failed = True
+            self._observe_handler(event, handler, start, calls, failed)
+
+    def _handle_event_with(self, handler: Callable, event: events.Event, queue: Deque[Message]):
+        logger.debug('Handling event {} with handler {}', event, handler)  # форматируется, только если debug включен
+        handler(event)
+        queue.extend(self.uow.collect_new_events())
 
-    def handle_command(self, command: commands.Command, queue: List[Message]):
-        logger.debug(f'Handling command {command}')
+    def handle_command(self, command: commands.Command, queue: Deque[Message]):
+        logger.debug('Handling command {}', command)
         try:
-            handler = self.command_handlers[type(command)]
-            result = handler(command)
+            [handler] = self.route(type(command)).handlers
+            calls, start = self._counted(handler), time.perf_counter()
+            try:
+                result = self.uow.with_conflict_retry(calls, command)
+            except Exception:
+                self._observe_handler(command, handler, start, calls, failed=True)
+                raise
+            self._observe_handler(command, handler, start, calls, failed=False)
             queue.extend(self.uow.collect_new_events())
             return result  # TODO костыль
         except Exception:
-            logger.error(f'Exception handling command {command}')
+            logger.error('Exception handling command {}', command)
+            raise
+
+
+def is_async_handler(handler: Callable) -> bool:
+    return inspect.iscoroutinefunction(handler) or inspect.iscoroutinefunction(getattr(handler, "__call__", None))
+
+
+class AsyncMessageBus(AbstractMessageBus):
+    """
+    Шина на asyncio для async-обработчиков (services/async_handlers.py) и AbstractAsyncUnitOfWork;
+    синхронные обработчики (Redis, уведомления) выполняются в потоке, чтобы не блокировать event loop.
+    Сообщения из очереди обрабатываются по одному, как в MessageBus, но обработчики одного события
+    выполняются конкурентно (каждый в своей задаче, поэтому и со своей сессией uow); ошибка одного
+    обработчика после всех повторов только логируется и не мешает остальным
+    """
+    def __init__(self, *args, concurrent_event_handlers: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.concurrent_event_handlers = concurrent_event_handlers
+
+    async def handle(self, message: Message):
+        results = []
+        queue = deque([message])
+        first, start, max_queue_depth = message, time.perf_counter(), 1
+        try:
+            while queue:
+                if len(queue) > max_queue_depth:
+                    max_queue_depth = len(queue)
+                message = queue.popleft()
+                if self.route(type(message)).is_command:
+                    cmd_result = await self.handle_command(message, queue)
+                    results.append(cmd_result)
+                else:
+                    await self.handle_event(message, queue)
+        finally:
+            self._observe_handle(first, start, max_queue_depth)
+        return results
+
+    async def handle_event(self, event: events.Event, queue: Deque[Message]):
+        handlers = self.route(type(event)).handlers
+        if self.concurrent_event_handlers and len(handlers) > 1:
+            # события, порожденные обработчиками, попадут в очередь и будут обработаны после всех них
+            await asyncio.gather(*(self._handle_event_isolated(handler, event, queue) for handler in handlers))
+        else:
+            for handler in handlers:
+                await self._handle_event_isolated(handler, event, queue)
+
+    async def _handle_event_isolated(self, handler: Callable, event: events.Event, queue: Deque[Message]):
+        calls, start, failed = self._counted(self._handle_event_with), time.perf_counter(), False
+        try:
+            await self.event_retry.call_async(calls, handler, event, queue)
+        except Exception:
+            logger.error('Exception handling event {} with handler {}', event, handler)
+            failed = True
+        self._observe_handler(event, handler, start, calls, failed)
+
+    async def _handle_event_with(self, handler: Callable, event: events.Event, queue: Deque[Message]):
+        logger.debug('Handling event {} with handler {}', event, handler)
+        await self._call(handler, event)
+        queue.extend(self.uow.collect_new_events())
+
+    async def handle_command(self, command: commands.Command, queue: Deque[Message]):
+        logger.debug('Handling command {}', command)
+        try:
+            [handler] = self.route(type(command)).handlers
+            calls, start = self._counted(self._call), time.perf_counter()
+            try:
+                result = await self.uow.with_conflict_retry(calls, handler, command)
+            except Exception:
+                self._observe_handler(command, handler, start, calls, failed=True)
+                raise
+            self._observe_handler(command, handler, start, calls, failed=False)
+            queue.extend(self.uow.collect_new_events())
+            return result
+        except Exception:
+            logger.error('Exception handling command {}', command)
             raise
+
+    @staticmethod
+    async def _call(handler: Callable, message: Message) -> Any:
+        if is_async_handler(handler):
+            return await handler(message)
+        return await asyncio.to_thread(handler, message)
@@ -0,0 +1,157 @@
+"""
+Метрики шины сообщений: задержка каскада по типу сообщения и каждого обработчика, повторы
+и ошибки обработчиков, максимальная глубина очереди каскада. Экспорт - текстовый формат Prometheus
+(entrypoints/routes/metrics_route.py).
+"""
+import abc
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# верхние границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def handler_name(handler: Callable) -> str:
+    """
+    Метка обработчика: имя функции или класса обработчика (обработчики в handlers.py - объекты с __call__)
+    """
+    handler = getattr(handler, "func", handler)  # functools.partial
+    return getattr(handler, "__name__", None) or type(handler).__name__
+
+
+class AbstractBusMetrics(abc.ABC):
+    """
+    Хуки шины; вызываются после обработки, исключения в них не ожидаются
+    """
+    @abc.abstractmethod
+    def observe_handle(self, message_type: type, seconds: float, max_queue_depth: int):
+        """
+        Весь handle: сообщение и порожденный им каскад; max_queue_depth - максимум сообщений в очереди
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def observe_handler(self, message_type: type, handler: Callable, seconds: float, attempts: int, failed: bool):
+        """
+        Один обработчик сообщения со всеми повторами: attempts - сколько раз он вызывался,
+        failed - ошибка осталась после всех попыток
+        """
+        raise NotImplementedError
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterable[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip((*map(str, self.buckets), "+Inf"), self.counts):
+            total += count
+            yield bound, total
+
+
+class BusMetrics(AbstractBusMetrics):
+    """
+    Метрики в памяти процесса; одним объектом могут пользоваться несколько шин и потоков
+    """
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.handle_seconds: Dict[str, Histogram] = {}  # тип сообщения -> задержка каскада
+        self.handler_seconds: Dict[Tuple[str, str], Histogram] = {}  # (тип сообщения, обработчик) -> задержка
+        self.handler_retries: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.handler_failures: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.max_queue_depth: Dict[str, int] = defaultdict(int)
+        self._handler_keys: Dict[Tuple[type, Callable], Tuple[str, str]] = {}  # метки считаются один раз
+
+    def observe_handle(self, message_type: type, seconds: float, max_queue_depth: int):
+        name = message_type.__name__
+        with self._lock:
+            self._histogram(self.handle_seconds, name).observe(seconds)
+            if max_queue_depth > self.max_queue_depth[name]:
+                self.max_queue_depth[name] = max_queue_depth
+
+    def observe_handler(self, message_type: type, handler: Callable, seconds: float, attempts: int, failed: bool):
+        key = self._handler_keys.get((message_type, handler))
+        if key is None:
+            key = self._handler_keys[(message_type, handler)] = (message_type.__name__, handler_name(handler))
+        with self._lock:
+            self._histogram(self.handler_seconds, key).observe(seconds)
+            if attempts > 1:
+                self.handler_retries[key] += attempts - 1
+            if failed:
+                self.handler_failures[key] += 1
+
+    def _histogram(self, histograms: Dict, key) -> Histogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def render(self) -> str:
+        """
+        Текстовый формат экспозиции Prometheus (text/plain; version=0.0.4)
+        """
+        lines: List[str] = []
+        with self._lock:
+            _render_histograms(
+                lines, "allocation_bus_handle_seconds", "Message and its cascade handling time",
+                {(("message", name),): h for name, h in self.handle_seconds.items()},
+            )
+            _render_histograms(
+                lines, "allocation_bus_handler_seconds", "Handler time including retries",
+                {_handler_labels(key): h for key, h in self.handler_seconds.items()},
+            )
+            _render_values(
+                lines, "allocation_bus_handler_retries_total", "counter", "Handler retries (repeated calls)",
+                {_handler_labels(key): v for key, v in self.handler_retries.items()},
+            )
+            _render_values(
+                lines, "allocation_bus_handler_failures_total", "counter", "Handler failures after all retries",
+                {_handler_labels(key): v for key, v in self.handler_failures.items()},
+            )
+            _render_values(
+                lines, "allocation_bus_queue_depth_max", "gauge", "Maximum cascade queue depth",
+                {(("message", name),): v for name, v in self.max_queue_depth.items()},
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _handler_labels(key: Tuple[str, str]) -> Tuple[Tuple[str, str], ...]:
+    message, handler = key
+    return ("message", message), ("handler", handler)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _render_values(lines: List[str], name: str, kind: str, help_text: str, values: Dict):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in sorted(values.items()):
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+
+def _render_histograms(lines: List[str], name: str, help_text: str, histograms: Dict):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, histogram in sorted(histograms.items()):
+        for bound, count in histogram.cumulative():
+            lines.append(f"{name}_bucket{_format_labels((*labels, ('le', bound)))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
@@ -0,0 +1,107 @@
+"""
+Офлайн-планировщик размещения (what-if): как большой файл товарных позиций
+разошелся бы по текущим партиям, если бы размещался через Product.allocate.
+
+Ничего не меняет в агрегатах и БД: партии каждого артикула выгружаются в массивы
+(закупленное кол-во, размещенное кол-во; порядок - по eta), дальше работаем только с ними.
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from src.allocation.models import domain
+from src.allocation.services import unit_of_work
+
+
+@dataclass
+class SkuBatches:
+    """
+    Партии одного артикула в виде массивов, упорядоченных по eta (как Product.batches_by_eta)
+    """
+    refs: List[str]
+    purchased: np.ndarray
+    allocated: np.ndarray
+
+    @classmethod
+    def from_product(cls, product: domain.Product) -> "SkuBatches":
+        batches = product.batches_by_eta
+        return cls(
+            refs=[b.reference for b in batches],
+            purchased=np.fromiter((b._purchased_quantity for b in batches), dtype=np.int64, count=len(batches)),
+            allocated=np.fromiter((b.allocated_quantity for b in batches), dtype=np.int64, count=len(batches)),
+        )
+
+    @property
+    def available(self) -> np.ndarray:
+        return self.purchased - self.allocated
+
+
+@dataclass
+class AllocationPlan:
+    batchrefs: List[Optional[str]]  # партия для каждой позиции в порядке входа, None - нет в наличии
+    out_of_stock: List[domain.OrderLine] = field(default_factory=list)
+
+
+def plan_sku(available: np.ndarray, qtys: np.ndarray) -> np.ndarray:
+    """
+    Правило Product.allocate (первая по eta партия, куда позиция влезает) для позиций одного артикула;
+    возвращает индекс партии для каждой позиции, -1 - нет в наличии.
+
+    Позиции идут сериями: пока позиция не влезает ни в одну более раннюю партию
+    (qty > максимума доступного в них) и накопленная сумма помещается в партию b,
+    вся серия уходит в b - это считается одним cumsum без цикла по позициям.
+    """
+    available = available.astype(np.int64, copy=True)
+    qtys = np.asarray(qtys, dtype=np.int64)
+    result = np.full(len(qtys), -1, dtype=np.int64)
+    window = 16  # растет вместе с длиной серий, чтобы короткие серии не стоили O(n) каждая
+    i = 0
+    while i < len(qtys):
+        fits = available >= qtys[i]
+        if not fits.any():
+            i += 1
+            continue
+        b = int(fits.argmax())
+        earlier_max = available[:b].max() if b else np.iinfo(np.int64).min
+        chunk = qtys[i:i + window]
+        cumulative = np.cumsum(chunk)
+        in_run = (chunk > earlier_max) & (cumulative <= available[b])
+        run = len(chunk) if in_run.all() else int(in_run.argmin())
+        result[i:i + run] = b
+        available[b] -= cumulative[run - 1]
+        i += run
+        window = max(16, run * 2)
+    return result
+
+
+def plan(products: Iterable[domain.Product], lines: Sequence[domain.OrderLine]) -> AllocationPlan:
+    """
+    Позиции с неизвестным артикулом считаются отсутствующими в наличии
+    """
+    batches_by_sku: Dict[str, SkuBatches] = {p.sku: SkuBatches.from_product(p) for p in products}
+    indexes_by_sku = defaultdict(list)
+    for i, line in enumerate(lines):
+        indexes_by_sku[line.sku].append(i)
+
+    batchrefs: List[Optional[str]] = [None] * len(lines)
+    for sku, indexes in indexes_by_sku.items():
+        sku_batches = batches_by_sku.get(sku)
+        if sku_batches is None:
+            continue
+        qtys = np.fromiter((lines[i].qty for i in indexes), dtype=np.int64, count=len(indexes))
+        for i, position in zip(indexes, plan_sku(sku_batches.available, qtys).tolist()):
+            if position >= 0:
+                batchrefs[i] = sku_batches.refs[position]
+
+    out_of_stock = [line for line, ref in zip(lines, batchrefs) if ref is None]
+    return AllocationPlan(batchrefs=batchrefs, out_of_stock=out_of_stock)
+
+
+def plan_from_repository(uow: unit_of_work.AbstractUnitOfWork, lines: Sequence[domain.OrderLine]) -> AllocationPlan:
+    """
+    Загружает текущие партии нужных артикулов через uow и строит план; транзакция откатывается
+    """
+    with uow:
+        return plan(uow.products.get_many(line.sku for line in lines), lines)
@@ -1,19 +1,115 @@
 import abc
+import contextvars
+import enum
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
 
-from sqlalchemy import create_engine
+from loguru import logger
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+from tenacity import AsyncRetrying, Retrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
+from src.allocation.adapters import database, orm, repository
+from src.allocation.adapters.outbox import Outbox
 from src.allocation.core import config
-from src.allocation.adapters import repository
+from src.allocation.models.exceptions import ConcurrencyConflict
 
-DEFAULT_SESSION_FACTORY = sessionmaker(bind=create_engine(
-    config.get_postgres_uri(),
-    isolation_level="REPEATABLE READ"  # уровень изолированности транзакции
-))
+# SQLSTATE, при которых транзакцию достаточно повторить: serialization_failure и deadlock_detected
+RETRYABLE_PGCODES = {"40001", "40P01"}
+
+
+class ConcurrencyMode(str, enum.Enum):
+    ISOLATION = "isolation"  # REPEATABLE READ: конкурентное изменение продукта отклоняет сама БД
+    OPTIMISTIC = "optimistic"  # READ COMMITTED + проверка products.version в UPDATE при commit
+
+
+def make_session_factory(mode: ConcurrencyMode = ConcurrencyMode.ISOLATION, uri: Optional[str] = None) -> sessionmaker:
+    isolation_level = "REPEATABLE READ" if mode == ConcurrencyMode.ISOLATION else "READ COMMITTED"
+    return sessionmaker(bind=database.create_db_engine(
+        uri,
+        isolation_level=isolation_level  # уровень изолированности транзакции
+    ))
+
+
+def make_async_session_factory(mode: ConcurrencyMode = ConcurrencyMode.ISOLATION, uri: Optional[str] = None) -> sessionmaker:
+    isolation_level = "REPEATABLE READ" if mode == ConcurrencyMode.ISOLATION else "READ COMMITTED"
+    return sessionmaker(
+        bind=database.create_async_db_engine(uri, isolation_level=isolation_level),
+        class_=AsyncSession,
+        expire_on_commit=False,  # иначе обращение к атрибутам после commit - ленивая загрузка, которой в async нет
+    )
+
+
+def make_read_only_engine(uri: Optional[str] = None) -> Engine:
+    """
+    Engine для представлений: свой пул, READ COMMITTED и транзакции READ ONLY
+    """
+    return database.create_db_engine(
+        uri or config.get_postgres_read_uri(),
+        isolation_level="READ COMMITTED",
+        execution_options={"postgresql_readonly": True},
+    )
+
+
+def make_async_read_only_engine(uri: Optional[str] = None) -> AsyncEngine:
+    return database.create_async_db_engine(
+        uri or config.get_postgres_async_read_uri(),
+        isolation_level="READ COMMITTED",
+        execution_options={"postgresql_readonly": True},
+    )
+
+
+DEFAULT_SESSION_FACTORY = make_session_factory(ConcurrencyMode.ISOLATION)
+DEFAULT_ASYNC_SESSION_FACTORY = make_async_session_factory(ConcurrencyMode.ISOLATION)
+
+
+@dataclass(frozen=True)
+class ConflictRetryPolicy:
+    """
+    Повтор команды целиком (новая транзакция, свежий продукт) при ConcurrencyConflict;
+    паузы между попытками - экспонента со случайным разбросом, чтобы конкуренты не сталкивались снова
+    """
+    max_attempts: int = 5
+    base_delay: float = 0.01  # секунды
+    max_delay: float = 0.5
+
+    def retrying(self) -> Retrying:
+        return Retrying(**self._retry_options())
+
+    def async_retrying(self) -> AsyncRetrying:
+        # паузы через asyncio.sleep: event loop не блокируется
+        return AsyncRetrying(**self._retry_options())
+
+    def _retry_options(self) -> dict:
+        return dict(
+            retry=retry_if_exception_type(ConcurrencyConflict),
+            stop=stop_after_attempt(self.max_attempts),
+            wait=wait_random_exponential(multiplier=self.base_delay, max=self.max_delay),
+            before_sleep=lambda state: logger.warning(
+                f'Concurrency conflict, retrying (attempt {state.attempt_number}): {state.outcome.exception()}'
+            ),
+            reraise=True,
+        )
+
+
+def as_concurrency_conflict(error: Exception) -> Optional[ConcurrencyConflict]:
+    """
+    ConcurrencyConflict, если ошибка commit'а означает конкурентное изменение продукта, иначе None
+    """
+    if isinstance(error, StaleDataError):  # UPDATE products ... WHERE version = ... не нашел строку
+        return ConcurrencyConflict(str(error))
+    if isinstance(error, DBAPIError) and getattr(error.orig, "pgcode", None) in RETRYABLE_PGCODES:
+        return ConcurrencyConflict(str(error.orig))
+    return None
 
 
 class AbstractUnitOfWork(abc.ABC):
     products: repository.AbstractRepository  # access to product (bathes with required sku) in repo
+    conflict_retry: Optional[ConflictRetryPolicy] = None  # без политики конфликт сразу уходит наверх
+    outbox: Optional[Outbox] = None  # события для Redis пишутся в outbox при commit, а не публикуются шиной
 
     # for contextmanager style
     def __enter__(self, *args):
@@ -26,6 +122,16 @@ class AbstractUnitOfWork(abc.ABC):
         # фиксируем изменения, затем проверяем event'ы у продукта и запускаем их, если требуется
         self._commit()
 
+    def with_conflict_retry(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Выполняет fn (обработчик, открывающий свою транзакцию через этот uow) с повтором при ConcurrencyConflict
+        """
+        if self.conflict_retry is None:
+            return fn(*args, **kwargs)
+        for attempt in self.conflict_retry.retrying():
+            with attempt:
+                return fn(*args, **kwargs)
+
     def collect_new_events(self):
         # uow collects all events itself
         for product in self.products.seen:
@@ -42,20 +148,208 @@ class AbstractUnitOfWork(abc.ABC):
 
 
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
+    def __init__(
+        self,
+        session_factory=DEFAULT_SESSION_FACTORY,
+        product_cache: Optional[repository.ProductCache] = None,
+        loading_strategy: repository.LoadingStrategy = repository.LoadingStrategy.SELECTIN,
+        conflict_retry: Optional[ConflictRetryPolicy] = None,
+        outbox: Optional[Outbox] = None,
+    ):
         self.session_factory = session_factory
+        self.conflict_retry = conflict_retry
+        self.outbox = outbox
+        self.product_cache = product_cache  # общий кэш продуктов, если нужен
+        self.loading_strategy = loading_strategy
+
+    @property
+    def engine(self) -> Engine:
+        return self.session_factory.kw["bind"]
 
     def __enter__(self):  # on contextmanager entry; connecting to db and creating copy of real repo
         self.session = self.session_factory()  # type sqla.Session
-        self.products = repository.SqlAlchemyRepository(self.session)
+        self._committed = False
+        self._staged_events = set()  # id событий, уже записанных в outbox в этой транзакции
+        if self.product_cache is None:
+            self.products = repository.SqlAlchemyRepository(self.session, self.loading_strategy)
+        else:
+            # после commit продукты должны остаться загруженными, чтобы попасть в кэш
+            self.session.expire_on_commit = False
+            self.products = repository.CachingSqlAlchemyRepository(
+                self.session, self.product_cache, self.loading_strategy
+            )
         return super().__enter__()
 
     def __exit__(self, *args): # on contextmanager exit; close session
         super().__exit__(*args)
         self.session.close()
+        if self.product_cache is not None and self._committed:
+            self.products.cache_seen()
 
     def _commit(self):
-        self.session.commit()
+        if self.outbox is not None:
+            rows = self.outbox.rows(self.products.seen, self._staged_events)
+            if rows:
+                self.session.execute(orm.outbox.insert(), rows)
+        try:
+            self.session.commit()
+        except (StaleDataError, DBAPIError) as e:
+            conflict = as_concurrency_conflict(e)
+            if conflict is None:
+                raise
+            raise conflict from e
+        self._committed = True
 
     def rollback(self):
         self.session.rollback()
+
+
+class AbstractAsyncUnitOfWork(abc.ABC):
+    """
+    Асинхронный вариант AbstractUnitOfWork: async with uow, await uow.commit()
+    """
+    products: repository.AbstractAsyncRepository
+    conflict_retry: Optional[ConflictRetryPolicy] = None
+    outbox: Optional[Outbox] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.rollback()
+
+    async def commit(self):
+        await self._commit()
+
+    async def with_conflict_retry(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        if self.conflict_retry is None:
+            return await fn(*args, **kwargs)
+        async for attempt in self.conflict_retry.async_retrying():
+            with attempt:
+                return await fn(*args, **kwargs)
+
+    def collect_new_events(self):
+        for product in self.products.seen:
+            while product.events:
+                yield product.events.pop(0)
+
+    @abc.abstractmethod
+    async def _commit(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def rollback(self):
+        raise NotImplementedError
+
+
+class AsyncSqlAlchemyUnitOfWork(AbstractAsyncUnitOfWork):
+    """
+    Один экземпляр обслуживает конкурентные запросы event loop'а: сессия и репозиторий
+    лежат в ContextVar, поэтому у каждой asyncio-задачи (запроса) они свои
+    """
+    def __init__(
+        self,
+        session_factory: Optional[sessionmaker] = None,
+        loading_strategy: repository.LoadingStrategy = repository.LoadingStrategy.SELECTIN,
+        conflict_retry: Optional[ConflictRetryPolicy] = None,
+        outbox: Optional[Outbox] = None,
+    ):
+        self.session_factory = session_factory or DEFAULT_ASYNC_SESSION_FACTORY
+        self.loading_strategy = loading_strategy
+        self.conflict_retry = conflict_retry
+        self.outbox = outbox
+        # (session, products, id событий, уже записанных в outbox)
+        self._state = contextvars.ContextVar(f"async_uow_{id(self)}", default=None)
+
+    @property
+    def engine(self) -> AsyncEngine:
+        return self.session_factory.kw["bind"]
+
+    @property
+    def session(self) -> AsyncSession:
+        return self._state.get()[0]
+
+    @property
+    def products(self) -> repository.AsyncSqlAlchemyRepository:
+        return self._state.get()[1]
+
+    async def __aenter__(self):
+        session = self.session_factory()
+        self._state.set((session, repository.AsyncSqlAlchemyRepository(session, self.loading_strategy), set()))
+        return await super().__aenter__()
+
+    async def __aexit__(self, *args):
+        await super().__aexit__(*args)
+        await self.session.close()
+
+    def collect_new_events(self):
+        if self._state.get() is None:  # в этой задаче uow еще не открывали
+            return
+        yield from super().collect_new_events()
+
+    async def _commit(self):
+        if self.outbox is not None:
+            rows = self.outbox.rows(self.products.seen, self._state.get()[2])
+            if rows:
+                await self.session.execute(orm.outbox.insert(), rows)
+        try:
+            await self.session.commit()
+        except (StaleDataError, DBAPIError) as e:
+            conflict = as_concurrency_conflict(e)
+            if conflict is None:
+                raise
+            raise conflict from e
+
+    async def rollback(self):
+        await self.session.rollback()
+
+
+class ReadOnlyUnitOfWork:
+    """
+    Для запросов к представлениям: голое соединение без сессии, репозитория и событий,
+    транзакция только на чтение и всегда откатывается. Соединение лежит в ContextVar,
+    поэтому один экземпляр можно использовать из нескольких потоков threadpool'а
+    """
+    def __init__(self, engine: Optional[Engine] = None):
+        self.engine = engine or make_read_only_engine()
+        self._state = contextvars.ContextVar(f"read_only_uow_{id(self)}", default=None)  # (connection, transaction)
+
+    @property
+    def connection(self) -> Connection:
+        return self._state.get()[0]
+
+    def __enter__(self):
+        connection = self.engine.connect()
+        self._state.set((connection, connection.begin()))
+        return self
+
+    def __exit__(self, *args):
+        connection, transaction = self._state.get()
+        self._state.set(None)
+        transaction.rollback()
+        connection.close()
+
+
+class AsyncReadOnlyUnitOfWork:
+    """
+    То же для async-маршрутов
+    """
+    def __init__(self, engine: Optional[AsyncEngine] = None):
+        self.engine = engine or make_async_read_only_engine()
+        self._state = contextvars.ContextVar(f"async_read_only_uow_{id(self)}", default=None)
+
+    @property
+    def connection(self) -> AsyncConnection:
+        return self._state.get()[0]
+
+    async def __aenter__(self):
+        connection = self.engine.connect()
+        await connection.start()
+        self._state.set((connection, await connection.begin()))
+        return self
+
+    async def __aexit__(self, *args):
+        connection, transaction = self._state.get()
+        self._state.set(None)
+        await transaction.rollback()
+        await connection.close()
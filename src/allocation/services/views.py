@@ -1,23 +1,56 @@
+import functools
+from typing import Optional
+
+from sqlalchemy import bindparam, delete, select, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql import Insert
+
+from src.allocation.adapters import orm
 from src.allocation.services import unit_of_work
 
+# выражения строятся один раз при импорте; их же используют обработчики, обновляющие представление
+ALLOCATIONS_BY_ORDER = text("SELECT sku, batchref FROM allocations_view WHERE order_id = :orderid")
+ALLOCATION_BY_ORDER_AND_SKU = text(
+    "SELECT sku, batchref FROM allocations_view WHERE order_id = :orderid and sku = :sku"
+)
+UPSERT_ALLOCATION = text(
+    'INSERT INTO allocations_view (order_id, sku, batchref)'
+    ' VALUES (:order_id, :sku, :batchref)'
+    ' ON CONFLICT (order_id, sku) DO UPDATE SET batchref = EXCLUDED.batchref'
+)
+DELETE_ALLOCATION = text('DELETE FROM allocations_view WHERE order_id = :order_id AND sku = :sku')
+# пакетные варианты для AllocationsViewBuffer: все ключи одним DELETE, все строки одним executemany
+DELETE_ALLOCATIONS = delete(orm.allocations_view).where(
+    tuple_(orm.allocations_view.c.order_id, orm.allocations_view.c.sku).in_(bindparam("keys", expanding=True))
+)
+SKU_BY_BATCHREF = select(orm.batches.c.sku).where(orm.batches.c.reference == bindparam("batchref"))
+
+
+@functools.lru_cache()
+def upsert_allocations(dialect_name: str) -> Insert:
+    """
+    INSERT ... ON CONFLICT для executemany; psycopg2 отправляет строки пачками multi-row VALUES
+    """
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    statement = insert(orm.allocations_view)
+    return statement.on_conflict_do_update(
+        index_elements=[orm.allocations_view.c.order_id, orm.allocations_view.c.sku],
+        set_=dict(batchref=statement.excluded.batchref),
+    )
+
+
+def allocations(uow: unit_of_work.ReadOnlyUnitOfWork, order_id: str):
+    with uow:
+        results = uow.connection.execute(ALLOCATIONS_BY_ORDER, dict(orderid=order_id))
+        return [dict(r) for r in results.mappings()]
+
 
-def allocations(uow: unit_of_work.SqlAlchemyUnitOfWork, order_id: str):
+def allocation(uow: unit_of_work.ReadOnlyUnitOfWork, order_id: str, sku: str):
     with uow:
-        results = uow.session.execute(
-            """
-            SELECT sku, batchref FROM allocations_view WHERE order_id = :orderid
-            """,
-            dict(orderid=order_id),
-        )
-    return [dict(r) for r in results]
+        result = uow.connection.execute(ALLOCATION_BY_ORDER_AND_SKU, dict(orderid=order_id, sku=sku))
+        return dict(result.all())
 
 
-def allocation(uow: unit_of_work.SqlAlchemyUnitOfWork, order_id: str, sku: str):
+def sku_by_batchref(uow: unit_of_work.ReadOnlyUnitOfWork, batchref: str) -> Optional[str]:
     with uow:
-        result = uow.session.execute(
-            """
-            SELECT sku, batchref FROM allocations_view WHERE order_id = :orderid and sku = :sku
-            """,
-            dict(orderid=order_id, sku=sku),
-        )
-    return dict(result)
+        return uow.connection.execute(SKU_BY_BATCHREF, dict(batchref=batchref)).scalar()
@@ -0,0 +1,126 @@
+"""
+Пропускная способность ядра шины сообщений (сообщений в секунду) на пустых обработчиках,
+без БД: команда порождает каскад из events событий, у каждого события handlers обработчиков.
+Меряются только очередь, диспетчеризация, повторы и логирование MessageBus / AsyncMessageBus.
+
+Логи уровня DEBUG выключены (sink с уровнем INFO), как в продакшене; --debug-log включает их
+в /dev/null, чтобы увидеть цену форматирования; --metrics подключает BusMetrics, чтобы увидеть цену хуков.
+
+Запуск из корня репозитория:
+    python -m tests.benchmarks.bench_bus --output bench_bus.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import time
+from typing import Dict, List
+
+from loguru import logger
+
+from src.allocation.models import commands, domain, events
+from src.allocation.services import messagebus, metrics
+from tests.fake_services import FakeUnitOfWork
+
+EVENT_COUNTS = [1, 100, 10_000]
+HANDLER_COUNTS = [1, 3]
+
+
+def make_bus(bus_class, event_count: int, handler_count: int, with_metrics: bool):
+    uow = FakeUnitOfWork()
+    product = domain.Product("BENCH", [])
+    uow.products.seen.add(product)
+    cascade = [events.Allocated(f"order-{i}", "BENCH", 1, "batch") for i in range(event_count)]
+
+    def command_handler(command):
+        product.events.extend(cascade)
+        return "batch"
+
+    async def async_command_handler(command):
+        return command_handler(command)
+
+    async def async_event_handler(event):
+        pass
+
+    is_async = bus_class is messagebus.AsyncMessageBus
+    event_handler = async_event_handler if is_async else (lambda event: None)
+    return bus_class(
+        uow,
+        {events.Allocated: [event_handler] * handler_count},
+        {commands.Allocate: async_command_handler if is_async else command_handler},
+        metrics=metrics.BusMetrics() if with_metrics else None,
+    )
+
+
+def bench(bus_class, event_count: int, handler_count: int, min_seconds: float, with_metrics: bool) -> Dict[str, float]:
+    bus = make_bus(bus_class, event_count, handler_count, with_metrics)
+    command = commands.Allocate("order", "BENCH", 1)
+    is_async = bus_class is messagebus.AsyncMessageBus
+
+    async def handle_async(rounds):
+        for _ in range(rounds):
+            await bus.handle(command)
+
+    def handle(rounds):
+        if is_async:
+            asyncio.run(handle_async(rounds))
+        else:
+            for _ in range(rounds):
+                bus.handle(command)
+
+    rounds, elapsed = 1, 0.0
+    while elapsed < min_seconds:  # удваиваем кол-во команд, пока замер не станет достаточно длинным
+        rounds *= 2
+        start = time.perf_counter()
+        handle(rounds)
+        elapsed = time.perf_counter() - start
+    messages = rounds * (1 + event_count)
+    return {
+        "messages": messages,
+        "seconds": elapsed,
+        "messages_per_second": messages / elapsed,
+        "handler_calls_per_second": rounds * (1 + event_count * handler_count) / elapsed,
+    }
+
+
+def run(min_seconds: float, with_metrics: bool) -> List[Dict]:
+    results = []
+    for bus_class, event_count, handler_count in itertools.product(
+        (messagebus.MessageBus, messagebus.AsyncMessageBus), EVENT_COUNTS, HANDLER_COUNTS
+    ):
+        params = {"events": event_count, "handlers": handler_count}
+        results.append({"name": bus_class.__name__, "params": params,
+                        **bench(bus_class, event_count, handler_count, min_seconds, with_metrics)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="bench_bus.json", help="куда записать результаты (JSON)")
+    parser.add_argument("--min-seconds", type=float, default=0.5, help="минимальная длительность замера")
+    parser.add_argument("--debug-log", action="store_true", help="писать debug-логи шины (в /dev/null)")
+    parser.add_argument("--metrics", action="store_true", help="собирать метрики шины (BusMetrics)")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(open(os.devnull, "w"), level="DEBUG" if args.debug_log else "INFO")
+    results = run(args.min_seconds, args.metrics)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "debug_log": args.debug_log,
+        "metrics": args.metrics,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for r in results:
+        print(f"{r['name']:<16} {json.dumps(r['params']):<32} {r['messages_per_second']:>12.0f} msg/s")
+    print(f"written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
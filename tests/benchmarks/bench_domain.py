@@ -0,0 +1,167 @@
+"""
+Микро-бенчмарки горячих путей предметной области без БД и Redis:
+Product.allocate, Product.deallocate, Product.change_batch_quantity
+и полный каскад MessageBus.handle(commands.Allocate) на FakeUnitOfWork.
+
+Параметры перебираются сеткой: кол-во партий, размещений на партию и артикулов;
+результаты пишутся в JSON, чтобы сравнивать прогоны между собой.
+
+Запуск из корня репозитория:
+    python -m tests.benchmarks.bench_domain --output bench_domain.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, List
+
+from loguru import logger
+
+from src.allocation import bootstrap
+from src.allocation.models import commands, domain
+from src.allocation.services import messagebus
+from tests import fake_services
+
+BATCH_COUNTS = [1, 10, 100, 1000]
+ALLOCATIONS_PER_BATCH = [0, 10, 100]
+SKU_COUNTS = [1, 10, 100]
+
+
+def make_product(sku: str, batch_count: int, allocations_per_batch: int) -> domain.Product:
+    """
+    Продукт с партиями с разной eta; в каждой партии allocations_per_batch позиций по 1 шт
+    и столько же свободного места
+    """
+    batches = []
+    for i in range(batch_count):
+        eta = None if i == 0 else date(2030, 1, 1) + timedelta(days=i)
+        batch = domain.Batch(f"{sku}-batch-{i}", sku, allocations_per_batch * 2 + 10, eta)
+        for j in range(allocations_per_batch):
+            batch.allocate(domain.OrderLine(f"{sku}-existing-{i}-{j}", sku, 1))
+        batches.append(batch)
+    return domain.Product(sku=sku, batches=batches)
+
+
+def fill_all_but_last(product: domain.Product, extra: int):
+    """
+    Все партии, кроме последней по eta, заполнены до конца: выбор партии проходит по всем партиям
+    """
+    for batch in product.batches[:-1]:
+        batch._purchased_quantity = batch.allocated_quantity
+    product.batches[-1]._purchased_quantity += extra
+
+
+def measure(op: Callable[[], None], setup: Callable[[], None] = None, repeat: int = 200) -> Dict[str, float]:
+    """
+    Время одного вызова op в микросекундах; setup (если есть) выполняется перед каждым вызовом вне замера
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        op()
+        timings.append((time.perf_counter() - start) * 1e6)
+    return {
+        "min_us": min(timings),
+        "median_us": statistics.median(timings),
+        "mean_us": statistics.fmean(timings),
+        "repeat": repeat,
+    }
+
+
+def bench_allocate(batch_count: int, allocations_per_batch: int, repeat: int) -> Dict[str, float]:
+    product = make_product("BENCH", batch_count, allocations_per_batch)
+    fill_all_but_last(product, repeat)
+    counter = itertools.count()
+    return measure(lambda: product.allocate(domain.OrderLine(f"order-{next(counter)}", "BENCH", 1)), repeat=repeat)
+
+
+def bench_deallocate(batch_count: int, allocations_per_batch: int, repeat: int) -> Dict[str, float]:
+    product = make_product("BENCH", batch_count, allocations_per_batch)
+    product.batches[-1]._purchased_quantity += repeat
+    lines = [domain.OrderLine(f"order-{i}", "BENCH", 1) for i in range(repeat)]
+    for line in lines:
+        product.allocate(line)
+    pending = iter(lines)
+    return measure(lambda: product.deallocate(next(pending)), repeat=repeat)
+
+
+def bench_change_batch_quantity(batch_count: int, allocations_per_batch: int, repeat: int) -> Dict[str, float]:
+    # каждый замер на свежем продукте: партия на складе уменьшается так, чтобы вытеснить половину позиций
+    state = {}
+
+    def setup():
+        state["product"] = make_product("BENCH", batch_count, allocations_per_batch)
+
+    def op():
+        product = state["product"]
+        batch = product.batches[0]
+        product.change_batch_quantity(batch.reference, batch.allocated_quantity // 2)
+
+    return measure(op, setup=setup, repeat=repeat)
+
+
+def bench_bus_allocate(batch_count: int, allocations_per_batch: int, sku_count: int, repeat: int) -> Dict[str, float]:
+    uow = fake_services.FakeUnitOfWork()
+    for s in range(sku_count):
+        product = make_product(f"BENCH-{s}", batch_count, allocations_per_batch)
+        fill_all_but_last(product, repeat)
+        uow.products.add(product)
+    uow.products.seen.clear()
+    bus = bootstrap.bootstrap(
+        start_orm=False,
+        uow=uow,
+        publish=lambda *args, **kwargs: None,
+        message_bus=messagebus.MessageBus,
+    )
+    target_sku = f"BENCH-{sku_count - 1}"
+    counter = itertools.count()
+    return measure(lambda: bus.handle(commands.Allocate(f"order-{next(counter)}", target_sku, 1)), repeat=repeat)
+
+
+def run(repeat: int) -> List[Dict]:
+    results = []
+    for batch_count, allocations_per_batch in itertools.product(BATCH_COUNTS, ALLOCATIONS_PER_BATCH):
+        params = {"batch_count": batch_count, "allocations_per_batch": allocations_per_batch}
+        results.append({"name": "product.allocate", "params": params,
+                        **bench_allocate(batch_count, allocations_per_batch, repeat)})
+        results.append({"name": "product.deallocate", "params": params,
+                        **bench_deallocate(batch_count, allocations_per_batch, repeat)})
+        if allocations_per_batch:
+            # change_batch_quantity строит продукт заново на каждый замер, поэтому повторов меньше
+            results.append({"name": "product.change_batch_quantity", "params": params,
+                            **bench_change_batch_quantity(batch_count, allocations_per_batch, max(repeat // 10, 5))})
+        for sku_count in SKU_COUNTS:
+            results.append({"name": "messagebus.handle(Allocate)", "params": {**params, "sku_count": sku_count},
+                            **bench_bus_allocate(batch_count, allocations_per_batch, sku_count, repeat)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="bench_domain.json", help="куда записать результаты (JSON)")
+    parser.add_argument("--repeat", type=int, default=200, help="кол-во замеров на сценарий")
+    args = parser.parse_args()
+
+    logger.remove()  # debug-логи шины в stderr исказили бы замеры
+    results = run(args.repeat)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for r in results:
+        print(f"{r['name']:<32} {json.dumps(r['params']):<70} median {r['median_us']:>10.1f} us")
+    print(f"written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Бенчмарк памяти: сколько байт занимает одна размещенная товарная позиция
+(OrderLine в партии + событие Allocated в product.events).
+
+Сравниваем события-dataclass со __slots__ (events.Allocated) с той же моделью,
+но с обычным __dict__ у каждого экземпляра (как было раньше).
+
+Запуск из корня репозитория:
+    python -m tests.benchmarks.bench_memory -n 10000
+"""
+import argparse
+import dataclasses
+import gc
+import tracemalloc
+from typing import Type
+
+from src.allocation.models import domain, events
+
+# та же модель события, но без __slots__ - состояние "до"
+DictAllocated = dataclasses.make_dataclass(
+    "DictAllocated", [("order_id", str), ("sku", str), ("qty", int), ("batchref", str)]
+)
+
+
+def bytes_per_line(event_cls: Type, lines_count: int) -> float:
+    """
+    Размещаем lines_count позиций в одной партии и создаем по событию на каждую;
+    возвращаем прирост памяти в пересчете на одну позицию
+    """
+    sku = "BENCH-SKU"
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+
+    batch = domain.Batch("bench-batch", sku, lines_count, eta=None)
+    product = domain.Product(sku, batches=[batch])
+    for i in range(lines_count):
+        line = domain.OrderLine(f"order-{i}", sku, 1)
+        batch.allocate(line)
+        product.events.append(event_cls(order_id=line.orderid, sku=sku, qty=line.qty, batchref=batch.reference))
+
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / lines_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--lines", type=int, default=10_000, help="кол-во размещаемых позиций")
+    args = parser.parse_args()
+
+    dict_based = bytes_per_line(DictAllocated, args.lines)
+    slotted = bytes_per_line(events.Allocated, args.lines)
+    print(f"lines: {args.lines}")
+    print(f"bytes per allocated line, __dict__ events: {dict_based:.1f}")
+    print(f"bytes per allocated line, __slots__ events: {slotted:.1f}")
+    print(f"saved: {dict_based - slotted:.1f} bytes/line ({(1 - slotted / dict_based) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Микро-бенчмарк накладных расходов Python на запрос: выражение, собираемое заново на каждый вызов
+(как было: select() со значениями внутри, text() из строки), против построенного один раз
+(repository.cached_statement, константы views) с параметрами через bindparam.
+
+Для каждого запроса два замера:
+    build - построить выражение и вычислить ключ кэша скомпилированного SQL (чистый Python);
+    execute - полный session.execute / connection.execute в SQLite в памяти, где сама БД почти ничего не стоит.
+
+Запуск из корня репозитория:
+    python -m tests.benchmarks.bench_statements --output bench_statements.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from sqlalchemy import create_engine, event, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from src.allocation.adapters import orm, repository
+from src.allocation.models import domain
+from src.allocation.services import views
+
+PRODUCTS = 100
+BATCHES_PER_PRODUCT = 5
+STRATEGY = repository.LoadingStrategy.SELECTIN
+
+
+def make_engine():
+    engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+
+    @event.listens_for(engine, "connect")
+    def attach_schema(dbapi_connection, _):
+        dbapi_connection.execute("ATTACH DATABASE ':memory:' AS public")
+
+    orm.metadata.create_all(engine)
+    return engine
+
+
+def seed(engine):
+    session = Session(bind=engine)
+    for p in range(PRODUCTS):
+        sku = f"sku-{p}"
+        batches = [domain.Batch(f"batch-{p}-{b}", sku, 100, None) for b in range(BATCHES_PER_PRODUCT)]
+        batches[0].allocate(domain.OrderLine(f"order-{p}", sku, 1))
+        session.add(domain.Product(sku, batches))
+    session.commit()
+    session.close()
+    with engine.begin() as connection:
+        connection.execute(views.UPSERT_ALLOCATION, [
+            dict(order_id=f"order-{p}", sku=f"sku-{p}", batchref=f"batch-{p}-0") for p in range(PRODUCTS)
+        ])
+
+
+def scenarios() -> Dict[str, Dict[str, Callable]]:
+    """
+    Имя запроса -> {"rebuilt" | "cached": () -> (выражение, параметры)}
+    """
+    sku, batchref, skus = "sku-42", "batch-42-0", [f"sku-{p}" for p in range(10)]
+    return {
+        "repository.get": {
+            "rebuilt": lambda: (repository.with_loading_strategy(
+                select(domain.Product).where(domain.Product.sku == sku), STRATEGY
+            ), {}),
+            "cached": lambda: (repository.cached_statement(repository.product_by_sku, STRATEGY), dict(sku=sku)),
+        },
+        "repository.get_by_batchref": {
+            "rebuilt": lambda: (repository.with_loading_strategy(
+                select(domain.Product).join(domain.Batch).where(domain.Batch.reference == batchref), STRATEGY
+            ), {}),
+            "cached": lambda: (
+                repository.cached_statement(repository.product_by_batchref, STRATEGY), dict(batchref=batchref)
+            ),
+        },
+        "repository.get_many": {
+            "rebuilt": lambda: (repository.with_loading_strategy(
+                select(domain.Product).where(domain.Product.sku.in_(set(skus))), STRATEGY
+            ), {}),
+            "cached": lambda: (repository.cached_statement(repository.products_by_skus, STRATEGY), dict(skus=skus)),
+        },
+        "views.allocations": {
+            "rebuilt": lambda: (
+                text("SELECT sku, batchref FROM allocations_view WHERE order_id = :orderid"), dict(orderid="order-42")
+            ),
+            "cached": lambda: (views.ALLOCATIONS_BY_ORDER, dict(orderid="order-42")),
+        },
+    }
+
+
+def measure(op: Callable[[], None], repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        op()
+        timings.append((time.perf_counter() - start) * 1e6)
+    return {
+        "min_us": min(timings),
+        "median_us": statistics.median(timings),
+        "mean_us": statistics.fmean(timings),
+    }
+
+
+def run(repeat: int) -> List[Dict]:
+    engine = make_engine()
+    orm.start_mappers()
+    seed(engine)
+    session = Session(bind=engine)
+    connection = engine.connect()
+    results = []
+    for name, variants in scenarios().items():
+        execute = connection.execute if name.startswith("views") else session.execute
+        for variant, make in variants.items():
+            def build():
+                statement, _ = make()
+                statement._generate_cache_key()  # то, что execute делает перед поиском в кэше компиляции
+
+            def run_query():
+                statement, params = make()
+                execute(statement, params).all()
+
+            run_query()  # прогрев кэша компиляции
+            results.append({"name": name, "variant": variant, "stage": "build", **measure(build, repeat)})
+            results.append({"name": name, "variant": variant, "stage": "execute", **measure(run_query, repeat)})
+            session.expunge_all()
+    connection.close()
+    session.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="bench_statements.json", help="куда записать результаты (JSON)")
+    parser.add_argument("--repeat", type=int, default=2000, help="кол-во замеров на сценарий")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for r in results:
+        print(f"{r['name']:<30} {r['variant']:<8} {r['stage']:<8} median {r['median_us']:>9.1f} us")
+    print(f"written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
+import asyncio
+
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, clear_mappers
+from sqlalchemy.pool import NullPool, StaticPool
 
 from src.allocation import bootstrap
 from src.allocation.core import config
@@ -10,15 +14,29 @@ from tests import fake_services
 
 
 @pytest.fixture
-def in_memory_db():
+def empty_in_memory_db():
     """
-    Возвращает engine к БД SQLite в RAM
+    Возвращает engine к пустой БД SQLite в RAM
     """
-    engine = create_engine("sqlite:///:memory:")
-    metadata.create_all(engine)  # создать таблицы в БД автоматически
+    engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)  # одно соединение - одна БД в RAM
+
+    @event.listens_for(engine, "connect")
+    def attach_schema(dbapi_connection, _):
+        # в SQLite нет схем, а таблицы в metadata лежат в схеме public
+        dbapi_connection.execute("ATTACH DATABASE ':memory:' AS public")
+
     return engine
 
 
+@pytest.fixture
+def in_memory_db(empty_in_memory_db):
+    """
+    Возвращает engine к БД SQLite в RAM
+    """
+    metadata.create_all(empty_in_memory_db)  # создать таблицы в БД автоматически
+    return empty_in_memory_db
+
+
 @pytest.fixture
 def sqlite_session(in_memory_db):
     """
@@ -29,6 +47,30 @@ def sqlite_session(in_memory_db):
     clear_mappers()
 
 
+@pytest.fixture
+def async_sqlite_session(tmp_path):
+    """
+    Файловая БД SQLite через aiosqlite (у каждого соединения своя БД в RAM, поэтому файл),
+    возвращает фабрику AsyncSession; тесты запускают корутины через asyncio.run
+    """
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'main.db'}", poolclass=NullPool)
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def attach_schema(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"ATTACH DATABASE '{tmp_path / 'public.db'}' AS public")
+        cursor.close()
+
+    async def create_tables():
+        async with engine.begin() as connection:
+            await connection.run_sync(metadata.create_all)
+
+    asyncio.run(create_tables())
+    start_mappers()
+    yield sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    clear_mappers()
+
+
 @pytest.fixture(scope="session")
 def postgres_db():
     """
@@ -101,3 +101,24 @@ class TestApiDeleteAllocation:
 
         assert res.status_code == 400
         assert res.json()["detail"] == f"Invalid stock-keeping: {unknown_sku}"
+
+
+class TestApiPostBatchesBulk:
+    """bulk batches upload by entrypoints tests"""
+    def test_non_positive_chunk_size_returns_422(self, postgres_db):
+        """
+        1. Загружаем файл партий с chunk_size=0 и с chunk_size=-5
+        ОР: оба запроса отклонены с 422, партия не загружена
+        """
+        sku, ref = random_sku(), random_batchref()
+        body = f"ref,sku,qty,eta\n{ref},{sku},10,\n"
+
+        for chunk_size in (0, -5):
+            res = requests.post(
+                f"{config.get_api_url()}/batches/bulk", params={"chunk_size": chunk_size}, data=body.encode()
+            )
+
+            assert res.status_code == 422
+
+        res = requests.post(_baseurl, json={"orderid": random_orderid(), "sku": sku, "qty": 1})
+        assert res.status_code == 400
@@ -16,10 +16,14 @@ class FakeRepository(repository.AbstractRepository):
     def __init__(self, products):
         super().__init__()
         self._products = set(products)
+        self.archived = []
 
     def _add(self, product):
         self._products.add(product)
 
+    def _archive(self, batches):
+        self.archived.extend(batches)
+
     def _get(self, sku):
         return next((p for p in self._products if p.sku == sku), None)
 
@@ -29,6 +33,12 @@ class FakeRepository(repository.AbstractRepository):
             if b.reference == batchref
         ), None)
 
+    def _get_many(self, skus):
+        return [p for p in self._products if p.sku in skus]
+
+    def _get_many_by_batchrefs(self, batchrefs):
+        return [p for p in self._products if any(b.reference in batchrefs for b in p.batches)]
+
 
 class FakeUnitOfWork(unit_of_work.AbstractUnitOfWork):
     session = FakeSession
@@ -49,9 +59,10 @@ class FakeMessageBus(messagebus.AbstractMessageBus):
         self,
         uow: unit_of_work.AbstractUnitOfWork,
         event_handlers: Dict[Type[events.Event], List[Callable]],
-        command_handlers: Dict[Type[commands.Command], Callable]
+        command_handlers: Dict[Type[commands.Command], Callable],
+        **kwargs,
     ):
-        super().__init__(uow, event_handlers, command_handlers)
+        super().__init__(uow, event_handlers, command_handlers, **kwargs)
         self.message_published = []
 
     def handle(self, message: messagebus.Message):
@@ -0,0 +1,61 @@
+from datetime import date
+
+from sqlalchemy import select
+
+from src.allocation import bootstrap
+from src.allocation.adapters import orm
+from src.allocation.models import domain
+from src.allocation.services import archival, unit_of_work
+
+
+def add_product(session_factory):
+    """
+    LAMP: закрытая партия (полностью размещена, eta прошла), неполная прошедшая и партия на складе
+    """
+    session = session_factory()
+    closed = domain.Batch("closed", "LAMP", 10, date(2020, 1, 1))
+    not_full = domain.Batch("not-full", "LAMP", 10, date(2020, 1, 1))
+    warehouse = domain.Batch("warehouse", "LAMP", 10, None)
+    closed.allocate(domain.OrderLine("o1", "LAMP", 4))
+    closed.allocate(domain.OrderLine("o2", "LAMP", 6))
+    not_full.allocate(domain.OrderLine("o3", "LAMP", 1))
+    warehouse.allocate(domain.OrderLine("o4", "LAMP", 10))
+    session.add(domain.Product("LAMP", [closed, not_full, warehouse]))
+    session.add(domain.Product("CHAIR", [domain.Batch("chair-batch", "CHAIR", 10, date(2020, 1, 1))]))
+    session.commit()
+    session.close()
+
+
+def rows(engine, *columns):
+    with engine.connect() as connection:
+        return sorted(connection.execute(select(*columns)).all())
+
+
+class TestArchival:
+    def test_archives_closed_batches_with_allocations_returns_ok(self, in_memory_db, sqlite_session):
+        """
+        1. В БД кладем продукт с закрытой партией (2 размещения), неполной прошедшей и партией на складе
+        2. Ищем артикулы с закрытыми партиями и архивируем их через шину
+        ОР: найден только LAMP; закрытая партия, ее размещения и позиции перенесены в архив,
+            в рабочих таблицах остались только активные партии, версия продукта выросла
+        """
+        add_product(sqlite_session)
+        uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory=sqlite_session)
+        bus = bootstrap.bootstrap(start_orm=False, uow=uow, publish=lambda *args: None)
+
+        assert archival.find_skus_with_closed_batches(uow, date(2021, 1, 1)) == ["LAMP"]
+        archived = archival.archive_closed_batches(bus, date(2021, 1, 1))
+
+        assert archived == {"LAMP": ["closed"]}
+        assert rows(in_memory_db, orm.batches.c.reference) == [("chair-batch",), ("not-full",), ("warehouse",)]
+        assert rows(in_memory_db, orm.order_lines.c.orderid) == [("o3",), ("o4",)]
+        assert len(rows(in_memory_db, orm.allocations.c.id)) == 2
+        assert rows(in_memory_db, orm.batches_archive.c.reference, orm.batches_archive.c.sku) == [("closed", "LAMP")]
+        assert rows(in_memory_db, orm.order_lines_archive.c.orderid) == [("o1",), ("o2",)]
+        assert len(rows(in_memory_db, orm.allocations_archive.c.orderline_id)) == 2
+
+        with uow:
+            product = uow.products.get("LAMP")
+            assert sorted(b.reference for b in product.batches) == ["not-full", "warehouse"]
+            assert product.version == 1
+        assert archival.find_skus_with_closed_batches(uow, date(2021, 1, 1)) == []
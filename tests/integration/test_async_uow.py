@@ -0,0 +1,98 @@
+import asyncio
+from datetime import date
+
+from src.allocation import bootstrap
+from src.allocation.models import commands, domain, events
+from src.allocation.services import async_views, unit_of_work
+
+
+async def add_product(session_factory, sku, *batches):
+    async with unit_of_work.AsyncSqlAlchemyUnitOfWork(session_factory) as uow:
+        uow.products.add(domain.Product(sku, [domain.Batch(ref, sku, qty, eta) for ref, qty, eta in batches]))
+        await uow.commit()
+
+
+class TestAsyncUnitOfWork:
+    def test_allocates_and_commits_returns_ok(self, async_sqlite_session):
+        """
+        1. В БД кладем продукт с партией
+        2. Через AsyncSqlAlchemyUnitOfWork размещаем позицию и фиксируем изменения
+        ОР: размещение сохранено, версия продукта выросла, событие Allocated собрано uow
+        """
+        async def scenario():
+            await add_product(async_sqlite_session, "LAMP", ("batch1", 100, None))
+            uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_sqlite_session)
+            async with uow:
+                product = await uow.products.get("LAMP")
+                batchref = product.allocate(domain.OrderLine("o1", "LAMP", 10))
+                await uow.commit()
+            new_events = list(uow.collect_new_events())
+
+            async with uow:
+                product = await uow.products.get_by_batchref("batch1")
+                return batchref, product.version, product.batches[0].available_quantity, new_events
+
+        batchref, version, available, new_events = asyncio.run(scenario())
+
+        assert batchref == "batch1"
+        assert (version, available) == (1, 90)
+        assert new_events == [events.Allocated("o1", "LAMP", 10, "batch1")]
+
+    def test_concurrent_tasks_get_own_sessions_returns_ok(self, async_sqlite_session):
+        """
+        1. В БД кладем два продукта
+        2. Две конкурентные задачи через один экземпляр uow размещают позиции каждая в своем продукте
+        ОР: у задач разные сессии, обе позиции размещены
+        """
+        uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_sqlite_session)
+
+        async def allocate(sku):
+            async with uow:
+                session = uow.session
+                await asyncio.sleep(0)  # даем второй задаче открыть свою сессию
+                product = await uow.products.get(sku)
+                product.allocate(domain.OrderLine(f"order-{sku}", sku, 5))
+                await uow.commit()
+                assert uow.session is session
+                return session
+
+        async def scenario():
+            await add_product(async_sqlite_session, "LAMP", ("lamp-batch", 10, None))
+            await add_product(async_sqlite_session, "CHAIR", ("chair-batch", 10, None))
+            sessions = await asyncio.gather(allocate("LAMP"), allocate("CHAIR"))
+            async with uow:
+                products = await uow.products.get_many(["LAMP", "CHAIR"])
+                return sessions, {p.sku: p.batches[0].available_quantity for p in products}
+
+        sessions, available = asyncio.run(scenario())
+
+        assert sessions[0] is not sessions[1]
+        assert available == {"LAMP": 5, "CHAIR": 5}
+
+
+class TestAsyncMessageBus:
+    def test_allocate_cascade_updates_view_returns_ok(self, async_sqlite_session):
+        """
+        1. Через AsyncMessageBus создаем партии и размещаем позицию
+        2. Читаем представление асинхронно
+        ОР: позиция в самой ранней партии, событие Allocated опубликовано и попало в allocations_view
+        """
+        published = []
+        bus = bootstrap.bootstrap_async(
+            start_orm=False,
+            uow=unit_of_work.AsyncSqlAlchemyUnitOfWork(async_sqlite_session),
+            publish=lambda channel, event: published.append(event),
+        )
+
+        async def scenario():
+            await bus.handle(commands.CreateBatch("late-batch", "LAMP", 100, date(2030, 1, 2)))
+            await bus.handle(commands.CreateBatch("early-batch", "LAMP", 100, date(2030, 1, 1)))
+            [batchref] = await bus.handle(commands.Allocate("o1", "LAMP", 10))
+            read_uow = unit_of_work.AsyncReadOnlyUnitOfWork(async_sqlite_session.kw["bind"])
+            return batchref, await async_views.allocations(read_uow, "o1")
+
+        batchref, view = asyncio.run(scenario())
+
+        assert batchref == "early-batch"
+        assert published == [events.Allocated("o1", "LAMP", 10, "early-batch")]
+        assert view == [{"sku": "LAMP", "batchref": "early-batch"}]
@@ -0,0 +1,116 @@
+import io
+import json
+from datetime import date
+
+import pytest
+from sqlalchemy import select, text
+
+from src.allocation.adapters import bulk_ingestion, orm
+
+
+def insert_product(engine, sku, version):
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO products (sku, version) VALUES (:sku, :version)"), dict(sku=sku, version=version))
+        connection.execute(
+            text("INSERT INTO batches (reference, sku, _purchased_quantity) VALUES (:ref, :sku, 10)"),
+            dict(ref=f"{sku}-existing", sku=sku),
+        )
+
+
+def fetch(engine, statement):
+    with engine.connect() as connection:
+        return connection.execute(statement).all()
+
+
+class TestBulkIngestion:
+    def test_ingests_csv_in_chunks_and_upserts_products_returns_ok(self, in_memory_db):
+        """
+        1. В БД есть продукт LAMP версии 3 с одной партией
+        2. Загружаем CSV пачками по 2 строки: новые партии LAMP и CHAIR, повтор reference, битая строка
+        ОР: вставлены только новые партии, CHAIR создан, версия LAMP выросла; повтор и битая строка посчитаны
+        """
+        insert_product(in_memory_db, "LAMP", 3)
+        manifest = io.StringIO(
+            "ref,sku,qty,eta\n"
+            "lamp-1,LAMP,100,2030-01-01\n"
+            "chair-1,CHAIR,20,\n"
+            "lamp-1,LAMP,100,2030-01-01\n"
+            "broken,LAMP,not-a-number,\n"
+            "LAMP-existing,LAMP,5,\n"
+            "chair-2,CHAIR,30,2030-02-01\n"
+        )
+        chunks = []
+
+        report = bulk_ingestion.ingest(in_memory_db, manifest, "csv", chunk_size=2, on_chunk=lambda r: chunks.append(r.rows))
+
+        assert (report.rows, report.inserted, report.duplicates, report.invalid) == (5, 3, 2, 1)
+        assert chunks == [2, 4, 5]
+        assert report.errors[0].startswith("Invalid row 5")
+        batches = fetch(in_memory_db, select(
+            orm.batches.c.reference, orm.batches.c.sku, orm.batches.c._purchased_quantity, orm.batches.c.eta
+        ).order_by(orm.batches.c.reference))
+        assert batches == [
+            ("LAMP-existing", "LAMP", 10, None),
+            ("chair-1", "CHAIR", 20, None),
+            ("chair-2", "CHAIR", 30, date(2030, 2, 1)),
+            ("lamp-1", "LAMP", 100, date(2030, 1, 1)),
+        ]
+        versions = dict(fetch(in_memory_db, select(orm.products.c.sku, orm.products.c.version)))
+        assert versions == {"LAMP": 4, "CHAIR": 1}  # пачка из одних повторов LAMP версию не меняет
+
+    def test_duplicates_keep_version_and_first_row_wins_returns_ok(self, in_memory_db):
+        """
+        1. В БД есть продукт LAMP версии 3 с партией LAMP-existing
+        2. Загружаем CSV из повтора LAMP-existing и двух строк lamp-1 с разным количеством
+        3. Загружаем тот же CSV повторно
+        ОР: вставлена первая строка lamp-1, версия LAMP выросла один раз; повторная загрузка версию не меняет
+        """
+        insert_product(in_memory_db, "LAMP", 3)
+        manifest = (
+            "ref,sku,qty,eta\n"
+            "LAMP-existing,LAMP,5,\n"
+            "lamp-1,LAMP,100,\n"
+            "lamp-1,LAMP,7,\n"
+        )
+
+        first = bulk_ingestion.ingest(in_memory_db, io.StringIO(manifest), "csv")
+        second = bulk_ingestion.ingest(in_memory_db, io.StringIO(manifest), "csv")
+
+        assert (first.inserted, first.duplicates) == (1, 2)
+        assert (second.inserted, second.duplicates) == (0, 3)
+        assert fetch(in_memory_db, select(
+            orm.batches.c.reference, orm.batches.c._purchased_quantity
+        ).order_by(orm.batches.c.reference)) == [("LAMP-existing", 10), ("lamp-1", 100)]
+        assert fetch(in_memory_db, select(orm.products.c.version)) == [(4,)]
+
+    def test_ingests_ndjson_returns_ok(self, in_memory_db):
+        """
+        1. Загружаем NDJSON с двумя партиями, пустой строкой и строкой с некорректным JSON
+        ОР: обе партии вставлены, некорректная строка посчитана
+        """
+        manifest = io.StringIO("\n".join([
+            json.dumps(dict(ref="b1", sku="SOFA", qty=5, eta=None)),
+            "",
+            "{not json",
+            json.dumps(dict(ref="b2", sku="SOFA", qty=7, eta="2030-03-01")),
+        ]))
+
+        report = bulk_ingestion.ingest(in_memory_db, manifest, "ndjson")
+
+        assert (report.rows, report.inserted, report.invalid) == (2, 2, 1)
+        assert fetch(in_memory_db, select(
+            orm.batches.c.reference, orm.batches.c._purchased_quantity
+        ).order_by(orm.batches.c.reference)) == [
+            ("b1", 5), ("b2", 7)
+        ]
+
+    def test_non_positive_chunk_size_is_rejected_returns_ok(self, in_memory_db):
+        """
+        1. Загружаем CSV с chunk_size 0 и -5
+        ОР: ValueError до записи в БД, а не пустая "успешная" загрузка или ошибка islice
+        """
+        for chunk_size in (0, -5):
+            with pytest.raises(ValueError, match="chunk_size must be positive"):
+                bulk_ingestion.ingest(in_memory_db, io.StringIO("ref,sku,qty,eta\nlamp-1,LAMP,1,\n"), "csv", chunk_size)
+
+        assert fetch(in_memory_db, select(orm.batches.c.reference)) == []
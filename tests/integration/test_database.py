@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import exc
+
+from src.allocation.adapters import database
+
+
+@pytest.fixture
+def small_pool_engine(tmp_path):
+    """
+    Engine к файлу SQLite с пулом на одно соединение без переполнения
+    """
+    engine = database.create_db_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}", pool_size=1, max_overflow=0, pool_timeout=0.05, pool_pre_ping=False
+    )
+    yield engine
+    engine.dispose()
+
+
+class TestPoolStatus:
+    def test_reports_in_use_and_checkouts_returns_ok(self, small_pool_engine):
+        """
+        1. Берем соединение из пула на одно соединение и смотрим состояние пула
+        2. Возвращаем соединение и снова смотрим состояние
+        ОР: пока соединение занято - in_use 1, после возврата - 0 и 1 простаивающее; выдача учтена
+        """
+        connection = small_pool_engine.connect()
+        busy = database.pool_status(small_pool_engine)
+        connection.close()
+        free = database.pool_status(small_pool_engine)
+
+        assert busy["pool_class"] == "InstrumentedQueuePool"
+        assert (busy["size"], busy["max_overflow"], busy["in_use"], busy["overflow"]) == (1, 0, 1, 0)
+        assert (free["in_use"], free["idle"]) == (0, 1)
+        assert free["checkouts"] == 1
+        assert free["in_use_max"] == 1
+
+    def test_counts_timeouts_and_wait_at_saturation_returns_ok(self, small_pool_engine):
+        """
+        1. Занимаем единственное соединение пула
+        2. Пытаемся взять второе
+        ОР: TimeoutError после pool_timeout, таймаут и время ожидания попали в статистику
+        """
+        with small_pool_engine.connect():
+            with pytest.raises(exc.TimeoutError):
+                small_pool_engine.connect()
+
+        status = database.pool_status(small_pool_engine)
+        assert status["timeouts"] == 1
+        assert status["wait_max_ms"] >= 50
+
+    def test_stats_survive_dispose_returns_ok(self, small_pool_engine):
+        """
+        1. Берем и возвращаем соединение, пересоздаем пул через dispose
+        ОР: счетчик выдач не обнулился, настройки пула сохранились
+        """
+        small_pool_engine.connect().close()
+        small_pool_engine.dispose()
+        small_pool_engine.connect().close()
+
+        status = database.pool_status(small_pool_engine)
+        assert status["checkouts"] == 2
+        assert (status["size"], status["max_overflow"]) == (1, 0)
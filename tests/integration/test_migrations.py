@@ -0,0 +1,42 @@
+from sqlalchemy import inspect
+
+from src.allocation.adapters import migrations, orm
+
+
+def index_names(engine, table):
+    return {i["name"] for i in inspect(engine).get_indexes(table.name, schema=orm.metadata.schema)}
+
+
+class TestMigrations:
+    def test_migrate_creates_schema_once_returns_ok(self, empty_in_memory_db):
+        """
+        1. Применяем миграции на пустой БД
+        2. Применяем миграции повторно
+        ОР: первый раз применены все миграции, второй - ни одной; индексы и PK на месте
+        """
+        applied = migrations.migrate(empty_in_memory_db)
+        applied_again = migrations.migrate(empty_in_memory_db)
+
+        assert [m.version for m in applied] == [m.version for m in migrations.MIGRATIONS]
+        assert applied_again == []
+        assert "ux_batches_reference" in index_names(empty_in_memory_db, orm.batches)
+        assert "ix_allocations_batch_id" in index_names(empty_in_memory_db, orm.allocations)
+        pk = inspect(empty_in_memory_db).get_pk_constraint("allocations_view", schema=orm.metadata.schema)
+        assert pk["constrained_columns"] == ["order_id", "sku"]
+
+    def test_migrate_adds_missing_indexes_to_existing_tables_returns_ok(self, in_memory_db):
+        """
+        1. Таблицы уже созданы (как раньше через create_all), индексов нет
+        2. Применяем миграции
+        ОР: индексы созданы на существующих таблицах
+        """
+        with in_memory_db.begin() as connection:
+            for index in orm.hot_query_indexes:
+                index.drop(connection)
+        assert "ix_batches_sku" not in index_names(in_memory_db, orm.batches)
+
+        migrations.migrate(in_memory_db)
+
+        expected = {index.name for index in orm.hot_query_indexes}
+        created = set().union(*(index_names(in_memory_db, t) for t in (orm.batches, orm.order_lines, orm.allocations)))
+        assert expected <= created
@@ -0,0 +1,122 @@
+import asyncio
+import json
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from src.allocation import bootstrap
+from src.allocation.adapters import orm, outbox
+from src.allocation.models import commands, domain
+from src.allocation.services import unit_of_work
+
+
+def outbox_rows(engine):
+    with engine.connect() as connection:
+        return connection.execute(select(orm.outbox).order_by(orm.outbox.c.id)).all()
+
+
+class TestOutbox:
+    def test_allocated_is_written_with_the_allocation_returns_ok(self, in_memory_db, sqlite_session):
+        """
+        1. Шина с outbox в UoW, публикация в Redis - функция, которая падает
+        2. Создаем партию и размещаем заказ
+        ОР: Allocated записан в outbox той же транзакцией, шина в Redis не публиковала
+        """
+        def publish(*args):
+            raise AssertionError("с outbox шина не публикует в Redis")
+
+        bus = bootstrap.bootstrap(
+            start_orm=False,
+            uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session, outbox=outbox.Outbox()),
+            publish=publish,
+        )
+        bus.handle(commands.CreateBatch("b1", "LAMP", 100, date(2030, 1, 1)))
+        bus.handle(commands.Allocate("o1", "LAMP", 10))
+
+        rows = outbox_rows(in_memory_db)
+        assert [row.channel for row in rows] == ["line_allocated"]
+        assert json.loads(rows[0].payload) == dict(order_id="o1", sku="LAMP", qty=10, batchref="b1")
+
+    def test_event_is_written_once_per_uow_returns_ok(self, in_memory_db, sqlite_session):
+        """
+        1. В одном UoW размещаем заказ, commit, размещаем второй, снова commit
+        ОР: в outbox 2 события - первое не записано повторно вторым commit
+        """
+        uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session, outbox=outbox.Outbox())
+        with uow:
+            uow.products.add(domain.Product("LAMP", [domain.Batch("b1", "LAMP", 100, None)]))
+            uow.commit()
+        with uow:
+            product = uow.products.get("LAMP")
+            product.allocate(domain.OrderLine("o1", "LAMP", 10))
+            uow.commit()
+            product.allocate(domain.OrderLine("o2", "LAMP", 10))
+            uow.commit()
+
+        assert [json.loads(row.payload)["order_id"] for row in outbox_rows(in_memory_db)] == ["o1", "o2"]
+
+    def test_async_uow_writes_outbox_returns_ok(self, async_sqlite_session):
+        """
+        1. Через AsyncSqlAlchemyUnitOfWork с outbox размещаем заказ и фиксируем изменения
+        ОР: Allocated записан в outbox
+        """
+        async def scenario():
+            uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_sqlite_session, outbox=outbox.Outbox())
+            async with uow:
+                uow.products.add(domain.Product("LAMP", [domain.Batch("b1", "LAMP", 100, None)]))
+                await uow.commit()
+            async with uow:
+                product = await uow.products.get("LAMP")
+                product.allocate(domain.OrderLine("o1", "LAMP", 10))
+                await uow.commit()
+            async with uow:
+                return (await uow.session.execute(select(orm.outbox.c.channel))).scalars().all()
+
+        assert asyncio.run(scenario()) == ["line_allocated"]
+
+
+class TestOutboxRelay:
+    def test_relay_publishes_in_batches_and_deletes_returns_ok(self, in_memory_db):
+        """
+        1. В outbox 5 событий, самому старому 2 секунды
+        2. Релей с пачкой 2 разбирает outbox
+        ОР: 3 пачки по одному вызову publish_many, порядок сохранен, outbox пуст, лаг учтен
+        """
+        created_at = datetime.utcnow() - timedelta(seconds=2)
+        with in_memory_db.begin() as connection:
+            connection.execute(insert(orm.outbox), [
+                dict(channel="line_allocated", payload=f'{{"n": {i}}}', created_at=created_at) for i in range(5)
+            ])
+        calls = []
+        relay = outbox.OutboxRelay(in_memory_db, calls.append, batch_size=2)
+
+        while relay.relay_batch():
+            pass
+
+        assert [len(batch) for batch in calls] == [2, 2, 1]
+        assert [payload for batch in calls for _, payload in batch] == [f'{{"n": {i}}}' for i in range(5)]
+        assert outbox_rows(in_memory_db) == []
+        stats = relay.stats.snapshot()
+        assert stats["published"] == 5 and stats["batches"] == 3
+        assert stats["lag_max_ms"] >= 2000
+
+    def test_failed_publish_keeps_batch_returns_ok(self, in_memory_db):
+        """
+        1. В outbox одно событие, публикация падает
+        ОР: строка осталась в outbox (будет опубликована повторно), outbox_status ее видит
+        """
+        with in_memory_db.begin() as connection:
+            connection.execute(insert(orm.outbox), [dict(channel="line_allocated", payload="{}")])
+
+        def publish_many(messages):
+            raise ConnectionError("redis is down")
+
+        relay = outbox.OutboxRelay(in_memory_db, publish_many)
+        try:
+            relay.relay_batch()
+        except ConnectionError:
+            pass
+
+        assert len(outbox_rows(in_memory_db)) == 1
+        with in_memory_db.connect() as connection:
+            assert outbox.outbox_status(connection)["pending"] == 1
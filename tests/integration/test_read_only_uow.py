@@ -0,0 +1,59 @@
+import asyncio
+
+from sqlalchemy import text
+
+from src.allocation.services import async_views, unit_of_work, views
+
+
+def add_view_rows(engine, *rows):
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO allocations_view (order_id, sku, batchref) VALUES (:order_id, :sku, :batchref)"),
+            [dict(order_id=order_id, sku=sku, batchref=batchref) for order_id, sku, batchref in rows],
+        )
+
+
+class TestReadOnlyUnitOfWork:
+    def test_views_read_through_read_only_uow_returns_ok(self, in_memory_db):
+        """
+        1. В allocations_view кладем размещения двух заказов
+        2. Читаем представления через ReadOnlyUnitOfWork
+        ОР: получены только строки запрошенного заказа (и артикула)
+        """
+        add_view_rows(in_memory_db, ("o1", "LAMP", "b1"), ("o1", "CHAIR", "b2"), ("o2", "LAMP", "b1"))
+        uow = unit_of_work.ReadOnlyUnitOfWork(in_memory_db)
+
+        assert sorted(views.allocations(uow, "o1"), key=lambda r: r["sku"]) == [
+            {"sku": "CHAIR", "batchref": "b2"},
+            {"sku": "LAMP", "batchref": "b1"},
+        ]
+        assert views.allocation(uow, "o2", "LAMP") == {"LAMP": "b1"}
+
+    def test_transaction_is_rolled_back_returns_ok(self, in_memory_db):
+        """
+        1. Внутри ReadOnlyUnitOfWork пишем строку в allocations_view
+        2. Выходим из uow и читаем представление
+        ОР: запись не сохранилась
+        """
+        uow = unit_of_work.ReadOnlyUnitOfWork(in_memory_db)
+        with uow:
+            uow.connection.execute(text("INSERT INTO allocations_view (order_id, sku, batchref) VALUES ('o1', 'LAMP', 'b1')"))
+
+        assert views.allocations(uow, "o1") == []
+
+    def test_async_views_read_through_read_only_uow_returns_ok(self, async_sqlite_session):
+        """
+        1. В allocations_view кладем размещение, читаем его через AsyncReadOnlyUnitOfWork из двух конкурентных задач
+        ОР: обе задачи получили строку
+        """
+        engine = async_sqlite_session.kw["bind"]
+        uow = unit_of_work.AsyncReadOnlyUnitOfWork(engine)
+
+        async def scenario():
+            async with engine.begin() as connection:
+                await connection.execute(
+                    text("INSERT INTO allocations_view (order_id, sku, batchref) VALUES ('o1', 'LAMP', 'b1')")
+                )
+            return await asyncio.gather(async_views.allocations(uow, "o1"), async_views.allocation(uow, "o1", "LAMP"))
+
+        assert asyncio.run(scenario()) == [[{"sku": "LAMP", "batchref": "b1"}], {"LAMP": "b1"}]
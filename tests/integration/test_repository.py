@@ -0,0 +1,158 @@
+import pytest
+from sqlalchemy import event
+
+from src.allocation.adapters import repository
+from src.allocation.models import domain
+
+
+def insert_product(session, sku, batches_count, lines_per_batch):
+    product = domain.Product(sku, batches=[])
+    for i in range(batches_count):
+        product.add_batch(domain.Batch(f"{sku}-batch-{i}", sku, 100, None))
+    session.add(product)
+    for i, batch in enumerate(product.batches):
+        for j in range(lines_per_batch):
+            batch.allocate(domain.OrderLine(f"order-{i}-{j}", sku, 1))
+    session.commit()
+
+
+def count_selects_while(engine, action):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        action()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return len([s for s in statements if s.lstrip().upper().startswith("SELECT")])
+
+
+def load_and_touch_allocations(session, strategy, **kwargs):
+    repo = repository.SqlAlchemyRepository(session, strategy)
+    product = repo.get(**kwargs) if "sku" in kwargs else repo.get_by_batchref(**kwargs)
+    return sum(b.available_quantity for b in product.batches)
+
+
+class TestRepositoryLoadingStrategy:
+    @pytest.mark.parametrize("strategy, expected_selects", [
+        (repository.LoadingStrategy.SELECTIN, 3),
+        (repository.LoadingStrategy.JOINED, 1),
+    ])
+    @pytest.mark.parametrize("batches_count", [1, 5, 20])
+    def test_eager_strategies_load_product_in_fixed_number_of_queries_returns_ok(
+        self, in_memory_db, sqlite_session, strategy, expected_selects, batches_count
+    ):
+        """
+        1. В БД кладем продукт с batches_count партиями по 3 размещения
+        2. Загружаем продукт по артикулу и по партии, обращаемся к размещениям всех партий
+        ОР: кол-во SELECT не зависит от кол-ва партий, доступное кол-во посчитано верно
+        """
+        insert_product(sqlite_session(), "LAMP", batches_count, 3)
+
+        for kwargs in (dict(sku="LAMP"), dict(batchref="LAMP-batch-0")):
+            session = sqlite_session()
+            available = []
+            selects = count_selects_while(
+                in_memory_db, lambda: available.append(load_and_touch_allocations(session, strategy, **kwargs))
+            )
+            session.close()
+            assert selects == expected_selects
+            assert available == [batches_count * 97]
+
+    def test_aggregate_only_loads_batches_lazily_returns_ok(self, in_memory_db, sqlite_session):
+        """
+        1. В БД кладем продукт с 5 партиями
+        2. Загружаем продукт в режиме aggregate_only и обращаемся к размещениям всех партий
+        ОР: продукт, партии и размещения каждой партии - отдельными запросами (1 + 1 + 5)
+        """
+        insert_product(sqlite_session(), "LAMP", 5, 3)
+        session = sqlite_session()
+
+        selects = count_selects_while(
+            in_memory_db,
+            lambda: load_and_touch_allocations(session, repository.LoadingStrategy.AGGREGATE_ONLY, sku="LAMP"),
+        )
+
+        assert selects == 7
+
+
+class TestRepositoryGetMany:
+    def test_get_many_loads_all_products_in_fixed_number_of_queries_returns_ok(self, in_memory_db, sqlite_session):
+        """
+        1. В БД кладем 4 продукта по 5 партий
+        2. Загружаем 3 из них одним get_many (плюс несуществующий артикул)
+        ОР: 3 SELECT на весь граф, все найденные продукты зарегистрированы в seen
+        """
+        for sku in ("LAMP", "CHAIR", "TABLE", "SOFA"):
+            insert_product(sqlite_session(), sku, 5, 2)
+        session = sqlite_session()
+        repo = repository.SqlAlchemyRepository(session)
+        products = []
+
+        def load_and_touch_allocations():
+            products.extend(repo.get_many(["LAMP", "CHAIR", "TABLE", "NONEXISTENT"]))
+            return [b.available_quantity for p in products for b in p.batches]
+
+        selects = count_selects_while(in_memory_db, load_and_touch_allocations)
+
+        assert selects == 3
+        assert {p.sku for p in products} == {"LAMP", "CHAIR", "TABLE"}
+        assert repo.seen == set(products)
+
+    def test_get_many_by_batchrefs_returns_each_product_once_returns_ok(self, sqlite_session):
+        """
+        1. В БД кладем 2 продукта по 3 партии
+        2. Загружаем продукты по трем партиям, две из которых принадлежат одному продукту
+        ОР: каждый продукт вернулся один раз
+        """
+        insert_product(sqlite_session(), "LAMP", 3, 0)
+        insert_product(sqlite_session(), "CHAIR", 3, 0)
+        repo = repository.SqlAlchemyRepository(sqlite_session())
+
+        products = repo.get_many_by_batchrefs(["LAMP-batch-0", "LAMP-batch-2", "CHAIR-batch-1"])
+
+        assert sorted(p.sku for p in products) == ["CHAIR", "LAMP"]
+        assert repo.seen == set(products)
+
+    def test_caching_get_many_loads_only_missing_products_returns_ok(self, in_memory_db, sqlite_session):
+        """
+        1. В БД кладем 2 продукта, один из них уже лежит в кэше
+        2. Загружаем оба через get_many репозитория с кэшем
+        ОР: закэшированный продукт взят из кэша, второй загружен из БД
+        """
+        insert_product(sqlite_session(), "LAMP", 2, 1)
+        insert_product(sqlite_session(), "CHAIR", 2, 1)
+        cache = repository.ProductCache()
+        warm_up_session = sqlite_session()
+        cache.put(repository.SqlAlchemyRepository(warm_up_session).get("LAMP"))
+        warm_up_session.close()
+
+        repo = repository.CachingSqlAlchemyRepository(sqlite_session(), cache)
+        products = repo.get_many(["LAMP", "CHAIR"])
+
+        assert sorted(p.sku for p in products) == ["CHAIR", "LAMP"]
+        assert all(sum(b.available_quantity for b in p.batches) == 198 for p in products)
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+
+class TestCachedStatements:
+    def test_statement_is_built_once_and_reused_returns_ok(self, in_memory_db, sqlite_session):
+        """
+        1. Кладем 2 продукта, дважды читаем их через репозиторий с разными значениями sku
+        ОР: выражение запроса строится один раз на стратегию загрузки, значения подставляются параметрами
+        """
+        insert_product(sqlite_session(), "LAMP", 1, 0)
+        insert_product(sqlite_session(), "CHAIR", 1, 0)
+        repo = repository.SqlAlchemyRepository(sqlite_session())
+
+        statement = repository.cached_statement(repository.product_by_sku, repository.LoadingStrategy.SELECTIN)
+
+        assert [repo.get("LAMP").sku, repo.get("CHAIR").sku] == ["LAMP", "CHAIR"]
+        assert repository.cached_statement(repository.product_by_sku, repository.LoadingStrategy.SELECTIN) is statement
+        assert repository.cached_statement(
+            repository.product_by_sku, repository.LoadingStrategy.JOINED
+        ) is not statement
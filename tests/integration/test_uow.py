@@ -5,7 +5,9 @@ import traceback
 import pytest
 
 from src.allocation.helpers.utils import random_sku, random_batchref, random_orderid
+from src.allocation.adapters import repository
 from src.allocation.models import domain
+from src.allocation.models.exceptions import ConcurrencyConflict
 from src.allocation.services import unit_of_work
 
 
@@ -144,6 +146,7 @@ class TestUoW:
         )
         assert version == 2  # проверяем, что только одна транзакция изменила версию
         [exception] = exceptions
+        assert isinstance(exception, ConcurrencyConflict)
         assert "could not serialize access due to concurrent update" in str(exception)
 
         orders = session.execute(
@@ -157,3 +160,58 @@ class TestUoW:
         assert orders.rowcount == 1  # проверяем, что в партии разместился только один заказ
         with unit_of_work.SqlAlchemyUnitOfWork() as uow:
             uow.session.execute("select 1")  # вернет один, если есть запись в таблице
+
+    def test_caching_uow_reuses_product_until_version_moves_returns_ok(self, postgres_session):
+        """
+        1. В БД кладем партию
+        2. Дважды размещаем позицию через UoW с кэшем продуктов
+        3. Меняем версию продукта в обход UoW и читаем продукт снова
+        ОР: второе чтение - из кэша, после смены версии продукт перечитан из БД
+        """
+        session = postgres_session()
+        insert_batch(session, 'batch1', 'CACHED-LAMP', 100, None)
+        session.commit()
+        cache = repository.ProductCache()
+
+        for orderid in ('o1', 'o2'):
+            with unit_of_work.SqlAlchemyUnitOfWork(product_cache=cache) as uow:
+                uow.products.get(sku='CACHED-LAMP').allocate(domain.OrderLine(orderid, 'CACHED-LAMP', 10))
+                uow.commit()
+        assert cache.hits == 1
+
+        session.execute("UPDATE products SET version = 100 WHERE sku = 'CACHED-LAMP'")
+        session.commit()
+        session.close()
+        with unit_of_work.SqlAlchemyUnitOfWork(product_cache=cache) as uow:
+            product = uow.products.get(sku='CACHED-LAMP')
+            assert product.version == 100
+            assert product.batches[0].available_quantity == 80
+        assert cache.hits == 1
+
+
+class TestOptimisticConcurrency:
+    def test_commit_of_stale_product_raises_conflict_returns_ok(self, sqlite_session):
+        """
+        1. В БД кладем продукт версии 1 с партией
+        2. Два UoW читают продукт; первый размещает позицию и фиксирует изменения
+        3. Второй размещает свою позицию и фиксирует изменения
+        ОР: второй commit отклонен проверкой версии (ConcurrencyConflict), размещена только первая позиция
+        """
+        session = sqlite_session()
+        session.add(domain.Product("LAMP", [domain.Batch("batch1", "LAMP", 100, None)], version=1))
+        session.commit()
+        session.close()
+
+        first = unit_of_work.SqlAlchemyUnitOfWork(session_factory=sqlite_session)
+        second = unit_of_work.SqlAlchemyUnitOfWork(session_factory=sqlite_session)
+        with first, second:
+            first.products.get("LAMP").allocate(domain.OrderLine("o1", "LAMP", 10))
+            second.products.get("LAMP").allocate(domain.OrderLine("o2", "LAMP", 10))
+            first.commit()
+            with pytest.raises(ConcurrencyConflict):
+                second.commit()
+
+        with unit_of_work.SqlAlchemyUnitOfWork(session_factory=sqlite_session) as uow:
+            product = uow.products.get("LAMP")
+            assert product.version == 2
+            assert product.batches[0].available_quantity == 90
@@ -0,0 +1,112 @@
+from datetime import date
+
+from loguru import logger
+from sqlalchemy import event, select
+
+from src.allocation import bootstrap
+from src.allocation.adapters import orm
+from src.allocation.models import commands
+from src.allocation.services import messagebus, unit_of_work
+
+
+def view_rows(engine):
+    with engine.connect() as connection:
+        return sorted(connection.execute(select(orm.allocations_view)).all())
+
+
+def run_eviction_cascade(engine, session_factory, batch_projections):
+    """
+    10 заказов по 5 шт. в ранней партии, затем партия уменьшается до 20 -
+    6 позиций вытесняются и переразмещаются в позднюю партию.
+    Возвращает кол-во обращений к allocations_view во время ChangeBatchQuantity
+    """
+    bus = bootstrap.bootstrap(
+        start_orm=False,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+        publish=lambda *args: None,
+        batch_projections=batch_projections,
+    )
+    bus.handle(commands.CreateBatch("early", "LAMP", 100, date(2030, 1, 1)))
+    bus.handle(commands.CreateBatch("late", "LAMP", 100, date(2030, 2, 1)))
+    for i in range(10):
+        bus.handle(commands.Allocate(f"order-{i}", "LAMP", 5))
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if "allocations_view" in statement:
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        bus.handle(commands.ChangeBatchQuantity("early", 20))
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements)
+
+
+class TestViewBatching:
+    def test_cascade_is_flushed_in_two_statements_returns_ok(self, in_memory_db, sqlite_session):
+        """
+        1. Через шину в пакетном режиме размещаем 10 заказов и уменьшаем партию с вытеснением 6 из них
+        ОР: каскад записал представление не более чем двумя запросами (DELETE и INSERT; удаление и повторное
+            размещение одного заказа схлопываются в INSERT), вытесненные заказы указывают на позднюю партию
+        """
+        statements = run_eviction_cascade(in_memory_db, sqlite_session, batch_projections=True)
+
+        rows = view_rows(in_memory_db)
+        assert statements <= 2
+        assert len(rows) == 10
+        assert sorted(batchref for _, _, batchref in rows) == ["early"] * 4 + ["late"] * 6
+
+    def test_batched_view_matches_per_event_view_returns_ok(self, in_memory_db, sqlite_session):
+        """
+        1. Прогоняем тот же каскад без пакетного режима и запоминаем представление
+        2. Очищаем таблицы и прогоняем каскад в пакетном режиме
+        ОР: представления совпадают, пакетный режим обращается к allocations_view кратно реже
+        """
+        per_event_statements = run_eviction_cascade(in_memory_db, sqlite_session, batch_projections=False)
+        per_event_rows = view_rows(in_memory_db)
+        with in_memory_db.begin() as connection:
+            for table in reversed(orm.metadata.sorted_tables):
+                connection.execute(table.delete())
+
+        batched_statements = run_eviction_cascade(in_memory_db, sqlite_session, batch_projections=True)
+
+        assert view_rows(in_memory_db) == per_event_rows
+        assert per_event_statements >= 6 * batched_statements
+
+    def test_failed_flush_is_logged_and_dropped_returns_ok(self, in_memory_db, sqlite_session):
+        """
+        1. В пакетном режиме размещаем заказ, пока запись в allocations_view падает
+        2. Запись снова работает, размещаем второй заказ
+        ОР: flush повторен шиной, потерянный ключ заказа залогирован как error, во второй flush
+            ушел только второй заказ - потерянные изменения не всплывают позже
+        """
+        bus = bootstrap.bootstrap(
+            start_orm=False,
+            uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session),
+            publish=lambda *args: None,
+            batch_projections=True,
+        )
+        bus.event_retry = messagebus.EventRetryPolicy(max_attempts=2, base_delay=0)
+        bus.handle(commands.CreateBatch("b1", "LAMP", 100, date(2030, 1, 1)))
+        attempts, errors = [], []
+
+        def fail_view_writes(conn, cursor, statement, *args):
+            if "allocations_view" in statement:
+                attempts.append(statement)
+                raise RuntimeError("view is down")
+
+        sink = logger.add(errors.append, level="ERROR", format="{message}")
+        event.listen(in_memory_db, "before_cursor_execute", fail_view_writes)
+        try:
+            bus.handle(commands.Allocate("o1", "LAMP", 10))
+        finally:
+            event.remove(in_memory_db, "before_cursor_execute", fail_view_writes)
+            logger.remove(sink)
+        bus.handle(commands.Allocate("o2", "LAMP", 10))
+
+        assert len(attempts) == 2
+        assert any("dropped: [('o1', 'LAMP')]" in str(message) for message in errors)
+        assert [order_id for order_id, _, _ in view_rows(in_memory_db)] == ["o2"]
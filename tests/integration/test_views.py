@@ -1,14 +1,14 @@
 from datetime import date
 
 from src.allocation.models import commands
-from src.allocation.services import views
+from src.allocation.services import unit_of_work, views
 
 
 today = date.today()
 
 
 class TestViews:
-    def test_allocations_view(self, real_bus):
+    def test_allocations_view(self, real_bus, postgres_db):
         mbus = real_bus
 
         mbus.handle(commands.CreateBatch('sku1batch', 'sku1', 50, None))
@@ -21,12 +21,12 @@ class TestViews:
         mbus.handle(commands.CreateBatch('sku1batch-later', 'sku1', 50, today))
         mbus.handle(commands.Allocate('otherorder', 'sku2', 10))
 
-        assert views.allocations(mbus.uow, 'order1') == [
+        assert views.allocations(unit_of_work.ReadOnlyUnitOfWork(postgres_db), 'order1') == [
             {'sku': 'sku1', 'batchref': 'sku1batch'},
             {'sku': 'sku2', 'batchref': 'sku2batch'},
         ]
 
-    def test_deallocation_view(self, real_bus):
+    def test_deallocation_view(self, real_bus, postgres_db):
         mbus = real_bus
 
         mbus.handle(commands.CreateBatch("br1", "sku13", 50, None))
@@ -34,6 +34,6 @@ class TestViews:
         mbus.handle(commands.Allocate("or1", "sku13", 40))
         mbus.handle(commands.ChangeBatchQuantity("br1", 10))
 
-        assert views.allocations(mbus.uow, "or1") == [
+        assert views.allocations(unit_of_work.ReadOnlyUnitOfWork(postgres_db), "or1") == [
             {"sku": "sku13", "batchref": "br2"},
         ]
@@ -116,3 +116,45 @@ class TestDeallocateBatches:
         assert batch.available_quantity == 20
         batch.deallocate(line)
         assert batch.available_quantity == 20
+
+
+class TestAllocatedQuantityCounter:
+    def test_counter_follows_allocate_and_deallocate_returns_ok(self):
+        """
+        1. Создаем партию на 20 штук
+        2. Размещаем две товарные позиции на 2 и 3 шт
+        3. Отменяем одну из них
+        ОР: счетчик размещенного кол-ва совпадает с суммой размещенных позиций
+        """
+        batch = Batch("batch-001", "ANGULAR-DESK", 20, eta=None)
+        first, second = OrderLine("order-1", "ANGULAR-DESK", 2), OrderLine("order-2", "ANGULAR-DESK", 3)
+        batch.allocate(first)
+        batch.allocate(second)
+        assert batch.allocated_quantity == 5
+        batch.deallocate(first)
+        assert batch.allocated_quantity == 3
+        assert batch.available_quantity == 17
+
+    def test_counter_follows_deallocate_random_one_returns_ok(self):
+        """
+        1. Создаем партию на 20 штук и размещаем в ней две позиции
+        2. Отменяем размещение случайной позиции
+        ОР: счетчик уменьшился на кол-во отмененной позиции
+        """
+        batch = Batch("batch-001", "ANGULAR-DESK", 20, eta=None)
+        batch.allocate(OrderLine("order-1", "ANGULAR-DESK", 2))
+        batch.allocate(OrderLine("order-2", "ANGULAR-DESK", 3))
+        line = batch.deallocate_random_one()
+        assert batch.allocated_quantity == 5 - line.qty
+
+    def test_counter_is_recomputed_after_reset_returns_ok(self):
+        """
+        1. Создаем партию и размещаем в ней позицию
+        2. Сбрасываем счетчик, как это делает orm при загрузке партии из БД
+        ОР: счетчик пересчитывается из _allocations
+        """
+        batch, line = make_batch_and_line("ANGULAR-DESK", 20, 2)
+        batch.allocate(line)
+        batch._allocated_quantity = None
+        assert batch.allocated_quantity == 2
+        assert batch.available_quantity == 18
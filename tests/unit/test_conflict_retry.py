@@ -0,0 +1,70 @@
+import pytest
+
+from src.allocation.models.exceptions import ConcurrencyConflict, InvalidSku
+from src.allocation.services.unit_of_work import ConflictRetryPolicy
+from tests.fake_services import FakeUnitOfWork
+
+
+def failing_times(times, exception):
+    calls = []
+
+    def handler(command):
+        calls.append(command)
+        if len(calls) <= times:
+            raise exception
+        return f"done-{command}"
+
+    return handler, calls
+
+
+class TestConflictRetry:
+    def test_retries_until_commit_succeeds_returns_ok(self):
+        """
+        1. UoW с политикой на 3 попытки, обработчик дважды падает с ConcurrencyConflict
+        2. Выполняем обработчик через with_conflict_retry
+        ОР: третья попытка успешна, ее результат возвращен
+        """
+        uow = FakeUnitOfWork()
+        uow.conflict_retry = ConflictRetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+        handler, calls = failing_times(2, ConcurrencyConflict("version 1"))
+
+        assert uow.with_conflict_retry(handler, "cmd") == "done-cmd"
+        assert len(calls) == 3
+
+    def test_reraises_conflict_when_attempts_exhausted_returns_ok(self):
+        """
+        1. UoW с политикой на 2 попытки, обработчик всегда падает с ConcurrencyConflict
+        ОР: после 2 попыток наверх уходит ConcurrencyConflict
+        """
+        uow = FakeUnitOfWork()
+        uow.conflict_retry = ConflictRetryPolicy(max_attempts=2, base_delay=0, max_delay=0)
+        handler, calls = failing_times(10, ConcurrencyConflict("version 1"))
+
+        with pytest.raises(ConcurrencyConflict):
+            uow.with_conflict_retry(handler, "cmd")
+        assert len(calls) == 2
+
+    def test_other_errors_are_not_retried_returns_ok(self):
+        """
+        1. UoW с политикой на 5 попыток, обработчик падает с InvalidSku
+        ОР: ровно одна попытка, InvalidSku уходит наверх
+        """
+        uow = FakeUnitOfWork()
+        uow.conflict_retry = ConflictRetryPolicy(max_attempts=5, base_delay=0, max_delay=0)
+        handler, calls = failing_times(1, InvalidSku("sku"))
+
+        with pytest.raises(InvalidSku):
+            uow.with_conflict_retry(handler, "cmd")
+        assert len(calls) == 1
+
+    def test_without_policy_conflict_is_not_retried_returns_ok(self):
+        """
+        1. UoW без политики повторов, обработчик падает с ConcurrencyConflict
+        ОР: ровно одна попытка, ConcurrencyConflict уходит наверх
+        """
+        uow = FakeUnitOfWork()
+        handler, calls = failing_times(1, ConcurrencyConflict("version 1"))
+
+        with pytest.raises(ConcurrencyConflict):
+            uow.with_conflict_retry(handler, "cmd")
+        assert len(calls) == 1
@@ -0,0 +1,112 @@
+import threading
+from datetime import date
+
+import pytest
+
+from src.allocation.models import commands
+from src.allocation.services import executor
+
+
+class RecordingBus:
+    """
+    Вместо шины: запоминает поток и сообщения; before_handle - чтобы тест мог задержать команду
+    """
+    def __init__(self, handled, before_handle=lambda message: None):
+        self.handled = handled
+        self.before_handle = before_handle
+
+    def handle(self, message):
+        self.before_handle(message)
+        self.handled.append((threading.current_thread().name, message))
+        if getattr(message, "qty", 0) < 0:
+            raise ValueError("negative qty")
+        return [getattr(message, "order_id", None)]
+
+
+def sku_with_other_partition(pool: executor.PartitionedExecutor, sku: str) -> str:
+    return next(
+        other for other in (f"SKU-{i}" for i in range(100))
+        if pool.partition(commands.Allocate("o", other, 1)) != pool.partition(commands.Allocate("o", sku, 1))
+    )
+
+
+class TestPartitionedExecutor:
+    def test_same_sku_is_ordered_and_other_skus_run_in_parallel_returns_ok(self):
+        """
+        1. Executor на 4 воркера; команды двух sku из разных партиций ждут друг друга на барьере
+        2. Отправляем по 20 команд каждого sku
+        ОР: барьер пройден (sku выполнялись параллельно), команды каждого sku выполнены одним воркером
+            в порядке отправки, результаты шины возвращены через Future
+        """
+        handled = []
+        barrier = threading.Barrier(2, timeout=5)
+
+        def before_handle(message):
+            if message.order_id.endswith("-0"):
+                barrier.wait()
+
+        with executor.PartitionedExecutor(lambda: RecordingBus(handled, before_handle), workers=4) as pool:
+            other = sku_with_other_partition(pool, "LAMP")
+            futures = [
+                pool.submit(commands.Allocate(f"{sku}-{i}", sku, 1)) for i in range(20) for sku in ("LAMP", other)
+            ]
+            results = [future.result(timeout=5) for future in futures]
+
+        assert results[:2] == [["LAMP-0"], [f"{other}-0"]]
+        for sku in ("LAMP", other):
+            own = [(thread, message.order_id) for thread, message in handled if message.sku == sku]
+            assert len({thread for thread, _ in own}) == 1
+            assert [order_id for _, order_id in own] == [f"{sku}-{i}" for i in range(20)]
+
+    def test_change_batch_quantity_follows_batch_sku_returns_ok(self):
+        """
+        1. CreateBatch через executor, затем ChangeBatchQuantity этой партии и партии, известной только БД
+        ОР: обе команды у воркера своего sku, БД спрошена только о незнакомой партии и один раз
+        """
+        lookups = []
+
+        def sku_by_batchref(batchref):
+            lookups.append(batchref)
+            return {"db-batch": "TABLE"}.get(batchref)
+
+        with executor.PartitionedExecutor(lambda: RecordingBus([]), workers=8, sku_by_batchref=sku_by_batchref) as pool:
+            pool.submit(commands.CreateBatch("new-batch", "LAMP", 10, date(2030, 1, 1)))
+
+            assert pool.partition(commands.ChangeBatchQuantity("new-batch", 5)) == \
+                pool.partition(commands.Allocate("o", "LAMP", 1))
+            for _ in range(3):
+                assert pool.partition(commands.ChangeBatchQuantity("db-batch", 5)) == \
+                    pool.partition(commands.Allocate("o", "TABLE", 1))
+
+        assert lookups == ["db-batch"]
+
+    def test_unknown_batch_goes_to_fixed_worker_returns_ok(self):
+        """
+        1. ChangeBatchQuantity партий, которых нет в БД
+        2. Партия "late-batch" появляется в БД
+        ОР: пока партии нет - всегда воркер 0 (не хэш batchref), промах не запомнен:
+            после появления партии команда уходит к воркеру ее sku
+        """
+        skus = {}
+
+        with executor.PartitionedExecutor(lambda: RecordingBus([]), workers=8, sku_by_batchref=skus.get) as pool:
+            sku = next(f"SKU-{i}" for i in range(100) if pool.partition(commands.Allocate("o", f"SKU-{i}", 1)) != 0)
+
+            assert {pool.partition(commands.ChangeBatchQuantity(f"missing-{i}", 5)) for i in range(20)} == {0}
+            assert pool.partition(commands.ChangeBatchQuantity("late-batch", 5)) == 0
+            skus["late-batch"] = sku
+            assert pool.partition(commands.ChangeBatchQuantity("late-batch", 5)) == \
+                pool.partition(commands.Allocate("o", sku, 1))
+
+    def test_failed_command_is_reported_and_worker_keeps_going_returns_ok(self):
+        """
+        1. Команда падает в шине, следом - команда того же sku
+        ОР: исключение пришло через Future, следующая команда выполнена
+        """
+        with executor.PartitionedExecutor(lambda: RecordingBus([]), workers=2) as pool:
+            failed = pool.submit(commands.Allocate("o1", "LAMP", -1))
+            ok = pool.submit(commands.Allocate("o2", "LAMP", 1))
+
+            with pytest.raises(ValueError, match="negative qty"):
+                failed.result(timeout=5)
+            assert ok.result(timeout=5) == ["o2"]
@@ -3,6 +3,7 @@ from datetime import date
 import pytest
 
 from src.allocation.models import exceptions, events, commands
+from src.allocation.models.domain import OrderLine
 from src.allocation.models.exceptions import InvalidSku
 
 
@@ -52,6 +53,32 @@ class TestAllocationRequired:
         assert mbus.uow.committed is True
 
 
+class TestAllocateMany:
+    def test_allocate_many_returns_allocations(self, fake_bus):
+        """
+        1. Размещаем партию через сервисный слой
+        2. Размещаем в партии группу товарных позиций одной командой
+        ОР: для каждой позиции вернулась партия или OutOfStock, события Allocated опубликованы
+        """
+        mbus = fake_bus
+        mbus.handle(commands.CreateBatch("batch1", "COMPLICATED-LAMP", 15, None))
+        [result] = mbus.handle(commands.AllocateMany("COMPLICATED-LAMP", [
+            commands.Allocate("o1", "COMPLICATED-LAMP", 10),
+            commands.Allocate("o2", "COMPLICATED-LAMP", 10),
+            commands.Allocate("o3", "COMPLICATED-LAMP", 5),
+        ]))
+        assert result[0] == result[2] == "batch1"
+        assert isinstance(result[1], exceptions.OutOfStock)
+        assert mbus.uow.committed
+        allocated = [m for m in mbus.message_published if isinstance(m, events.Allocated)]
+        assert [e.order_id for e in allocated] == ["o1", "o3"]
+
+    def test_allocate_many_errors_for_invalid_sku(self, fake_bus):
+        mbus = fake_bus
+        with pytest.raises(InvalidSku, match="Invalid stock-keeping: NONEXISTENTSKU"):
+            mbus.handle(commands.AllocateMany("NONEXISTENTSKU", [commands.Allocate("o1", "NONEXISTENTSKU", 10)]))
+
+
 class TestDeallocationRequired:
     def test_returns_deallocation(self, fake_bus):
         """
@@ -154,3 +181,25 @@ class TestChangeBatchQuantity:
         reallocated_event = mbus.message_published[-1]
         assert isinstance(reallocation_command, commands.Allocate)
         assert isinstance(reallocated_event, events.Allocated)
+
+
+class TestArchiveClosedBatches:
+    def test_archives_closed_batches_returns_ok(self, fake_bus):
+        """
+        1. Создаем прошедшую партию и партию на складе, полностью размещаем прошедшую
+        2. Архивируем закрытые партии через сервисный слой
+        ОР: вернулась ссылка на прошедшую партию, она передана репозиторию в архив, изменения зафиксированы
+        """
+        mbus = fake_bus
+        mbus.handle(commands.CreateBatch("old-batch", "LAMP", 10, date(2020, 1, 1)))
+        mbus.handle(commands.CreateBatch("warehouse", "LAMP", 10, None))
+        product = mbus.uow.products.get("LAMP")
+        old_batch = next(b for b in product.batches if b.reference == "old-batch")
+        old_batch.allocate(OrderLine("o1", "LAMP", 10))
+
+        [archived] = mbus.handle(commands.ArchiveClosedBatches("LAMP", date(2021, 1, 1)))
+
+        assert archived == ["old-batch"]
+        assert [b.reference for b in mbus.uow.products.archived] == ["old-batch"]
+        assert [b.reference for b in product.batches] == ["warehouse"]
+        assert mbus.uow.committed
@@ -0,0 +1,252 @@
+import asyncio
+import functools
+from dataclasses import dataclass
+
+import pytest
+
+from src.allocation.models import commands, domain, events
+from src.allocation.services import messagebus, metrics
+from tests.fake_services import FakeUnitOfWork
+
+
+@dataclass(slots=True)
+class UrgentAllocated(events.Allocated):
+    pass
+
+
+def make_bus(event_handlers, command_handlers, event_retry=messagebus.EventRetryPolicy(base_delay=0), bus_metrics=None):
+    """
+    Шина на FakeUnitOfWork; события, добавленные обработчиками в product.events, попадают в очередь шины
+    """
+    uow = FakeUnitOfWork()
+    product = domain.Product("LAMP", [])
+    uow.products.seen.add(product)
+    bus = messagebus.MessageBus(uow, event_handlers, command_handlers, event_retry=event_retry, metrics=bus_metrics)
+    return bus, product
+
+
+class TestMessageBusDispatch:
+    def test_cascade_is_processed_in_fifo_order_returns_ok(self):
+        """
+        1. Команда порождает 2 события, первое из них - еще одно
+        ОР: события обработаны в порядке поступления в очередь, результат команды возвращен
+        """
+        handled = []
+
+        def allocate(command):
+            product.events.extend([events.Allocated("o1", "LAMP", 1, "b1"), events.Deallocated("o2", "LAMP", 1)])
+            return "b1"
+
+        def on_allocated(event):
+            handled.append(event)
+            product.events.append(events.OutOfStock("LAMP"))
+
+        bus, product = make_bus(
+            {
+                events.Allocated: [on_allocated],
+                events.Deallocated: [handled.append],
+                events.OutOfStock: [handled.append],
+            },
+            {commands.Allocate: allocate},
+        )
+
+        assert bus.handle(commands.Allocate("o1", "LAMP", 1)) == ["b1"]
+        assert [type(e) for e in handled] == [events.Allocated, events.Deallocated, events.OutOfStock]
+
+    def test_subclass_event_gets_base_handlers_returns_ok(self):
+        """
+        1. Обработчики зарегистрированы для Allocated и для его наследника UrgentAllocated
+        2. Отправляем в шину UrgentAllocated
+        ОР: вызваны оба обработчика, сначала - более конкретный
+        """
+        calls = []
+        bus, _ = make_bus(
+            {
+                events.Allocated: [lambda e: calls.append("base")],
+                UrgentAllocated: [lambda e: calls.append("urgent")],
+            },
+            {},
+        )
+
+        bus.handle(UrgentAllocated("o1", "LAMP", 1, "b1"))
+
+        assert calls == ["urgent", "base"]
+        assert bus.route(UrgentAllocated) is bus.route(UrgentAllocated)
+
+    def test_failing_event_handler_is_retried_and_isolated_returns_ok(self):
+        """
+        1. Первый обработчик события всегда падает, второй работает
+        ОР: первый вызван max_attempts раз, ошибка не прервала обработку - второй вызван
+        """
+        attempts, handled = [], []
+
+        def failing(event):
+            attempts.append(event)
+            raise RuntimeError("redis is down")
+
+        bus, _ = make_bus(
+            {events.Allocated: [failing, handled.append]},
+            {},
+            event_retry=messagebus.EventRetryPolicy(max_attempts=3, base_delay=0),
+        )
+
+        bus.handle(events.Allocated("o1", "LAMP", 1, "b1"))
+
+        assert len(attempts) == 3
+        assert len(handled) == 1
+
+    def test_unknown_messages_are_rejected_returns_ok(self):
+        """
+        1. Отправляем в шину команду без обработчика и объект, не являющийся сообщением
+        ОР: KeyError для команды, Exception для не-сообщения
+        """
+        bus, _ = make_bus({}, {})
+
+        with pytest.raises(KeyError):
+            bus.handle(commands.Allocate("o1", "LAMP", 1))
+        with pytest.raises(Exception, match="was not an Event or Command"):
+            bus.handle("not a message")
+
+
+class TestAsyncMessageBusFanOut:
+    def test_event_handlers_run_concurrently_returns_ok(self):
+        """
+        1. Два async-обработчика Allocated ждут друг друга, каждый порождает событие OutOfStock
+        2. Отправляем в шину Allocated
+        ОР: обработчики встретились (выполнялись конкурентно), порожденные события обработаны после обоих
+        """
+        calls = []
+        first_started, second_started = asyncio.Event(), asyncio.Event()
+
+        async def rendezvous(started, other, name, event):
+            started.set()
+            await asyncio.wait_for(other.wait(), timeout=1)
+            calls.append(name)
+            product.events.append(events.OutOfStock(name))
+
+        async def on_out_of_stock(event):
+            calls.append(f"out-of-stock-{event.sku}")
+
+        uow = FakeUnitOfWork()
+        product = domain.Product("LAMP", [])
+        uow.products.seen.add(product)
+        bus = messagebus.AsyncMessageBus(
+            uow,
+            {
+                events.Allocated: [
+                    functools.partial(rendezvous, first_started, second_started, "first"),
+                    functools.partial(rendezvous, second_started, first_started, "second"),
+                ],
+                events.OutOfStock: [on_out_of_stock],
+            },
+            {},
+            event_retry=messagebus.EventRetryPolicy(max_attempts=1),
+        )
+
+        asyncio.run(bus.handle(events.Allocated("o1", "LAMP", 1, "b1")))
+
+        assert sorted(calls[:2]) == ["first", "second"]
+        assert sorted(calls[2:]) == ["out-of-stock-first", "out-of-stock-second"]
+
+    def test_failing_handler_does_not_abort_others_returns_ok(self):
+        """
+        1. Из двух async-обработчиков события один всегда падает
+        ОР: второй обработчик отработал, ошибка не ушла наверх, упавший вызван max_attempts раз
+        """
+        attempts, handled = [], []
+
+        async def failing(event):
+            attempts.append(event)
+            raise RuntimeError("redis is down")
+
+        async def working(event):
+            handled.append(event)
+
+        bus = messagebus.AsyncMessageBus(
+            FakeUnitOfWork(),
+            {events.Allocated: [failing, working]},
+            {},
+            event_retry=messagebus.EventRetryPolicy(max_attempts=2, base_delay=0),
+        )
+
+        asyncio.run(bus.handle(events.Allocated("o1", "LAMP", 1, "b1")))
+
+        assert len(attempts) == 2
+        assert len(handled) == 1
+
+
+class TestBusMetrics:
+    def test_handler_latency_retries_and_queue_depth_returns_ok(self):
+        """
+        1. Команда порождает 3 события Allocated; обработчик Allocated падает на первой попытке для каждого
+           события, второй обработчик всегда падает
+        ОР: по команде и обработчикам записаны задержки, повторы (3 у первого, 2 на событие у второго),
+            ошибки только у второго, максимальная глубина очереди - 3
+        """
+        failed_once = set()
+
+        def flaky(event):
+            if event.order_id not in failed_once:
+                failed_once.add(event.order_id)
+                raise RuntimeError("redis is down")
+
+        def broken(event):
+            raise RuntimeError("always")
+
+        def allocate(command):
+            product.events.extend(events.Allocated(f"o{i}", "LAMP", 1, "b1") for i in range(3))
+            return "b1"
+
+        bus_metrics = metrics.BusMetrics()
+        bus, product = make_bus(
+            {events.Allocated: [flaky, broken]},
+            {commands.Allocate: allocate},
+            event_retry=messagebus.EventRetryPolicy(max_attempts=3, base_delay=0),
+            bus_metrics=bus_metrics,
+        )
+
+        bus.handle(commands.Allocate("o1", "LAMP", 3))
+
+        assert bus_metrics.handle_seconds["Allocate"].count == 1
+        assert bus_metrics.handler_seconds[("Allocate", "allocate")].count == 1
+        assert bus_metrics.handler_seconds[("Allocated", "flaky")].count == 3
+        assert bus_metrics.handler_retries == {("Allocated", "flaky"): 3, ("Allocated", "broken"): 6}
+        assert bus_metrics.handler_failures == {("Allocated", "broken"): 3}
+        assert bus_metrics.max_queue_depth == {"Allocate": 3}
+
+    def test_failed_command_and_async_bus_are_observed_returns_ok(self):
+        """
+        1. Команда AsyncMessageBus падает
+        ОР: исключение ушло наверх, ошибка и задержка обработчика и всего handle записаны
+        """
+        async def allocate(command):
+            raise ValueError("out of stock")
+
+        bus_metrics = metrics.BusMetrics()
+        bus = messagebus.AsyncMessageBus(FakeUnitOfWork(), {}, {commands.Allocate: allocate}, metrics=bus_metrics)
+
+        with pytest.raises(ValueError):
+            asyncio.run(bus.handle(commands.Allocate("o1", "LAMP", 1)))
+
+        assert bus_metrics.handler_failures == {("Allocate", "allocate"): 1}
+        assert bus_metrics.handle_seconds["Allocate"].count == 1
+
+    def test_render_prometheus_text_returns_ok(self):
+        """
+        1. В метрики записаны обработчик за 3 мс с одним повтором и каскад глубиной 2
+        ОР: текст в формате Prometheus: накопительные корзины, _sum, _count, счетчики и gauge с метками
+        """
+        bus_metrics = metrics.BusMetrics(buckets=(0.001, 0.01))
+        bus_metrics.observe_handler(events.Allocated, messagebus.CallCounter(print), 0.003, attempts=2, failed=False)
+        bus_metrics.observe_handle(commands.Allocate, 0.02, max_queue_depth=2)
+
+        lines = bus_metrics.render().splitlines()
+
+        assert "# TYPE allocation_bus_handler_seconds histogram" in lines
+        assert 'allocation_bus_handler_seconds_bucket{message="Allocated",handler="CallCounter",le="0.001"} 0' in lines
+        assert 'allocation_bus_handler_seconds_bucket{message="Allocated",handler="CallCounter",le="0.01"} 1' in lines
+        assert 'allocation_bus_handler_seconds_bucket{message="Allocated",handler="CallCounter",le="+Inf"} 1' in lines
+        assert 'allocation_bus_handler_seconds_count{message="Allocated",handler="CallCounter"} 1' in lines
+        assert 'allocation_bus_handle_seconds_bucket{message="Allocate",le="+Inf"} 1' in lines
+        assert 'allocation_bus_handler_retries_total{message="Allocated",handler="CallCounter"} 1' in lines
+        assert 'allocation_bus_queue_depth_max{message="Allocate"} 2' in lines
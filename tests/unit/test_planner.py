@@ -0,0 +1,81 @@
+import random
+from datetime import date, timedelta
+
+import numpy as np
+
+from src.allocation.models.domain import OrderLine, Batch, Product, OutOfStock
+from src.allocation.services import planner
+
+today = date.today()
+
+
+def make_products(rnd: random.Random, skus):
+    products = []
+    for sku in skus:
+        batches = [
+            Batch(
+                f"{sku}-batch{i}", sku, rnd.randint(0, 60),
+                eta=rnd.choice([None, today + timedelta(days=rnd.randint(0, 5))]),
+            )
+            for i in range(rnd.randint(1, 8))
+        ]
+        products.append(Product(sku=sku, batches=batches))
+    return products
+
+
+class TestPlanner:
+    def test_plan_sku_assigns_runs_to_first_fitting_batch_returns_ok(self):
+        """
+        1. Три партии с доступным кол-вом 10, 5 и 100 (в порядке eta)
+        2. Позиции на 4, 4, 4, 1, 6
+        ОР: 4 и 4 - в первую партию, 4 - во вторую, 1 - снова в первую, 6 - в третью
+        """
+        result = planner.plan_sku(np.array([10, 5, 100]), np.array([4, 4, 4, 1, 6]))
+        assert result.tolist() == [0, 0, 1, 0, 2]
+
+    def test_plan_marks_unknown_sku_and_shortage_as_out_of_stock_returns_ok(self):
+        """
+        1. Продукт с одной партией на 10 шт
+        2. Позиции на 8 и 5 шт этого артикула и позиция другого артикула
+        ОР: размещена только первая позиция, остальные - нет в наличии
+        """
+        product = Product(sku="SMALL-FORK", batches=[Batch("batch1", "SMALL-FORK", 10, eta=None)])
+        lines = [
+            OrderLine("order1", "SMALL-FORK", 8),
+            OrderLine("order2", "SMALL-FORK", 5),
+            OrderLine("order3", "OTHER-SKU", 1),
+        ]
+
+        result = planner.plan([product], lines)
+
+        assert result.batchrefs == ["batch1", None, None]
+        assert result.out_of_stock == lines[1:]
+
+    def test_plan_matches_domain_model_on_random_inputs_returns_ok(self):
+        """
+        1. Генерируем случайные продукты, партии (часть уже с размещениями) и позиции
+        2. Строим план и размещаем те же позиции через Product.allocate
+        ОР: для каждой позиции партия совпадает, OutOfStock - там же
+        """
+        for seed in range(20):
+            rnd = random.Random(seed)
+            skus = [f"SKU-{i}" for i in range(4)]
+            products = make_products(rnd, skus)
+            for product in products:
+                for i in range(rnd.randint(0, 5)):
+                    try:
+                        product.allocate(OrderLine(f"existing-{i}", product.sku, rnd.randint(1, 20)))
+                    except OutOfStock:
+                        pass
+            lines = [OrderLine(f"order-{i}", rnd.choice(skus), rnd.randint(1, 25)) for i in range(300)]
+
+            result = planner.plan(products, lines)
+
+            by_sku = {p.sku: p for p in products}
+            expected = []
+            for line in lines:
+                try:
+                    expected.append(by_sku[line.sku].allocate(line))
+                except OutOfStock:
+                    expected.append(None)
+            assert result.batchrefs == expected, f"seed {seed}"
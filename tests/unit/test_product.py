@@ -2,7 +2,11 @@ from datetime import date, timedelta
 
 import pytest
 
-from src.allocation.models.domain import OrderLine, Batch, Product, OutOfStock
+from src.allocation.models import events
+from src.allocation.models.domain import (
+    OrderLine, Batch, Product, OutOfStock,
+    LargestFirstEvictionPolicy, LatestFirstEvictionPolicy, ArbitraryEvictionPolicy,
+)
 from src.allocation.models.exceptions import NoOrderInBatch
 
 today = date.today()
@@ -82,6 +86,144 @@ class TestProductAllocate:
             product.allocate(OrderLine('order2', 'SMALL-FORK', 1))
 
 
+    def test_prefers_earlier_batch_added_after_first_allocation_returns_ok(self):
+        """
+        1. Создаем продукт с партией с eta - позже и размещаем в ней позицию
+        2. Добавляем в продукт партию с eta - сегодня
+        3. Размещаем еще одну позицию
+        ОР: вторая позиция разместилась в добавленной, более ранней партии
+        """
+        latest = Batch("slow-batch", "MINIMALIST-SPOON", 100, eta=later)
+        product = Product(sku="MINIMALIST-SPOON", batches=[latest])
+        product.allocate(OrderLine("order1", "MINIMALIST-SPOON", 10))
+        earliest = Batch("speedy-batch", "MINIMALIST-SPOON", 100, eta=today)
+        product.add_batch(earliest)
+
+        allocation = product.allocate(OrderLine("order2", "MINIMALIST-SPOON", 10))
+
+        assert allocation == earliest.reference
+        assert product.batches_by_eta == [earliest, latest]
+
+    def test_prefers_batch_after_eta_change_returns_ok(self):
+        """
+        1. Создаем партии с eta - сегодня и с eta - завтра
+        2. Переносим eta ранней партии на позже
+        3. Размещаем товарную позицию
+        ОР: позиция разместилась в партии, которая теперь самая ранняя
+        """
+        earliest = Batch("speedy-batch", "MINIMALIST-SPOON", 100, eta=today)
+        medium = Batch("normal-batch", "MINIMALIST-SPOON", 100, eta=tomorrow)
+        product = Product(sku="MINIMALIST-SPOON", batches=[earliest, medium])
+        product.allocate(OrderLine("order1", "MINIMALIST-SPOON", 10))
+
+        product.change_batch_eta("speedy-batch", later)
+        allocation = product.allocate(OrderLine("order2", "MINIMALIST-SPOON", 10))
+
+        assert allocation == medium.reference
+        assert product.batches_by_eta == [medium, earliest]
+
+    def test_equal_eta_order_does_not_depend_on_index_rebuild_returns_ok(self):
+        """
+        1. Две партии с одинаковой eta, в self.batches - в обратном порядке reference
+        2. Переносим eta третьей партии на ту же дату (индекс поддерживается вставкой)
+        3. Сравниваем с индексом, перестроенным с нуля
+        ОР: порядок одинаковый, при равных eta - по reference
+        """
+        a = Batch("a-batch", "MINIMALIST-SPOON", 100, eta=tomorrow)
+        b = Batch("b-batch", "MINIMALIST-SPOON", 100, eta=tomorrow)
+        c = Batch("c-batch", "MINIMALIST-SPOON", 100, eta=today)
+        product = Product(sku="MINIMALIST-SPOON", batches=[c, b, a])
+        product.batches_by_eta  # строим индекс до изменения
+
+        product.change_batch_eta("a-batch", tomorrow)
+        product.change_batch_eta("c-batch", tomorrow)
+        rebuilt = Product(sku="MINIMALIST-SPOON", batches=list(product.batches))
+
+        assert product.batches_by_eta == rebuilt.batches_by_eta == [a, b, c]
+
+    def test_replaced_batches_rebuild_indexes_returns_ok(self):
+        """
+        1. Строим индексы продукта, затем заменяем self.batches списком той же длины с другой партией
+        ОР: размещение и поиск по reference видят новые партии
+        """
+        product = Product(sku="MINIMALIST-SPOON", batches=[Batch("old-batch", "MINIMALIST-SPOON", 100, eta=today)])
+        product.allocate(OrderLine("order1", "MINIMALIST-SPOON", 10))
+
+        product.batches = [Batch("new-batch", "MINIMALIST-SPOON", 100, eta=today)]
+        allocation = product.allocate(OrderLine("order2", "MINIMALIST-SPOON", 10))
+        product.change_batch_eta("new-batch", later)
+
+        assert allocation == "new-batch"
+        assert [b.reference for b in product.batches_by_eta] == ["new-batch"]
+
+
+class TestProductAllocateMany:
+    def test_allocate_many_matches_sequential_allocation_returns_ok(self):
+        """
+        1. Создаем две пары одинаковых продуктов с партиями на складе и в пути
+        2. В первый продукт размещаем позиции по одной, во второй - через allocate_many
+        ОР: позиции разместились в те же партии
+        """
+        def make_product():
+            return Product(sku="RETRO-CLOCK", batches=[
+                Batch("shipment-batch", "RETRO-CLOCK", 30, eta=tomorrow),
+                Batch("in-stock-batch", "RETRO-CLOCK", 25, eta=None),
+            ])
+        lines = [OrderLine(f"order{i}", "RETRO-CLOCK", qty) for i, qty in enumerate([10, 10, 10, 3, 20])]
+        sequential, bulk = make_product(), make_product()
+
+        expected = [sequential.allocate(line) for line in lines]
+
+        assert bulk.allocate_many(lines) == expected
+
+    def test_allocate_many_matches_sequential_allocation_with_zero_qty_returns_ok(self):
+        """
+        1. Две пары одинаковых продуктов: ранняя партия заполняется первой позицией полностью
+        2. Следом позиция на 0 шт и еще позиции; в первый продукт - по одной, во второй - через allocate_many
+        ОР: результаты совпадают, позиция на 0 шт, как и в allocate, - в заполненной ранней партии
+        """
+        def make_product():
+            return Product(sku="RETRO-CLOCK", batches=[
+                Batch("in-stock-batch", "RETRO-CLOCK", 10, eta=None),
+                Batch("shipment-batch", "RETRO-CLOCK", 30, eta=tomorrow),
+            ])
+        lines = [OrderLine(f"order{i}", "RETRO-CLOCK", qty) for i, qty in enumerate([10, 0, 5, 0, 40])]
+        sequential, bulk = make_product(), make_product()
+
+        def allocate(line):
+            try:
+                return sequential.allocate(line)
+            except OutOfStock:
+                return OutOfStock
+        expected = [allocate(line) for line in lines]
+        result = [r if isinstance(r, str) else type(r) for r in bulk.allocate_many(lines)]
+
+        assert result == expected
+        assert expected == ["in-stock-batch", "in-stock-batch", "shipment-batch", "in-stock-batch", OutOfStock]
+
+    def test_allocate_many_returns_out_of_stock_for_failed_lines_returns_ok(self):
+        """
+        1. Создаем партию на 10 шт
+        2. Размещаем через allocate_many позиции на 8, 5 и 2 шт
+        ОР: позиция на 5 шт - OutOfStock, остальные размещены; версия увеличилась один раз
+        """
+        batch = Batch("batch1", "SMALL-FORK", 10, eta=today)
+        product = Product(sku="SMALL-FORK", batches=[batch])
+        lines = [
+            OrderLine("order1", "SMALL-FORK", 8),
+            OrderLine("order2", "SMALL-FORK", 5),
+            OrderLine("order3", "SMALL-FORK", 2),
+        ]
+
+        first, second, third = product.allocate_many(lines)
+
+        assert first == third == "batch1"
+        assert isinstance(second, OutOfStock)
+        assert batch.available_quantity == 0
+        assert product.version == 1
+        assert [e.order_id for e in product.events] == ["order1", "order3"]
+
+
 class TestProductDeallocate:
     def test_deallocate_line_in_one_batch_returns_ok(self):
         """
@@ -143,3 +285,141 @@ class TestProductDeallocate:
 
         assert in_stock_batch.available_quantity == 100
         assert shipment_batch.available_quantity == 100
+
+
+class TestProductChangeBatchQuantity:
+    def test_change_quantity_of_batch_by_reference_returns_ok(self):
+        """
+        1. Создаем несколько партий товара
+        2. Меняем кол-во товара в одной из них по reference
+        ОР: изменилось кол-во только в этой партии
+        """
+        in_stock_batch = Batch("in-stock-batch", "RETRO-CLOCK", 100, eta=None)
+        shipment_batch = Batch("shipment-batch", "RETRO-CLOCK", 100, eta=tomorrow)
+        product = Product(sku="RETRO-CLOCK", batches=[in_stock_batch, shipment_batch])
+
+        product.change_batch_quantity("shipment-batch", 50)
+
+        assert in_stock_batch.available_quantity == 100
+        assert shipment_batch.available_quantity == 50
+
+    def test_evicted_line_can_not_be_deallocated_returns_error(self):
+        """
+        1. Создаем партию товара и размещаем в ней позицию
+        2. Отменяем размещение позиции, чтобы построился индекс позиций
+        3. Размещаем позицию снова и уменьшаем кол-во товара в партии до 0
+        4. Пытаемся отменить размещение вытесненной позиции
+        ОР: NoOrderInBatch, позиция больше нигде не размещена
+        """
+        batch = Batch("in-stock-batch", "RETRO-CLOCK", 100, eta=None)
+        product = Product(sku="RETRO-CLOCK", batches=[batch])
+        line = OrderLine("oref", "RETRO-CLOCK", 10)
+        product.allocate(line)
+        product.deallocate(line)
+        product.allocate(line)
+
+        product.change_batch_quantity("in-stock-batch", 0)
+
+        with pytest.raises(NoOrderInBatch):
+            product.deallocate(line)
+
+
+class TestProductArchiveClosedBatches:
+    def test_archives_only_full_batches_before_cutoff_returns_ok(self):
+        """
+        1. Создаем партии: полностью размещенную с прошедшей eta, неполную с прошедшей eta,
+           полностью размещенную на складе (eta=None) и полностью размещенную с будущей eta
+        2. Архивируем закрытые партии с границей - сегодня
+        ОР: убрана только первая партия, версия продукта выросла
+        """
+        yesterday = today - timedelta(days=1)
+        closed = Batch("closed", "LAMP", 10, eta=yesterday)
+        not_full = Batch("not-full", "LAMP", 10, eta=yesterday)
+        warehouse = Batch("warehouse", "LAMP", 10, eta=None)
+        future = Batch("future", "LAMP", 10, eta=tomorrow)
+        for batch, qty in ((closed, 10), (not_full, 5), (warehouse, 10), (future, 10)):
+            batch.allocate(OrderLine(f"order-{batch.reference}", "LAMP", qty))
+        product = Product("LAMP", [closed, not_full, warehouse, future], version=3)
+
+        archived = product.archive_closed_batches(cutoff=today)
+
+        assert archived == [closed]
+        assert [b.reference for b in product.batches] == ["not-full", "warehouse", "future"]
+        assert product.version == 4
+
+    def test_archived_batches_are_not_used_by_aggregate_returns_ok(self):
+        """
+        1. Продукт с закрытой партией и партией на складе; индексы агрегата построены
+        2. Архивируем закрытую партию, меняем кол-во и размещаем позицию
+        ОР: архивная партия недоступна по reference, позиция размещена в оставшейся партии
+        """
+        closed = Batch("closed", "LAMP", 10, eta=today - timedelta(days=30))
+        closed.allocate(OrderLine("o1", "LAMP", 10))
+        product = Product("LAMP", [closed, Batch("warehouse", "LAMP", 10, eta=None)])
+        product.change_batch_quantity("warehouse", 20)
+
+        product.archive_closed_batches(cutoff=today)
+
+        with pytest.raises(KeyError):
+            product.change_batch_quantity("closed", 20)
+        assert product.allocate(OrderLine("o2", "LAMP", 5)) == "warehouse"
+
+    def test_nothing_to_archive_keeps_version_returns_ok(self):
+        """
+        1. Продукт только с партией на складе
+        ОР: ничего не заархивировано, версия не изменилась
+        """
+        product = Product("LAMP", [Batch("warehouse", "LAMP", 10, eta=None)], version=7)
+
+        assert product.archive_closed_batches(cutoff=today) == []
+        assert product.version == 7
+
+
+class TestEvictionPolicies:
+    @staticmethod
+    def make_product_with_lines(*qtys):
+        batch = Batch("in-stock-batch", "RETRO-CLOCK", 100, eta=None)
+        product = Product(sku="RETRO-CLOCK", batches=[batch])
+        for i, qty in enumerate(qtys):
+            product.allocate(OrderLine(f"order{i}", "RETRO-CLOCK", qty))
+        product.events.clear()
+        return product, batch
+
+    def test_largest_first_evicts_fewest_lines_returns_ok(self):
+        """
+        1. Размещаем в партии позиции на 5, 30, 10 и 20 шт
+        2. Уменьшаем партию до 40 шт с политикой LargestFirst
+        ОР: вытеснена одна позиция на 30 шт, событие Deallocated одно
+        """
+        product, batch = self.make_product_with_lines(5, 30, 10, 20)
+
+        product.change_batch_quantity("in-stock-batch", 40, LargestFirstEvictionPolicy())
+
+        assert batch.available_quantity == 5
+        assert product.events == [events.Deallocated("order1", "RETRO-CLOCK", 30)]
+
+    def test_latest_first_evicts_latest_allocations_returns_ok(self):
+        """
+        1. Размещаем в партии позиции на 5, 30, 10 и 20 шт
+        2. Уменьшаем партию до 40 шт с политикой LatestFirst
+        ОР: вытеснены две последние позиции (20 и 10 шт)
+        """
+        product, batch = self.make_product_with_lines(5, 30, 10, 20)
+
+        product.change_batch_quantity("in-stock-batch", 40, LatestFirstEvictionPolicy())
+
+        assert batch.available_quantity == 5
+        assert [e.order_id for e in product.events] == ["order3", "order2"]
+
+    def test_arbitrary_keeps_evicting_until_batch_fits_returns_ok(self):
+        """
+        1. Размещаем в партии позиции на 5, 30, 10 и 20 шт
+        2. Уменьшаем партию до 40 шт с прежней политикой
+        ОР: размещенное кол-во не превышает размер партии, по событию на каждую вытесненную позицию
+        """
+        product, batch = self.make_product_with_lines(5, 30, 10, 20)
+
+        product.change_batch_quantity("in-stock-batch", 40, ArbitraryEvictionPolicy())
+
+        assert batch.available_quantity >= 0
+        assert sum(e.qty for e in product.events) == 65 - batch.allocated_quantity
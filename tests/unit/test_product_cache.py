@@ -0,0 +1,57 @@
+from src.allocation.adapters.repository import ProductCache
+from src.allocation.models.domain import Batch, OrderLine, Product
+
+
+def make_product(sku, batches=1, version=1):
+    return Product(sku=sku, batches=[Batch(f"{sku}-{i}", sku, 100, eta=None) for i in range(batches)], version=version)
+
+
+class TestProductCache:
+    def test_returns_product_only_for_same_version_returns_ok(self):
+        """
+        1. Кладем в кэш продукт версии 1
+        2. Запрашиваем его с версией 1, затем с версией 2
+        ОР: первый запрос - попадание, второй - промах
+        """
+        cache = ProductCache()
+        product = make_product("sku1")
+        cache.put(product)
+
+        assert cache.get("sku1", 1) is product
+        assert cache.get("sku1", 2) is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_evicts_least_recently_used_product_returns_ok(self):
+        """
+        1. Кэш на 2 продукта, кладем sku1 и sku2
+        2. Обращаемся к sku1, кладем sku3
+        ОР: вытеснен sku2, к которому дольше всего не обращались
+        """
+        cache = ProductCache(max_products=2)
+        cache.put(make_product("sku1"))
+        cache.put(make_product("sku2"))
+        cache.get("sku1", 1)
+        cache.put(make_product("sku3"))
+
+        assert cache.get("sku2", 1) is None
+        assert cache.get("sku1", 1) is not None
+        assert cache.get("sku3", 1) is not None
+        assert cache.evictions == 1
+
+    def test_evicts_by_weight_returns_ok(self):
+        """
+        1. Кэш с весом 10: продукт с одной партией и двумя размещениями весит 4
+        2. Кладем три таких продукта
+        ОР: в кэше остаются два последних, вес не превышает ограничение
+        """
+        cache = ProductCache(max_weight=10)
+        for sku in ("sku1", "sku2", "sku3"):
+            product = make_product(sku)
+            product.allocate(OrderLine("o1", sku, 1))
+            product.allocate(OrderLine("o2", sku, 1))
+            cache.put(product)
+
+        assert cache.stats()["size"] == 2
+        assert cache.stats()["weight"] == 8
+        assert cache.get("sku1", 3) is None